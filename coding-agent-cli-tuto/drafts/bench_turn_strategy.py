@@ -0,0 +1,106 @@
+"""
+Benchmark the agent turn strategies of main_v2_2.py against an OpenAI compatible endpoint (normally mock_openai_server.py).
+
+- split: one call with tool_choice "none" for the reasoning, then a forced tool_choice "required" call that re-sends the whole conversation.
+- single: one call with tool_choice "auto", the forced call is only a fallback when the model did not call any tool.
+
+Tools are not actually run, each tool result is a canned text (with an optional simulated tool latency), so the numbers
+are about the LLM round trips of the orchestration only. Report turns per minute, requests per turn and prompt tokens sent.
+
+Example:
+    python mock_openai_server.py --conversation ~/.minicode/debug_dump_20250101_120000.json --loop --ttft-ms 400 --tokens-per-second 60
+    python bench_turn_strategy.py --base-url http://127.0.0.1:8099/v1 --turns 20 --sessions 4
+"""
+
+import argparse
+import json
+import statistics
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from openai import OpenAI
+
+BENCH_TOOLS = [
+    { "type": "function", "function": { "name": name, "description": f"Benchmark stand-in for {name}.", "parameters": { "type": "object", "properties": { "command": { "type": "string" } }, "required": ["command"], "additionalProperties": False } } }
+    for name in ("execute_command_simple", "read_single_file_enriched", "write_files_unified_diff", "signal_agent_completed")
+]
+BENCH_TOOL_RESULT = "total 12\ndrwxr-xr-x 2 pn pn 4096 .\n-rw-r--r-- 1 pn pn  220 main.py\n--\n[system] Exited with code 0."
+
+
+def call_llm(cli, model, messages, tool_choice, stats):
+    res = cli.chat.completions.create(model=model, messages=messages, tools=BENCH_TOOLS, parallel_tool_calls=True, tool_choice=tool_choice, stream=False)
+    stats["requests"] += 1
+    if res.usage:
+        stats["prompt_tokens"] += res.usage.prompt_tokens
+    return res
+
+def run_turn(cli, model, conversation, strategy, stats):
+    # Same logic as main_agent_loop in main_v2_2.py
+    if strategy == "single":
+        res = call_llm(cli, model, conversation, "auto", stats)
+    else:
+        res = call_llm(cli, model, conversation, "none", stats)
+    conversation.append(res.choices[0].message.model_dump())
+    tool_calls = res.choices[0].message.tool_calls
+    if not tool_calls:
+        res2 = call_llm(cli, model, conversation, "required", stats)
+        tool_calls = res2.choices[0].message.tool_calls or []
+        conversation[-1]["tool_calls"] = [ x.model_dump() for x in tool_calls ]
+    return tool_calls
+
+def run_session(cli, model, strategy, n_turns, tool_seconds):
+    stats = { "requests": 0, "prompt_tokens": 0, "turn_seconds": [] }
+    conversation = [
+        { "role": "system", "content": "You are a fully autonomous coding agent. (benchmark)" },
+        { "role": "user", "content": "Create a minimal fullstack todo app. (benchmark)" },
+    ]
+    for _ in range(n_turns):
+        start_time = time.perf_counter()
+        tool_calls = run_turn(cli, model, conversation, strategy, stats)
+        for tool_call in tool_calls:
+            time.sleep(tool_seconds)
+            conversation.append({ "role": "tool", "tool_call_id": tool_call.id, "content": BENCH_TOOL_RESULT })
+        stats["turn_seconds"].append(time.perf_counter() - start_time)
+    return stats
+
+def bench_strategy(cli, model, strategy, n_turns, n_sessions, tool_seconds):
+    start_time = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=n_sessions) as executor:
+        all_stats = list(executor.map(lambda _: run_session(cli, model, strategy, n_turns, tool_seconds), range(n_sessions)))
+    elapsed = time.perf_counter() - start_time
+    turn_seconds = [x for stats in all_stats for x in stats["turn_seconds"]]
+    n_total_turns = len(turn_seconds)
+    return {
+        "strategy": strategy,
+        "sessions": n_sessions,
+        "turns": n_total_turns,
+        "seconds": round(elapsed, 2),
+        "turns_per_minute": round(n_total_turns / elapsed * 60, 1),
+        "requests_per_turn": round(sum(stats["requests"] for stats in all_stats) / n_total_turns, 2),
+        "prompt_tokens_per_turn": round(sum(stats["prompt_tokens"] for stats in all_stats) / n_total_turns),
+        "turn_p50_seconds": round(statistics.median(turn_seconds), 3),
+        "turn_max_seconds": round(max(turn_seconds), 3),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare the split and single turn strategies, in turns per minute.")
+    parser.add_argument("--base-url", default="http://127.0.0.1:8099/v1")
+    parser.add_argument("--api-key", default="mock")
+    parser.add_argument("--model", default="mock")
+    parser.add_argument("--turns", type=int, default=10, help="Turns per session.")
+    parser.add_argument("--sessions", type=int, default=1, help="Concurrent sessions.")
+    parser.add_argument("--tool-seconds", type=float, default=0.0, help="Simulated latency of each tool call.")
+    parser.add_argument("--strategies", nargs="+", default=["split", "single"], choices=["split", "single"])
+    args = parser.parse_args()
+
+    cli = OpenAI(base_url=args.base_url, api_key=args.api_key, max_retries=0)
+    results = [bench_strategy(cli, args.model, strategy, args.turns, args.sessions, args.tool_seconds) for strategy in args.strategies]
+    for result in results:
+        print(json.dumps(result))
+    if len(results) == 2:
+        print(f"Speedup of {results[1]['strategy']} over {results[0]['strategy']}: {results[1]['turns_per_minute'] / results[0]['turns_per_minute']:.2f}x turns per minute")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,91 @@
+"""
+Frontend renderer for the coding agent CLI
+
+Rendering (syntax highlight in particular) happens on a dedicated UI thread, so that the agent loop never wait on the terminal.
+Large payloads are cut down to their head and tail before being displayed.
+"""
+
+import queue
+import threading
+
+from rich.panel import Panel
+from rich.text import Text
+
+RENDER_QUEUE_SIZE = 256
+RENDER_HEAD_LINES = 200
+RENDER_TAIL_LINES = 20
+RENDER_MAX_LINE_CHARS = 500
+RENDER_MAX_PRETTY_STRING_CHARS = 300
+
+def clip_lines(content, head_lines=RENDER_HEAD_LINES, tail_lines=RENDER_TAIL_LINES):
+    """
+    Return (head, n_hidden_lines, tail). Tail is empty if nothing is hidden.
+    """
+    lines = content.splitlines(keepends=True)
+    if len(lines) <= head_lines + tail_lines:
+        return content, 0, ""
+    return "".join(lines[:head_lines]), len(lines) - head_lines - tail_lines, "".join(lines[-tail_lines:])
+
+def clip_text(content):
+    head, n_hidden, tail = clip_lines(content)
+    clipped_lines = []
+    for line in (head + (f"\n[... {n_hidden} lines not shown ...]\n" + tail if n_hidden else "")).splitlines():
+        if len(line) > RENDER_MAX_LINE_CHARS:
+            line = line[:RENDER_MAX_LINE_CHARS] + f" [... {len(line) - RENDER_MAX_LINE_CHARS} chars not shown]"
+        clipped_lines.append(line)
+    return "\n".join(clipped_lines)
+
+def clip_pretty(obj):
+    if isinstance(obj, str) and len(obj) > RENDER_MAX_PRETTY_STRING_CHARS:
+        return obj[:RENDER_MAX_PRETTY_STRING_CHARS] + f" [... {len(obj) - RENDER_MAX_PRETTY_STRING_CHARS} chars not shown]"
+    if isinstance(obj, dict):
+        return { k: clip_pretty(v) for k, v in obj.items() }
+    if isinstance(obj, list):
+        return [clip_pretty(x) for x in obj]
+    return obj
+
+def text_panel(content, title):
+    # Plain text, not markup: tool output may contain [brackets]
+    return Panel(Text(clip_text(str(content))), title=title)
+
+class FrontendRenderer:
+    def __init__(self, console, queue_size=RENDER_QUEUE_SIZE):
+        self.console = console
+        self.queue = queue.Queue(maxsize=queue_size)
+        self.n_dropped = 0
+        self.thread = threading.Thread(target=self._run, name="frontend-renderer", daemon=True)
+
+    def start(self):
+        self.thread.start()
+
+    def submit(self, render_fn):
+        # render_fn(console) is called on the UI thread. Never block the caller, drop instead if the UI is that far behind
+        try:
+            self.queue.put_nowait(render_fn)
+        except queue.Full:
+            self.n_dropped += 1
+
+    def print(self, renderable):
+        self.submit(lambda console: console.print(renderable))
+
+    def _run(self):
+        while True:
+            render_fn = self.queue.get()
+            try:
+                if render_fn is None:
+                    return
+                if self.n_dropped:
+                    n_dropped, self.n_dropped = self.n_dropped, 0
+                    self.console.print(f"[dim]({n_dropped} outputs not shown because the display could not keep up)")
+                render_fn(self.console)
+            except Exception:
+                self.console.print_exception()
+            finally:
+                self.queue.task_done()
+
+    def flush(self):
+        self.queue.join()
+
+    def stop(self):
+        self.queue.put(None)
+        self.thread.join()
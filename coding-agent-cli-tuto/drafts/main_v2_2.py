@@ -1,7 +1,6 @@
 from rich.console import Console
 from rich.syntax import Syntax
 
-from rich import print as richprint
 from rich.panel import Panel
 
 from datetime import datetime
@@ -13,6 +12,74 @@ console = Console(record=True)
 # Print welcome banner
 console.print(text2art("Mini Code", font="tarty1"), style="cyan3")
 
+"""
+Frontend renderer
+
+Rendering happens on a dedicated UI thread, see frontend_renderer.py.
+"""
+
+from rich.console import Group
+from rich.text import Text
+
+from frontend_renderer import FrontendRenderer, clip_lines, clip_text, clip_pretty, text_panel
+
+renderer = FrontendRenderer(console=console)
+renderer.start()
+
+
+"""
+Session log recorder
+
+Instead of keeping every rendered segment of the session in memory until save_html at the end, periodically export what
+the console recorded so far as a HTML fragment (clearing the record buffer), and append it to the log file.
+"""
+
+import threading
+
+from rich.console import CONSOLE_HTML_FORMAT
+from rich.terminal_theme import DEFAULT_TERMINAL_THEME
+
+SESSION_LOG_FLUSH_SECONDS = 2
+
+class StreamingSessionRecorder:
+    def __init__(self, console, path, theme=DEFAULT_TERMINAL_THEME, flush_seconds=SESSION_LOG_FLUSH_SECONDS):
+        self.console = console
+        self.theme = theme
+        self.flush_seconds = flush_seconds
+        self.lock = threading.Lock()
+        self.stopped = threading.Event()
+        # Split the usual HTML page around the code, so that fragments can be streamed in between
+        code_marker = "\0code\0"
+        page = CONSOLE_HTML_FORMAT.format(code=code_marker, stylesheet="", foreground=theme.foreground_color.hex, background=theme.background_color.hex)
+        self.page_head, self.page_tail = page.split(code_marker)
+        self.file = open(path, "w", encoding="utf-8")
+        self.file.write(self.page_head)
+        self.thread = threading.Thread(target=self._run, name="session-recorder", daemon=True)
+
+    def start(self):
+        self.thread.start()
+
+    def _run(self):
+        while not self.stopped.wait(self.flush_seconds):
+            self.flush()
+
+    def flush(self):
+        with self.lock:
+            if self.file.closed:
+                return
+            fragment = self.console.export_html(theme=self.theme, clear=True, code_format="{code}", inline_styles=True)
+            if fragment:
+                self.file.write(fragment)
+                self.file.flush()
+
+    def close(self):
+        self.stopped.set()
+        self.thread.join()
+        self.flush()
+        with self.lock:
+            self.file.write(self.page_tail)
+            self.file.close()
+
 """
 Tool registry
 """
@@ -127,6 +194,27 @@ class DockerCodeInterpreterSession:
         else:
             return f"{result.output.decode("utf-8")} "
     
+    def stream_single_command(self, command : str, out_file, work_dir = None, chunk_callback = None):
+        """
+        Like run_single_command, but stream stdout into out_file as it comes instead of buffering it all in memory.
+        Return (exit code, stderr).
+        """
+        if work_dir is None:
+            my_work_dir = self.default_work_dir
+        else:
+            my_work_dir = work_dir
+        exec_id = self.client.api.exec_create(self.container.id, command, workdir=my_work_dir)["Id"]
+        stderr_chunks = []
+        for stdout_chunk, stderr_chunk in self.client.api.exec_start(exec_id, stream=True, demux=True):
+            if stdout_chunk:
+                out_file.write(stdout_chunk)
+                if chunk_callback is not None:
+                    chunk_callback(stdout_chunk)
+            if stderr_chunk:
+                stderr_chunks.append(stderr_chunk)
+        exit_code = self.client.api.exec_inspect(exec_id)["ExitCode"]
+        return exit_code, b"".join(stderr_chunks).decode("utf-8", errors="replace")
+    
     def stop_session(self):
         self.container.stop()
 
@@ -212,6 +300,11 @@ tools:
 7. poll_interactive_command_shell_output
 8. signal_agent_completed
 9. report_live_preview_url
+10. search_shell_log
+11. read_files_batch
+12. search_code
+13. outline_file
+14. find_symbol
 """
 
 
@@ -222,54 +315,622 @@ Define the tool fns and register
 import tarfile
 import io
 import time
+import re
 import tempfile
+import itertools
+import hashlib
+import difflib
+import glob
+import shutil
+from concurrent.futures import ThreadPoolExecutor
 
 import pygments
-from pygments.lexers import guess_lexer
-
-def rich_print_source_code(console, content, lang=None):
-    # Autodetect language
-    if lang is None:
-        try:
-            lexer = guess_lexer(content)
-            console.log(lexer.aliases)
-            lang = lexer.aliases[0]
-        except pygments.util.ClassNotFound:
-            console.log("not found")
-            lang = "text"
-    console.log(lang)
-    syntax = Syntax(content, lang, theme="ansi_light", background_color="white", line_numbers=True)
-    console.print(syntax)
-
-def read_single_file_enriched(filepath, uniform_format=True):
-    with open(os.path.join(USER_HOME_DIR, filepath), 'r') as file:
-        lines = file.readlines()
-
+from pygments.lexers import guess_lexer, get_lexer_for_filename
+from functools import lru_cache
+
+LEXER_GUESS_PREFIX_CHARS = 4096
+LEXER_GUESS_MAX_CHARS = 256 * 1024
+DIFF_PREFIXES = ("diff --git", "--- ", "+++ ", "@@ ", "Index: ")
+
+@lru_cache(maxsize=256)
+def lexer_for_extension(extension_or_name):
+    # Unknown extensions are cached too, as None
+    try:
+        return get_lexer_for_filename(extension_or_name)
+    except pygments.util.ClassNotFound:
+        return None
+
+def lexer_for_filename(filepath):
+    # Keyed by extension so that all *.py etc share one cache entry; files like Makefile are keyed by name
+    base_name = os.path.basename(filepath)
+    extension = os.path.splitext(base_name)[1].lower()
+    return lexer_for_extension(f"file{extension}" if extension else base_name)
+
+@lru_cache(maxsize=256)
+def guess_lexer_alias(content_prefix):
+    try:
+        return guess_lexer(content_prefix).aliases[0]
+    except pygments.util.ClassNotFound:
+        return "text"
+
+def resolve_lexer_alias(content, filepath=None):
+    if filepath is not None:
+        lexer = lexer_for_filename(filepath)
+        if lexer is not None:
+            return lexer.aliases[0]
+    # guess_lexer is often wrong on diff, and diff is easy to spot
+    if content.startswith(DIFF_PREFIXES):
+        return "diff"
+    # Running every lexer's analyse_text over a huge content is too slow
+    if len(content) > LEXER_GUESS_MAX_CHARS:
+        return "text"
+    return guess_lexer_alias(content[:LEXER_GUESS_PREFIX_CHARS])
+
+def rich_print_source_code(console, content, lang=None, start_line=1, filepath=None):
+    # Only the visible part gets highlighted, and it all happens on the UI thread
+    head, n_hidden, tail = clip_lines(content)
+    def render(console):
+        my_lang = lang if lang is not None else resolve_lexer_alias(head, filepath)
+        console.log(my_lang)
+        if not n_hidden:
+            console.print(Syntax(head, my_lang, theme="ansi_light", background_color="white", line_numbers=True, start_line=start_line))
+            return
+        syntax = Syntax(head.rstrip("\n"), my_lang, theme="ansi_light", background_color="white", line_numbers=True, start_line=start_line)
+        tail_start_line = start_line + len(head.splitlines()) + n_hidden
+        tail_syntax = Syntax(tail, my_lang, theme="ansi_light", background_color="white", line_numbers=True, start_line=tail_start_line)
+        console.print(Group(syntax, Text(f"[... {n_hidden} lines not shown ...]", style="dim"), tail_syntax))
+    renderer.submit(render)
+
+READ_FULL_MAX_BYTES = 256 * 1024
+READ_DEFAULT_MAX_LINES = 2000
+READ_OUTLINE_PREVIEW_LINES = 40
+READ_OUTLINE_MAX_LINE_CHARS = 300
+READ_STREAM_CHUNK_BYTES = 1024 * 1024
+
+def resolve_home_path(path):
+    # Tool paths are relative to the home dir, and must stay in it (absolute paths, .. and symlinks included)
+    home_dir = os.path.realpath(LOCAL_USER_HOME_DIR)
+    real_path = os.path.realpath(os.path.join(LOCAL_USER_HOME_DIR, path))
+    if os.path.commonpath([home_dir, real_path]) != home_dir:
+        raise ValueError(f"Path {path} points outside of home directory.")
+    return real_path
+
+def count_lines_streaming(path):
+    # Same counting rule as readlines(), but without holding the whole file in memory
+    n_lines = 0
+    last_chunk = b""
+    with open(path, "rb") as f:
+        while chunk := f.read(READ_STREAM_CHUNK_BYTES):
+            n_lines += chunk.count(b"\n")
+            last_chunk = chunk
+    if last_chunk and not last_chunk.endswith(b"\n"):
+        n_lines += 1
+    return n_lines
+
+def read_line_range(path, start_line, end_line):
+    with open(path, "r", encoding="utf-8", errors="replace") as file:
+        return list(itertools.islice(file, start_line - 1, end_line))
+
+def format_numbered_lines(lines, start_line, total_lines, uniform_format=True):
+    # Width is based on the whole file, so that a partial view lines up with the full file view
     if uniform_format:
-        max_line_number = len(lines)
-        line_number_format = f"{{:0{len(str(max_line_number))}}}"
+        line_number_format = f"{{:0{len(str(total_lines))}}}"
     else:
         line_number_format = "{}"
-
     enriched_content = []
-    original_content = []
-    for i, line in enumerate(lines, start=1):
+    for i, line in enumerate(lines, start=start_line):
         line_number = line_number_format.format(i)
         enriched_content.append(f"{line_number} |{line}")
-        original_content.append(line)
-    
+    return "".join(enriched_content)
+
+def outline_large_file(filepath, open_path, file_size, uniform_format=True):
+    total_lines = count_lines_streaming(open_path)
+    preview = []
+    for line in read_line_range(open_path, 1, READ_OUTLINE_PREVIEW_LINES):
+        if len(line) > READ_OUTLINE_MAX_LINE_CHARS:
+            line = line[:READ_OUTLINE_MAX_LINE_CHARS] + " [...]\n"
+        preview.append(line)
+    header_str = f"File {filepath} is too large to read in full ({file_size} bytes, {total_lines} lines). Showing the first {len(preview)} lines only, use start_line/end_line to read the part you need.\n"
+    outline_str = ""
+    symbols = symbol_index.get_symbols(filepath)
+    if symbols:
+        outline_str = "--\nDefinitions in this file:\n" + format_symbol_outline(symbols) + "\n"
+    return header_str + format_numbered_lines(preview, 1, total_lines, uniform_format) + outline_str
+
+# Updated by the main agent loop
+agent_turn_no = 0
+
+class ReadCache:
+    """
+    Remember which part of which file version the agent has already seen in this session,
+    so that re-reads can be answered with a short note or a diff instead of the full content.
+    """
+    def __init__(self):
+        self.digests = {}
+        self.entries = {}
+        self.forgotten_turns = set()
+
+    def fingerprint(self, filepath, open_path):
+        st = os.stat(open_path)
+        stat_key = (st.st_mtime_ns, st.st_size)
+        cached = self.digests.get(filepath)
+        if cached is not None and cached[0] == stat_key:
+            return cached[1]
+        with open(open_path, "rb") as f:
+            digest = hashlib.file_digest(f, "sha256").hexdigest()
+        self.digests[filepath] = (stat_key, digest)
+        return digest
+
+    def invalidate_changes(self, changes):
+        # Stat key alone can miss a rewrite within the mtime granularity, so forget the digest of anything touched.
+        # The seen views are kept, they are keyed by digest anyway and needed to diff against.
+        for _, rel_path in changes:
+            rel_path = os.path.normpath(rel_path)
+            for filepath in list(self.digests):
+                normalized = os.path.normpath(filepath)
+                if normalized == rel_path or normalized.startswith(rel_path + os.sep):
+                    self.digests.pop(filepath, None)
+
+    def seen_unchanged(self, filepath, digest, view):
+        # Return the turn in which this exact view was sent, if the file did not change since
+        entry = self.entries.get(filepath)
+        if entry is None or entry["digest"] != digest:
+            return None
+        return entry["views"].get(view)
+
+    def diff_against_seen(self, filepath, digest, lines):
+        # Only possible when the agent has seen the full file before
+        entry = self.entries.get(filepath)
+        if entry is None or entry["digest"] == digest or entry["lines"] is None:
+            return None
+        diff = "".join(difflib.unified_diff(entry["lines"], lines, fromfile=f"a/{filepath}", tofile=f"b/{filepath}"))
+        return entry["turn"], diff
+
+    def remember(self, filepath, digest, view, lines=None):
+        entry = self.entries.get(filepath)
+        if entry is None or entry["digest"] != digest:
+            entry = { "digest": digest, "views": {}, "lines": None, "turn": agent_turn_no }
+            self.entries[filepath] = entry
+        entry["views"][view] = agent_turn_no
+        if lines is not None:
+            entry["lines"] = lines
+            entry["turn"] = agent_turn_no
+
+    def forget_turn(self, turn):
+        # What was read in that turn is no longer in the context sent to the LLM (elided), so never refer back to it.
+        # All reads of the turn are forgotten, worst case a file still in context is sent again in full.
+        # Once elided a turn stays elided (every later request is longer), so each turn only needs this once.
+        if turn in self.forgotten_turns:
+            return
+        self.forgotten_turns.add(turn)
+        for filepath, entry in list(self.entries.items()):
+            entry["views"] = { view: view_turn for view, view_turn in entry["views"].items() if view_turn != turn }
+            if entry["turn"] == turn:
+                entry["lines"] = None
+            if not entry["views"] and entry["lines"] is None:
+                del self.entries[filepath]
+
+read_cache = ReadCache()
+
+def read_file_enriched_core(filepath, start_line=None, end_line=None, max_lines=None, refresh=False, uniform_format=True):
+    """
+    Return the tool result string, plus what to display in the frontend as (content, lang, start_line) or None.
+    """
+    open_path = resolve_home_path(filepath)
+    first_line = max(start_line or 1, 1)
+    if end_line is not None and end_line < first_line:
+        return f"[system] Invalid line range {first_line}-{end_line}: end_line must be at least start_line.", None
+    file_size = os.path.getsize(open_path)
+    is_ranged = start_line is not None or end_line is not None
+    if not is_ranged and file_size > READ_FULL_MAX_BYTES:
+        return outline_large_file(filepath, open_path, file_size, uniform_format), None
+
+    total_lines = count_lines_streaming(open_path)
+    if total_lines == 0:
+        return f"[system] {filepath} is empty.", None
+    last_line = min(end_line or total_lines, total_lines)
+    if first_line > total_lines:
+        return f"[system] {filepath} only has {total_lines} lines, cannot read from line {first_line}.", None
+    line_limit = max_lines or READ_DEFAULT_MAX_LINES
+    is_truncated = last_line - first_line + 1 > line_limit
+    if is_truncated:
+        last_line = first_line + line_limit - 1
+    is_full_view = first_line == 1 and last_line == total_lines
+    view = (first_line, last_line)
+
+    digest = read_cache.fingerprint(filepath, open_path)
+    if not refresh:
+        seen_turn = read_cache.seen_unchanged(filepath, digest, view)
+        if seen_turn is not None:
+            return f"[system] {filepath} (lines {first_line}-{last_line}) is unchanged since you read it in turn {seen_turn}, refer to that tool result. Set refresh to true if you really need the content again.", None
+
+    lines = read_line_range(open_path, first_line, last_line)
+    enriched_content = format_numbered_lines(lines, first_line, total_lines, uniform_format)
+
+    if is_full_view and not refresh:
+        seen = read_cache.diff_against_seen(filepath, digest, lines)
+        # Only worth it if the diff is substantially smaller than the full content
+        if seen is not None and len(seen[1]) < len(enriched_content) // 2:
+            seen_turn, diff = seen
+            read_cache.remember(filepath, digest, view, lines)
+            return f"[system] {filepath} has changed since you read it in turn {seen_turn}. Diff against that version:\n{diff}", (diff, "diff", 1)
+
+    read_cache.remember(filepath, digest, view, lines if is_full_view else None)
+
+    if is_full_view:
+        header_str = f"Content of {filepath}:\n"
+    else:
+        header_str = f"Content of {filepath} (lines {first_line}-{last_line} of {total_lines}):\n"
+    if is_truncated:
+        if not enriched_content.endswith("\n"):
+            enriched_content += "\n"
+        enriched_content += f"--\n[system] Output truncated at line {last_line} of {total_lines}. Call again with start_line={last_line + 1} to continue.\n"
+    return header_str + enriched_content, ("".join(lines), None, first_line)
+
+def read_single_file_enriched(filepath, start_line=None, end_line=None, max_lines=None, refresh=False, uniform_format=True):
+    result, preview = read_file_enriched_core(filepath, start_line=start_line, end_line=end_line, max_lines=max_lines, refresh=refresh, uniform_format=uniform_format)
     # Frontend hook
-    rich_print_source_code(console=console, content="".join(original_content))
+    if preview is not None:
+        preview_content, preview_lang, preview_start_line = preview
+        rich_print_source_code(console=console, content=preview_content, lang=preview_lang, start_line=preview_start_line, filepath=filepath)
+    return result
+
+READ_BATCH_MAX_BYTES = 128 * 1024
+READ_BATCH_MAX_FILES = 50
+READ_BATCH_WORKERS = 8
+
+def expand_read_batch_paths(paths):
+    expanded = []
+    for path in paths:
+        if glob.has_magic(path):
+            matches = sorted(glob.glob(path, root_dir=LOCAL_USER_HOME_DIR, recursive=True))
+        else:
+            matches = [path]
+        for match in matches:
+            real_path = resolve_home_path(match)
+            if os.path.isdir(real_path) or match in expanded:
+                continue
+            expanded.append(match)
+    return expanded
+
+def read_files_batch(paths):
+    filepaths = expand_read_batch_paths(paths)
+    if not filepaths:
+        return f"No file matched {paths}."
+    notes = []
+    if len(filepaths) > READ_BATCH_MAX_FILES:
+        notes.append(f"[system] Matched {len(filepaths)} files, only the first {READ_BATCH_MAX_FILES} are considered. Use more specific paths/globs.")
+        filepaths = filepaths[:READ_BATCH_MAX_FILES]
+
+    # Decide upfront which files fit the budget, so that skipped files are neither read nor marked as seen.
+    # Files up to the single read size limit are returned in full and cost their size, larger ones only cost an outline.
+    selected = []
+    budget_left = READ_BATCH_MAX_BYTES
+    for filepath in filepaths:
+        open_path = os.path.join(LOCAL_USER_HOME_DIR, filepath)
+        if not os.path.isfile(open_path):
+            notes.append(f"[system] {filepath}: file not found.")
+            continue
+        size = os.path.getsize(open_path)
+        cost = size if size <= READ_FULL_MAX_BYTES else READ_OUTLINE_PREVIEW_LINES * READ_OUTLINE_MAX_LINE_CHARS
+        if cost > budget_left:
+            notes.append(f"[system] {filepath}: skipped, total size budget of {READ_BATCH_MAX_BYTES} bytes exhausted. Read it in a separate call.")
+            continue
+        budget_left -= cost
+        selected.append(filepath)
+
+    def read_one(filepath):
+        # One unreadable file (permission, deleted meanwhile, ...) should not fail the whole batch
+        try:
+            return read_file_enriched_core(filepath)[0]
+        except Exception as e:
+            return f"[system] {filepath}: error reading file: {e.__class__.__name__}: {e}"
+
+    with ThreadPoolExecutor(max_workers=READ_BATCH_WORKERS) as executor:
+        results = list(executor.map(read_one, selected))
+
+    # Frontend hook: one compact summary instead of one syntax panel per file
+    renderer.print(Panel("\n".join(selected + notes), title=f"Batch read of {len(selected)} files"))
+    return "\n".join(results + notes)
+
+"""
+Unified diff patch engine
+
+Parse and apply unified diff in-process directly onto the bind mounted files, instead of `git apply` inside the container.
+LLM often get the line numbers (and sometimes whitespace) slightly wrong, so hunks are located by their context
+with a search around the expected position, similar to `patch` fuzz.
+"""
+
+HUNK_HEADER_RE = re.compile(r"^@@ -(\d+)(?:,(\d+))? \+(\d+)(?:,(\d+))? @@")
+PATCH_MAX_CONTEXT_TRIM = 2
+
+class UnsupportedPatchError(ValueError):
+    pass
+
+# Temp files are created 0600, new files get the usual mode instead (os.umask can only be read by setting it)
+PATCH_UMASK = os.umask(0o022)
+os.umask(PATCH_UMASK)
+PATCH_NEW_FILE_MODE = 0o666 & ~PATCH_UMASK
+
+def write_patched_file(target, content, original_stat):
+    """
+    Atomically replace/create target. Rewritten files keep their mode and owner, new files take the owner of their directory
+    (the bind mount is shared with the container user, which may not be the host user).
+    """
+    owner_stat = original_stat or os.stat(os.path.dirname(target))
+    with tempfile.NamedTemporaryFile(mode="w", encoding="utf-8", newline="", dir=os.path.dirname(target), delete=False) as tmp_file:
+        tmp_file.write(content)
+    try:
+        if original_stat is not None:
+            shutil.copymode(target, tmp_file.name)
+        else:
+            os.chmod(tmp_file.name, PATCH_NEW_FILE_MODE)
+        try:
+            os.chown(tmp_file.name, owner_stat.st_uid, owner_stat.st_gid)
+        except PermissionError:
+            if original_stat is not None:
+                # Not allowed to give the file away: overwrite in place instead, which keeps the owner (but is not atomic)
+                os.remove(tmp_file.name)
+                with open(target, "w", encoding="utf-8", newline="") as f:
+                    f.write(content)
+                return
+        os.replace(tmp_file.name, target)
+    except BaseException:
+        if os.path.exists(tmp_file.name):
+            os.remove(tmp_file.name)
+        raise
+
+@dataclass
+class DiffHunk:
+    old_start : int
+    lines : list # of (tag, text), tag is one of " ", "-", "+"
+
+    def old_lines(self):
+        return [text for tag, text in self.lines if tag != "+"]
+
+@dataclass
+class FilePatch:
+    old_path : str | None
+    new_path : str | None
+    hunks : list
+
+def parse_patch_path(header_line):
+    path = header_line[4:].rstrip("\r\n").split("\t")[0].strip()
+    if path == "/dev/null":
+        return None
+    if path.startswith("a/") or path.startswith("b/"):
+        path = path[2:]
+    return path
+
+def parse_unified_diff(diff_text):
+    lines = diff_text.splitlines(keepends=True)
+    file_patches = []
+    current_file = None
+    current_hunk = None
+    i = 0
+    while i < len(lines):
+        line = lines[i]
+        if line.startswith("GIT binary patch") or line.startswith("Binary files ") or line.startswith("rename from ") or line.startswith("copy from "):
+            raise UnsupportedPatchError(f"Unsupported patch construct: {line.strip()}")
+        if line.startswith("--- ") and i + 1 < len(lines) and lines[i + 1].startswith("+++ "):
+            current_file = FilePatch(old_path=parse_patch_path(line), new_path=parse_patch_path(lines[i + 1]), hunks=[])
+            file_patches.append(current_file)
+            current_hunk = None
+            i += 2
+            continue
+        m = HUNK_HEADER_RE.match(line)
+        if m:
+            if current_file is None:
+                raise ValueError(f"Hunk header without file header at line {i + 1} of the patch.")
+            # The line counts in the header are not trusted, LLM often get them wrong
+            current_hunk = DiffHunk(old_start=int(m.group(1)), lines=[])
+            current_file.hunks.append(current_hunk)
+        elif current_hunk is not None and line[:1] in (" ", "-", "+"):
+            current_hunk.lines.append((line[0], line[1:]))
+        elif current_hunk is not None and line.startswith("\\"):
+            # "\ No newline at end of file" applies to the previous line
+            if current_hunk.lines:
+                tag, text = current_hunk.lines[-1]
+                current_hunk.lines[-1] = (tag, text.rstrip("\r\n"))
+        elif current_hunk is not None and line.strip() == "":
+            # Blank context line where the leading space got lost
+            current_hunk.lines.append((" ", line))
+        else:
+            # Anything else (diff --git, index, mode lines, commentary) ends the current hunk
+            current_hunk = None
+        i += 1
+    for file_patch in file_patches:
+        for hunk in file_patch.hunks:
+            while hunk.lines and hunk.lines[-1][0] == " " and hunk.lines[-1][1].strip() == "":
+                hunk.lines.pop()
+    return [file_patch for file_patch in file_patches if file_patch.hunks or file_patch.old_path is None]
+
+def normalize_whitespace(text):
+    return " ".join(text.split())
+
+def find_hunk_position(source_lines, old_lines, expected, min_pos, normalize):
+    target = [normalize(x) for x in old_lines]
+    n = len(target)
+    max_pos = len(source_lines) - n
+    if max_pos < min_pos:
+        return None
+    expected = min(max(expected, min_pos), max_pos)
+    # Search outward from the expected position, nearest match wins
+    for distance in range(0, max(expected - min_pos, max_pos - expected) + 1):
+        for pos in (expected + distance, expected - distance):
+            if min_pos <= pos <= max_pos and all(normalize(source_lines[pos + k]) == target[k] for k in range(n)):
+                return pos
+    return None
+
+def trim_hunk_context(hunk_lines, n_leading, n_trailing):
+    # Only drop context lines, never the actual changes, and always keep at least one context line on each side
+    leading = list(itertools.takewhile(lambda x: x[0] == " ", hunk_lines))
+    trailing = list(itertools.takewhile(lambda x: x[0] == " ", reversed(hunk_lines)))
+    if n_leading > max(len(leading) - 1, 0) or n_trailing > max(len(trailing) - 1, 0) or n_leading + n_trailing >= len(hunk_lines):
+        return None
+    return hunk_lines[n_leading:len(hunk_lines) - n_trailing]
+
+def apply_hunks(source_lines, hunks):
+    """
+    Return the new lines and a report for each hunk. New lines is None if any hunk failed.
+    """
+    newline = "\r\n" if source_lines and source_lines[0].endswith("\r\n") else "\n"
+    match_modes = [("exact", lambda x: x.rstrip("\r\n")), ("whitespace-insensitive", normalize_whitespace)]
+    result_lines = []
+    reports = []
+    src_pos = 0
+    offset = 0
+    for hunk_no, hunk in enumerate(hunks, start=1):
+        found = None
+        # Pure insertion (eg new file) has nothing to match against, and its start line is the line before the insertion
+        expected = hunk.old_start if not hunk.old_lines() else hunk.old_start - 1
+        for n_trim in range(0, PATCH_MAX_CONTEXT_TRIM + 1):
+            for n_leading, n_trailing in sorted({ (n_trim, n_trim), (n_trim, 0), (0, n_trim) }):
+                trimmed = trim_hunk_context(hunk.lines, n_leading, n_trailing)
+                if trimmed is None or found:
+                    continue
+                old_lines = [text for tag, text in trimmed if tag != "+"]
+                for match_name, normalize in match_modes:
+                    pos = find_hunk_position(source_lines, old_lines, expected + offset + n_leading, src_pos, normalize)
+                    if pos is not None:
+                        found = (pos, trimmed, match_name, n_leading, n_trailing)
+                        break
+            if found:
+                break
+        if found is None:
+            reports.append({ "hunk": hunk_no, "ok": False, "line": hunk.old_start })
+            continue
+        pos, trimmed, match_name, n_leading, n_trailing = found
+        offset = pos - n_leading - expected
+        reports.append({ "hunk": hunk_no, "ok": True, "line": pos + 1, "offset": offset, "match": match_name, "trimmed_context": n_leading + n_trailing })
+        result_lines.extend(source_lines[src_pos:pos])
+        for tag, text in trimmed:
+            if tag == "-":
+                pos += 1
+                continue
+            if tag == " ":
+                # Keep the file's own version of context lines
+                text = source_lines[pos]
+                pos += 1
+            elif text.endswith("\n") and not text.endswith(newline):
+                text = text[:-1] + newline
+            if result_lines and not result_lines[-1].endswith("\n"):
+                result_lines[-1] += newline
+            result_lines.append(text)
+        src_pos = pos
+    if result_lines and src_pos < len(source_lines) and not result_lines[-1].endswith("\n"):
+        result_lines[-1] += newline
+    result_lines.extend(source_lines[src_pos:])
+    if not all(report["ok"] for report in reports):
+        return None, reports
+    return result_lines, reports
+
+def resolve_patch_target(repo_dir, path):
+    real_repo_dir = os.path.realpath(repo_dir)
+    real_path = os.path.realpath(os.path.join(repo_dir, path))
+    if os.path.commonpath([real_repo_dir, real_path]) != real_repo_dir:
+        raise ValueError(f"Patch target {path} points outside of the repo.")
+    return real_path
+
+def apply_unified_diff(repo_dir, diff_text):
+    """
+    Apply all file patches, or none of them. Return (success, report string).
+    """
+    file_patches = parse_unified_diff(diff_text)
+    if not file_patches:
+        raise ValueError("No file patch found. Make sure the diff has the --- / +++ file header lines, and @@ hunk headers.")
+    # Refuse the whole patch if any path in it leads outside of the repo, before anything is read or written
+    for file_patch in file_patches:
+        for path in (file_patch.old_path, file_patch.new_path):
+            if path is not None:
+                resolve_patch_target(repo_dir, path)
+    # First compute everything in memory
+    planned = []
+    report_lines = []
+    all_ok = True
+    for file_patch in file_patches:
+        display_path = file_patch.new_path or file_patch.old_path
+        source_lines = []
+        if file_patch.old_path is not None:
+            old_target = resolve_patch_target(repo_dir, file_patch.old_path)
+            if not os.path.isfile(old_target):
+                all_ok = False
+                report_lines.append(f"{display_path}: FAILED - file does not exist.")
+                continue
+            with open(old_target, "r", encoding="utf-8", newline="") as f:
+                source_lines = f.readlines()
+        elif os.path.exists(resolve_patch_target(repo_dir, file_patch.new_path)):
+            all_ok = False
+            report_lines.append(f"{display_path}: FAILED - patch creates a new file, but it already exists.")
+            continue
+        new_lines, hunk_reports = apply_hunks(source_lines, file_patch.hunks)
+        report_lines.append(f"{display_path}:")
+        for report in hunk_reports:
+            if report["ok"]:
+                extra = []
+                if report["offset"]:
+                    extra.append(f"offset {report['offset']:+d} lines")
+                if report["match"] != "exact":
+                    extra.append(report["match"])
+                if report["trimmed_context"]:
+                    extra.append(f"ignored {report['trimmed_context']} context lines")
+                report_lines.append(f"  hunk {report['hunk']}: applied at line {report['line']}" + (f" ({', '.join(extra)})" if extra else ""))
+            else:
+                report_lines.append(f"  hunk {report['hunk']}: FAILED - no match for its context/removed lines near line {report['line']}.")
+        if new_lines is None:
+            all_ok = False
+            continue
+        if file_patch.new_path is None:
+            planned.append((resolve_patch_target(repo_dir, file_patch.old_path), None))
+        else:
+            planned.append((resolve_patch_target(repo_dir, file_patch.new_path), "".join(new_lines)))
+        if file_patch.old_path is not None and file_patch.new_path is not None and file_patch.old_path != file_patch.new_path:
+            planned.append((resolve_patch_target(repo_dir, file_patch.old_path), None))
+    if not all_ok:
+        return False, "Patch NOT applied, no file was changed:\n" + "\n".join(report_lines)
+
+    # Then write everything, rolling back already written files if anything goes wrong midway
+    originals = []
+    try:
+        for target, content in planned:
+            original = None
+            original_stat = None
+            if os.path.isfile(target):
+                original_stat = os.stat(target)
+                with open(target, "rb") as f:
+                    original = f.read()
+            originals.append((target, original))
+            if content is None:
+                os.remove(target)
+                continue
+            os.makedirs(os.path.dirname(target), exist_ok=True)
+            write_patched_file(target, content, original_stat)
+    except Exception:
+        for target, original in reversed(originals):
+            if original is None:
+                if os.path.isfile(target):
+                    os.remove(target)
+            else:
+                with open(target, "wb") as f:
+                    f.write(original)
+        raise
+    return True, f"Patch applied to {len(file_patches)} file(s):\n" + "\n".join(report_lines)
 
-    header_str = f"Content of {filepath}:\n"
-    return header_str + "".join(enriched_content)
 
 import pathlib
 
 def write_files_unified_diff_after_editmode(repo_root, file_content):
     # Frontend hook
-    rich_print_source_code(console=console, content=file_content)
+    rich_print_source_code(console=console, content=file_content, lang="diff")
     # Main
+    # The patch is applied from the host side, so repo_root must stay in the home dir (git apply used to be confined by the container)
+    repo_dir = resolve_home_path(repo_root)
+    try:
+        _, report = apply_unified_diff(repo_dir, file_content)
+        return report
+    except UnsupportedPatchError as e:
+        # Things like rename/binary patch, let git handle it
+        console.log(f"{e}, falling back to git apply")
     obj_stream = io.BytesIO()
     tmp_file_name = None
     with tarfile.open(fileobj=obj_stream, mode='w|') as tmp_tar, tempfile.NamedTemporaryFile(mode="wb+") as tmp_file:
@@ -287,7 +948,7 @@ def write_single_file_vanilla_fallback_after_editmode(filepath, file_content):
     err_msg_abs = f"Validation error in file path {filepath}: This tool only supports edit within home directory, absolute path does not point to a location inside home dir or one of its subfolder."
     err_msg_rel_up = f"Validation error in file path {filepath}: This tool does not support parent dir relative path specification."
     # Frontend hook
-    rich_print_source_code(console=console, content=file_content)
+    rich_print_source_code(console=console, content=file_content, filepath=filepath)
     # TODO: patchup dumbness of LLM model by intelligently detecting case
     #open_path = os.path.join(LOCAL_USER_HOME_DIR, filepath)
     p = pathlib.Path(filepath)
@@ -332,6 +993,308 @@ sandbox.run_single_command(command=f"tmux -S {TMUX_SOCKET} new -d -s {TMUX_SESSI
 console.log("Okay!")
 
 
+"""
+Bind mount change watcher
+
+One inotify watch over the bind mounted home dir, shared by everything that caches file content on the host side.
+Bursts of events (an `npm install`, a `git checkout`, an editor's save dance) are coalesced per path and only
+dispatched to the subscribers after things are quiet for a moment.
+"""
+
+from watchdog.observers import Observer
+from watchdog.events import FileSystemEventHandler
+
+CHANGE_WATCH_DEBOUNCE_SECONDS = 0.3
+CHANGE_SETTLE_MAX_SECONDS = 1.0
+# Never watched: huge trees (inotify watch limit) that nobody needs change events for
+WATCH_IGNORED_DIRS = { ".git", "node_modules", ".venv", "venv", "__pycache__" }
+
+def merge_change(old, new):
+    # Net effect of two changes to the same path, None means it cancels out
+    if old is None:
+        return new
+    if old == "created":
+        return None if new == "deleted" else "created"
+    if old == "deleted" and new == "created":
+        return "modified"
+    return new
+
+class BindMountWatcher(FileSystemEventHandler):
+    """
+    Subscribers are called (from the watcher thread) with a list of (change, rel_path), where change is one of
+    "created", "modified", "deleted". Deleted directories end with a path separator.
+    """
+    def __init__(self, root_dir, debounce_seconds=CHANGE_WATCH_DEBOUNCE_SECONDS):
+        self.root_dir = root_dir
+        self.debounce_seconds = debounce_seconds
+        self.subscribers = []
+        self.cond = threading.Condition()
+        self.pending = OrderedDict()
+        self.changes_since_pop = OrderedDict()
+        self.last_event_time = 0
+        self.stopped = False
+        self.observer = Observer()
+        # rel_dir -> watch. Only touched before the observer starts, then from its thread
+        self.watches = {}
+        self.thread = threading.Thread(target=self.run, daemon=True)
+
+    def subscribe(self, callback):
+        self.subscribers.append(callback)
+
+    def start(self):
+        Path(self.root_dir).mkdir(parents=True, exist_ok=True)
+        self.watch_tree(".")
+        self.observer.start()
+        self.thread.start()
+
+    def stop(self):
+        self.observer.stop()
+        self.observer.join()
+        with self.cond:
+            self.stopped = True
+            self.cond.notify_all()
+        self.thread.join()
+
+    def is_ignored(self, rel_path):
+        return rel_path == "." or rel_path.startswith("..") or any(part in WATCH_IGNORED_DIRS for part in rel_path.split(os.sep))
+
+    def watch_tree(self, rel_dir, report_files=False):
+        # One non recursive watch per directory instead of a recursive one, so that ignored dirs are never walked into
+        for dir_path, dir_names, file_names in os.walk(os.path.join(self.root_dir, rel_dir)):
+            dir_names[:] = [x for x in dir_names if x not in WATCH_IGNORED_DIRS]
+            rel_path = os.path.normpath(os.path.relpath(dir_path, self.root_dir))
+            if rel_path not in self.watches:
+                try:
+                    self.watches[rel_path] = self.observer.schedule(self, dir_path, recursive=False)
+                except OSError as e:
+                    console.log(f"[red]Cannot watch {rel_path}: {e}")
+                    continue
+            if report_files:
+                # Created before their directory got a watch, so they have no event of their own
+                for file_name in file_names:
+                    self.record("created", os.path.join(dir_path, file_name))
+
+    def unwatch_tree(self, rel_dir):
+        prefix = rel_dir + os.sep
+        for rel_path in [x for x in self.watches if x == rel_dir or x.startswith(prefix)]:
+            try:
+                self.observer.unschedule(self.watches.pop(rel_path))
+            except KeyError:
+                pass
+
+    def on_any_event(self, event):
+        if event.event_type in ("opened", "closed", "closed_no_write"):
+            return
+        src_rel_path = os.path.normpath(os.path.relpath(event.src_path, self.root_dir))
+        if self.is_ignored(src_rel_path):
+            return
+        if event.is_directory:
+            if event.event_type == "created":
+                self.watch_tree(src_rel_path, report_files=True)
+            elif event.event_type in ("deleted", "moved"):
+                self.unwatch_tree(src_rel_path)
+                self.record("deleted", event.src_path, is_directory=True)
+                if event.event_type == "moved":
+                    dest_rel_path = os.path.normpath(os.path.relpath(event.dest_path, self.root_dir))
+                    if not self.is_ignored(dest_rel_path):
+                        self.watch_tree(dest_rel_path, report_files=True)
+            return
+        if event.event_type == "moved":
+            self.record("deleted", event.src_path)
+            self.record("created", event.dest_path)
+        else:
+            self.record(event.event_type, event.src_path)
+
+    def record(self, change, full_path, is_directory=False):
+        rel_path = os.path.relpath(full_path, self.root_dir)
+        if self.is_ignored(rel_path):
+            return
+        if is_directory:
+            rel_path += os.sep
+        with self.cond:
+            merged = merge_change(self.pending.pop(rel_path, None), change)
+            if merged is not None:
+                self.pending[rel_path] = merged
+            self.last_event_time = time.monotonic()
+            self.cond.notify_all()
+
+    def run(self):
+        while True:
+            with self.cond:
+                while not self.pending and not self.stopped:
+                    self.cond.wait()
+                # Wait until no new event for a while
+                while self.pending and not self.stopped:
+                    remaining = self.last_event_time + self.debounce_seconds - time.monotonic()
+                    if remaining <= 0:
+                        break
+                    self.cond.wait(remaining)
+                if not self.pending and self.stopped:
+                    return
+                batch = [(change, rel_path) for rel_path, change in self.pending.items()]
+                self.pending.clear()
+            for callback in self.subscribers:
+                try:
+                    callback(batch)
+                except Exception as e:
+                    console.log(f"[red]Change watcher subscriber {getattr(callback, '__qualname__', callback)} failed: {e}")
+            with self.cond:
+                for change, rel_path in batch:
+                    merged = merge_change(self.changes_since_pop.pop(rel_path, None), change)
+                    if merged is not None:
+                        self.changes_since_pop[rel_path] = merged
+                self.cond.notify_all()
+
+    def pop_changes(self):
+        """
+        Net changes since the last call, as an ordered dict of rel_path -> change.
+        Give the in-flight events a short moment to settle first, so that a command that just finished is included.
+        """
+        deadline = time.monotonic() + CHANGE_SETTLE_MAX_SECONDS
+        with self.cond:
+            while self.pending and not self.stopped and time.monotonic() < deadline:
+                self.cond.wait(deadline - time.monotonic())
+            changes = self.changes_since_pop
+            self.changes_since_pop = OrderedDict()
+        return changes
+
+
+bind_mount_watcher = BindMountWatcher(root_dir=LOCAL_USER_HOME_DIR)
+bind_mount_watcher.subscribe(read_cache.invalidate_changes)
+bind_mount_watcher.start()
+
+
+"""
+Shell log capture
+
+Every named shell mirror its output via `tmux pipe-pane` into a log file under the bind mounted home dir,
+so the host can tail/search it directly without docker exec, and without the scrollback limit.
+"""
+
+from collections import deque
+
+SHELL_LOG_DIR_NAME = ".agent_shell_logs"
+SHELL_LOG_DIR = f"{USER_HOME_DIR}/{SHELL_LOG_DIR_NAME}"
+LOCAL_SHELL_LOG_DIR = os.path.join(LOCAL_USER_HOME_DIR, SHELL_LOG_DIR_NAME)
+
+SHELL_CAPTURE_LINES = 200
+SHELL_LOG_TAIL_LINES = 2000
+SHELL_LOG_MAX_MATCHES = 50
+
+# CSI, OSC, and other two byte escape sequences
+TERMINAL_ESCAPE_RE = re.compile(rb"\x1b\[[0-?]*[ -/]*[@-~]|\x1b\][^\x07\x1b]*(?:\x07|\x1b\\)|\x1b[@-Z\\-_]")
+# Full screen (TUI) programs switch to the alternate screen, their output is screen redraws rather than lines
+ALTERNATE_SCREEN_RE = re.compile(rb"\x1b\[\?(?:1049|1047|47)([hl])")
+
+def strip_terminal_escapes(raw_line):
+    line = TERMINAL_ESCAPE_RE.sub(b"", raw_line.rstrip(b"\r"))
+    # Carriage return means the line is redrawn (progress bar etc), only the last version is visible
+    line = line.rsplit(b"\r", 1)[-1]
+    return line.decode("utf-8", errors="replace")
+
+def shell_log_file_name(shell_name):
+    return re.sub(r"[^A-Za-z0-9_.-]", "_", shell_name) + ".log"
+
+class ShellLogTailer:
+    def __init__(self, log_dir, tail_lines=SHELL_LOG_TAIL_LINES):
+        self.log_dir = log_dir
+        self.tail_lines = tail_lines
+        self.logs = {}
+        self.lock = threading.Lock()
+
+    def start(self):
+        Path(self.log_dir).mkdir(parents=True, exist_ok=True)
+        # Created by the host user, but pipe-pane writes from inside the container as uid 1000, the owner of the home dir.
+        # Hand the dir over to that owner, if not allowed the logs are not written and capture-pane is used instead.
+        home_stat = os.stat(os.path.dirname(self.log_dir))
+        try:
+            os.chown(self.log_dir, home_stat.st_uid, home_stat.st_gid)
+        except PermissionError:
+            pass
+        os.chmod(self.log_dir, 0o770)
+
+    def log_path(self, shell_name):
+        return os.path.join(self.log_dir, shell_log_file_name(shell_name))
+
+    def track(self, shell_name):
+        with self.lock:
+            self.logs[shell_log_file_name(shell_name)] = { "offset": 0, "partial": b"", "tail": deque(maxlen=self.tail_lines), "alternate_screen": False }
+
+    def on_changes(self, changes):
+        for change, rel_path in changes:
+            if change != "deleted" and os.path.dirname(rel_path) == SHELL_LOG_DIR_NAME:
+                self.consume(os.path.basename(rel_path))
+
+    def consume(self, file_name):
+        # Incrementally read whatever got appended since last time, keep only a bounded tail in memory
+        with self.lock:
+            state = self.logs.get(file_name)
+            if state is None:
+                return
+            try:
+                with open(os.path.join(self.log_dir, file_name), "rb") as f:
+                    f.seek(state["offset"])
+                    chunk = f.read()
+            except FileNotFoundError:
+                return
+            state["offset"] += len(chunk)
+            screen_switches = ALTERNATE_SCREEN_RE.findall(state["partial"] + chunk)
+            if screen_switches:
+                state["alternate_screen"] = screen_switches[-1] == b"h"
+            lines = (state["partial"] + chunk).split(b"\n")
+            state["partial"] = lines.pop()
+            for line in lines:
+                state["tail"].append(strip_terminal_escapes(line))
+
+    def get_tail(self, shell_name, n_lines):
+        """
+        Returns None when the log can't be used and the screen should be captured instead:
+        the log file was never created (pipe-pane failed) or the shell is showing a full screen program.
+        """
+        file_name = shell_log_file_name(shell_name)
+        if not os.path.exists(os.path.join(self.log_dir, file_name)):
+            return None
+        # Don't wait for inotify to catch up, we want the freshest view
+        self.consume(file_name)
+        with self.lock:
+            state = self.logs.get(file_name)
+            if state is None or state["alternate_screen"]:
+                return None
+            tail = list(state["tail"])[-n_lines:]
+            if state["partial"]:
+                tail.append(strip_terminal_escapes(state["partial"]))
+            return "\n".join(tail)
+
+    def search(self, shell_name, pattern, start_offset=0, max_matches=SHELL_LOG_MAX_MATCHES):
+        """
+        Returns the matches (prefixed by their byte offset) and the offset right after the last line searched.
+        """
+        regex = re.compile(pattern)
+        matches = []
+        offset = start_offset
+        with open(self.log_path(shell_name), "rb") as f:
+            f.seek(start_offset)
+            for raw_line in f:
+                line = strip_terminal_escapes(raw_line.rstrip(b"\n"))
+                if regex.search(line):
+                    matches.append(f"{offset}:{line}")
+                offset += len(raw_line)
+                if len(matches) >= max_matches:
+                    break
+        return matches, offset
+
+
+shell_log_tailer = ShellLogTailer(log_dir=LOCAL_SHELL_LOG_DIR)
+shell_log_tailer.start()
+bind_mount_watcher.subscribe(shell_log_tailer.on_changes)
+
+
+def capture_shell_output(shell_name, tmux_id):
+    tail = shell_log_tailer.get_tail(shell_name, SHELL_CAPTURE_LINES)
+    if tail is not None:
+        return tail
+    # Fallback in case pipe-pane did not get setup, or for full screen programs where only the screen makes sense
+    return sandbox.run_single_command(command=f"tmux -S {TMUX_SOCKET} capture-pane -p -J -t {TMUX_SESSION}:{tmux_id}.0 -S -{SHELL_CAPTURE_LINES}", work_dir=USER_HOME_DIR, show_exit_code=False)
 
 def execute_command_interactively(command_key_sequence, shell_name, wait_seconds = DEFAULT_SLEEP_SECONDS):
     global current_max_tmux_id
@@ -344,10 +1307,13 @@ def execute_command_interactively(command_key_sequence, shell_name, wait_seconds
         current_max_tmux_id += 1
         interactive_shells[shell_name] = current_max_tmux_id
         tmux_id = current_max_tmux_id
+        # Mirror all output of the new window into the log file
+        shell_log_tailer.track(shell_name)
+        sandbox.run_single_command(command=f"tmux -S {TMUX_SOCKET} pipe-pane -o -t {TMUX_SESSION}:{tmux_id}.0 'cat >> {SHELL_LOG_DIR}/{shell_log_file_name(shell_name)}'", work_dir=USER_HOME_DIR)
     # Then send the key sequence in tmux eitherway
     sandbox.run_single_command(command=f"tmux -S {TMUX_SOCKET} send-keys -t {TMUX_SESSION}:{tmux_id}.0 -- {command_key_sequence}", work_dir=USER_HOME_DIR)
     time.sleep(wait_seconds)
-    return sandbox.run_single_command(command=f"tmux -S {TMUX_SOCKET} capture-pane -p -J -t {TMUX_SESSION}:{tmux_id}.0 -S -200", work_dir=USER_HOME_DIR, show_exit_code=False)
+    return capture_shell_output(shell_name, tmux_id)
 
 def list_command_shell_sessions():
     return list(interactive_shells.keys())
@@ -357,23 +1323,633 @@ def poll_interactive_command_shell_output(shell_name, wait_seconds = DEFAULT_SLE
         raise ValueError(f"The shell named: {shell_name}, does not exists.")
     tmux_id = interactive_shells.get(shell_name)
     time.sleep(wait_seconds)
-    return sandbox.run_single_command(command=f"tmux -S {TMUX_SOCKET} capture-pane -p -J -t {TMUX_SESSION}:{tmux_id}.0 -S -200", work_dir=USER_HOME_DIR, show_exit_code=False)
+    return capture_shell_output(shell_name, tmux_id)
+
+def search_shell_log(shell_name, pattern, start_offset=0):
+    if shell_name not in interactive_shells:
+        raise ValueError(f"The shell named: {shell_name}, does not exists.")
+    try:
+        matches, next_offset = shell_log_tailer.search(shell_name, pattern, start_offset=start_offset)
+    except FileNotFoundError:
+        return f"No log file for shell {shell_name}, its output is not being mirrored. Use poll_interactive_command_shell_output instead."
+    if not matches:
+        return f"No match for {pattern} in the log of shell {shell_name} (searched from byte offset {start_offset})."
+    result = "\n".join(matches)
+    if len(matches) >= SHELL_LOG_MAX_MATCHES:
+        result += f"\n--\n[system] Stopped at {SHELL_LOG_MAX_MATCHES} matches. Search again with start_offset={next_offset} to see more."
+    return result
 
 #from datetime import datetime
 #now = datetime.now()
 #formatted_date_time = now.strftime("%Y-%m-%d %H:%M:%S")
 #print(formatted_date_time)
 
+"""
+Project export
+
+Archives are streamed straight out of the container (git archive) or the bind mount (additional files) into zstd compressors
+writing to a host side export dir, all in parallel. Nothing is staged in the container home, and a manifest records what was produced.
+"""
+
+import zstandard
+
+LOCAL_EXPORT_DIR = os.path.join( os.getcwd(), AGENT_LOCAL_HOME, f"{formatted_date_time}_export")
+EXPORT_ZSTD_LEVEL = 3
+EXPORT_MAX_WORKERS = 8
+
+class CountingWriter:
+    # Count and hash the raw (uncompressed) bytes on their way to the compressor
+    def __init__(self, inner):
+        self.inner = inner
+        self.n_bytes = 0
+        self.sha256 = hashlib.sha256()
+
+    def write(self, data):
+        self.n_bytes += len(data)
+        self.sha256.update(data)
+        return self.inner.write(data)
+
+def export_artifact(file_name, write_fn):
+    """
+    Run write_fn(writer) with a zstd stream writer to the export file, return its manifest entry.
+    write_fn return an error string, or None if successful.
+    """
+    start_time = time.perf_counter()
+    out_path = os.path.join(LOCAL_EXPORT_DIR, file_name)
+    compressor = zstandard.ZstdCompressor(level=EXPORT_ZSTD_LEVEL, threads=-1)
+    with open(out_path, "wb") as out_file:
+        with compressor.stream_writer(out_file, closefd=False) as zstd_writer:
+            writer = CountingWriter(zstd_writer)
+            error = write_fn(writer)
+    entry = { "file": file_name, "ok": error is None, "raw_bytes": writer.n_bytes, "raw_sha256": writer.sha256.hexdigest() }
+    if error is not None:
+        os.remove(out_path)
+        entry["error"] = error
+    else:
+        with open(out_path, "rb") as f:
+            entry["sha256"] = hashlib.file_digest(f, "sha256").hexdigest()
+        entry["compressed_bytes"] = os.path.getsize(out_path)
+    entry["seconds"] = round(time.perf_counter() - start_time, 3)
+    return entry
+
+def export_repo(repo):
+    def write_fn(writer):
+        exit_code, stderr = sandbox.stream_single_command(command="git archive --format=tar main", out_file=writer, work_dir=os.path.join(USER_HOME_DIR, repo))
+        if exit_code != 0:
+            return f"git archive exited with code {exit_code}: {stderr.strip()}"
+        return None
+    entry = export_artifact(f"export_{re.sub(r'[^A-Za-z0-9_.-]', '_', repo)}.tar.zst", write_fn)
+    entry["repo"] = repo
+    return entry
+
+def export_additional_files(additional_files):
+    missing = []
+    def write_fn(writer):
+        # Read straight from the bind mount, no need to go through the container
+        with tarfile.open(fileobj=writer, mode="w|") as tar:
+            for filepath in additional_files:
+                try:
+                    full_path = resolve_patch_target(LOCAL_USER_HOME_DIR, filepath)
+                except ValueError:
+                    missing.append(filepath)
+                    continue
+                if not os.path.exists(full_path):
+                    missing.append(filepath)
+                    continue
+                tar.add(full_path, arcname=os.path.relpath(full_path, os.path.realpath(LOCAL_USER_HOME_DIR)))
+        return None
+    entry = export_artifact("export_others.tar.zst", write_fn)
+    entry["files"] = additional_files
+    entry["missing"] = missing
+    return entry
+
 def signal_agent_completed(repos, additional_files):
-    for repo in repos:
-        sandbox.run_single_command(command=f"git archive --format=zip --output {USER_HOME_DIR}/export_{repo}.zip main", work_dir=os.path.join(USER_HOME_DIR, repo))
-    sandbox.run_single_command(command="tar -czvf export_others.tar.gz " + " ".join(additional_files), work_dir=USER_HOME_DIR)
-    return "project exported."
+    start_time = time.perf_counter()
+    Path(LOCAL_EXPORT_DIR).mkdir(parents=True, exist_ok=True)
+    with ThreadPoolExecutor(max_workers=min(EXPORT_MAX_WORKERS, len(repos) + 1)) as executor:
+        futures = [executor.submit(export_repo, repo) for repo in repos]
+        if additional_files:
+            futures.append(executor.submit(export_additional_files, additional_files))
+        entries = [future.result() for future in futures]
+    manifest = { "session": formatted_date_time, "seconds": round(time.perf_counter() - start_time, 3), "artifacts": entries }
+    with open(os.path.join(LOCAL_EXPORT_DIR, "manifest.json"), "w", encoding="utf-8") as f:
+        json.dump(manifest, f, indent=2)
+    result = [f"Project exported to {LOCAL_EXPORT_DIR} in {manifest['seconds']:.1f}s:"]
+    for entry in entries:
+        if entry["ok"]:
+            result.append(f"- {entry['file']}: {entry['raw_bytes']} bytes, {entry['compressed_bytes']} compressed")
+        else:
+            result.append(f"- {entry['file']}: FAILED - {entry['error']}")
+        if entry.get("missing"):
+            result.append(f"  not found (skipped): {', '.join(entry['missing'])}")
+    return "\n".join(result)
 
 def report_live_preview_url(url):
-    richprint(Panel(f"[link={url}]{url}[/link]", title="Live Preview Available"))
+    renderer.print(Panel(f"[link={url}]{url}[/link]", title="Live Preview Available"))
     return "sent preview URL to UI."
 
+
+"""
+Code search index
+
+In-memory trigram index over the home dir, so that searching code does not need a `grep -r` exec that walks node_modules every time.
+Candidate files are narrowed down by the trigrams of the literal parts of the regex, then only those files are actually scanned.
+"""
+
+import fnmatch
+from collections import defaultdict
+
+import pathspec
+
+ALWAYS_IGNORED_DIRS = { ".git", "node_modules", ".venv", "venv", "__pycache__", SHELL_LOG_DIR_NAME }
+SEARCH_MAX_FILE_BYTES = 1024 * 1024
+SEARCH_MAX_FILES = 20
+SEARCH_MAX_LINES_PER_FILE = 5
+SEARCH_MAX_LINE_CHARS = 200
+
+DEFINITION_LINE_RE = re.compile(r"^\s*(export\s+)?(async\s+)?(def|class|function|fn|struct|interface|type|const|let|var|func|impl)\b")
+
+def trigrams_of(text):
+    return { text[i:i + 3] for i in range(len(text) - 2) }
+
+def required_literals(pattern):
+    """
+    Literal substrings that any match of the regex must contain. Conservative: when unsure, a run is cut short,
+    and a top level alternation gives up entirely (returning no literal means every file is a candidate).
+    """
+    literals = []
+    current = []
+    i = 0
+    while i < len(pattern):
+        c = pattern[i]
+        if c == "\\":
+            nxt = pattern[i + 1:i + 2]
+            i += 2
+            if nxt and not nxt.isalnum():
+                current.append(nxt)
+                continue
+            # Character class like \w, or a backreference etc
+            literals.append("".join(current))
+            current = []
+            continue
+        if c == "|":
+            return []
+        if c in "?*{":
+            # The previous char is optional
+            if current:
+                current.pop()
+            literals.append("".join(current))
+            current = []
+            if c == "{":
+                i = pattern.find("}", i) + 1 or len(pattern)
+                continue
+        elif c == "+":
+            literals.append("".join(current))
+            current = []
+        elif c in "([":
+            literals.append("".join(current))
+            current = []
+            # Skip over the whole group/class, alternation inside a group does not affect the outside
+            if c == "[":
+                j = i + 1
+                if pattern[j:j + 1] == "^":
+                    j += 1
+                if pattern[j:j + 1] == "]":
+                    j += 1
+                while j < len(pattern) and pattern[j] != "]":
+                    j += 2 if pattern[j] == "\\" else 1
+                i = j + 1
+            else:
+                depth = 1
+                j = i + 1
+                while j < len(pattern) and depth:
+                    if pattern[j] == "\\":
+                        j += 1
+                    elif pattern[j] == "(":
+                        depth += 1
+                    elif pattern[j] == ")":
+                        depth -= 1
+                    j += 1
+                i = j
+            # A quantifier after the group/class is fine to ignore, as nothing was added to the current run
+            continue
+        elif c in ".^$":
+            literals.append("".join(current))
+            current = []
+        else:
+            current.append(c)
+        i += 1
+    literals.append("".join(current))
+    return [x for x in literals if len(x) >= 3]
+
+class CodeSearchIndex:
+    def __init__(self, root_dir):
+        self.root_dir = root_dir
+        self.lock = threading.Lock()
+        self.ignore_specs = {}
+        self.file_trigrams = {}
+        self.postings = defaultdict(set)
+        self.is_built = False
+
+    def load_gitignore(self, rel_dir):
+        gitignore_path = os.path.join(self.root_dir, rel_dir, ".gitignore")
+        if os.path.isfile(gitignore_path):
+            with open(gitignore_path, "r", encoding="utf-8", errors="replace") as f:
+                self.ignore_specs[rel_dir] = pathspec.GitIgnoreSpec.from_lines(f)
+        else:
+            self.ignore_specs.pop(rel_dir, None)
+
+    def is_ignored(self, rel_path, is_dir=False):
+        parts = Path(rel_path).parts
+        if any(part in ALWAYS_IGNORED_DIRS for part in parts):
+            return True
+        # Each .gitignore applies to paths relative to its own directory
+        for i in range(len(parts)):
+            spec = self.ignore_specs.get(os.path.join(*parts[:i]) if i else "")
+            if spec is not None:
+                sub_path = "/".join(parts[i:]) + ("/" if is_dir else "")
+                if spec.match_file(sub_path):
+                    return True
+        return False
+
+    def _walk(self):
+        # Load each directory's .gitignore on the way down, so that ignored subdirs are never walked into
+        self.ignore_specs = {}
+        for dir_path, dir_names, file_names in os.walk(self.root_dir):
+            rel_dir = os.path.relpath(dir_path, self.root_dir)
+            rel_dir = "" if rel_dir == "." else rel_dir
+            self.load_gitignore(rel_dir)
+            dir_names[:] = [x for x in dir_names if not self.is_ignored(os.path.join(rel_dir, x), is_dir=True)]
+            yield rel_dir, file_names
+
+    def load_ignore_specs(self):
+        # Only the ignore rules, without indexing anything (the index is built on first search)
+        with self.lock:
+            for _ in self._walk():
+                pass
+
+    def build(self):
+        with self.lock:
+            self.file_trigrams = {}
+            self.postings = defaultdict(set)
+            for rel_dir, file_names in self._walk():
+                for file_name in file_names:
+                    rel_path = os.path.join(rel_dir, file_name)
+                    if not self.is_ignored(rel_path):
+                        self._index_file(rel_path)
+            self.is_built = True
+
+    def _read_text(self, rel_path):
+        full_path = os.path.join(self.root_dir, rel_path)
+        try:
+            if os.path.getsize(full_path) > SEARCH_MAX_FILE_BYTES:
+                return None
+            with open(full_path, "rb") as f:
+                data = f.read()
+        except OSError:
+            return None
+        if b"\0" in data[:8192]:
+            return None
+        return data.decode("utf-8", errors="replace")
+
+    def _index_file(self, rel_path):
+        self._remove_file(rel_path)
+        text = self._read_text(rel_path)
+        if text is None:
+            return
+        file_trigrams = trigrams_of(text.lower())
+        self.file_trigrams[rel_path] = file_trigrams
+        for trigram in file_trigrams:
+            self.postings[trigram].add(rel_path)
+
+    def _remove_file(self, rel_path):
+        for trigram in self.file_trigrams.pop(rel_path, ()):
+            posting = self.postings.get(trigram)
+            if posting is not None:
+                posting.discard(rel_path)
+                if not posting:
+                    del self.postings[trigram]
+
+    def update_path(self, rel_path):
+        full_path = os.path.join(self.root_dir, rel_path)
+        # The change watcher marks deleted directories with a trailing separator
+        is_deleted_dir = rel_path.endswith(os.sep)
+        rel_path = os.path.normpath(rel_path)
+        with self.lock:
+            if os.path.basename(rel_path) == ".gitignore":
+                # Ignore rules changed: keep them current for is_ignored, and for the index simplest is to start over
+                self.load_gitignore(os.path.dirname(rel_path))
+                self.is_built = False
+                return
+            if not self.is_built:
+                return
+            if os.path.isdir(full_path):
+                # Files inside get their own events
+                return
+            if os.path.isfile(full_path) and not self.is_ignored(rel_path):
+                self._index_file(rel_path)
+            else:
+                self._remove_file(rel_path)
+                if is_deleted_dir:
+                    prefix = rel_path + os.sep
+                    for indexed_path in [x for x in self.file_trigrams if x.startswith(prefix)]:
+                        self._remove_file(indexed_path)
+
+    def on_changes(self, changes):
+        for _, rel_path in changes:
+            self.update_path(rel_path)
+
+    def candidate_files(self, pattern):
+        literals = required_literals(pattern)
+        with self.lock:
+            if not literals:
+                return sorted(self.file_trigrams), len(self.file_trigrams)
+            candidates = None
+            for literal in literals:
+                for trigram in trigrams_of(literal.lower()):
+                    posting = self.postings.get(trigram, set())
+                    candidates = set(posting) if candidates is None else candidates & posting
+            return sorted(candidates), len(self.file_trigrams)
+
+    def ensure_built(self):
+        if not self.is_built:
+            self.build()
+
+    def search(self, pattern, path_glob="", case_sensitive=False):
+        self.ensure_built()
+        regex = re.compile(pattern, 0 if case_sensitive else re.IGNORECASE)
+        candidates, n_indexed = self.candidate_files(pattern)
+        if path_glob:
+            candidates = [x for x in candidates if fnmatch.fnmatch(x, path_glob)]
+        literals = [x.lower() for x in required_literals(pattern)]
+        file_results = []
+        for rel_path in candidates:
+            text = self._read_text(rel_path)
+            if text is None:
+                continue
+            matches = []
+            score = 0
+            for line_no, line in enumerate(text.splitlines(), start=1):
+                if regex.search(line):
+                    matches.append((line_no, line))
+                    # Definitions are usually what one is looking for
+                    score += 3 if DEFINITION_LINE_RE.match(line) else 1
+            if not matches:
+                continue
+            if any(literal in rel_path.lower() for literal in literals):
+                score += 5
+            file_results.append((score, rel_path, matches))
+        file_results.sort(key=lambda x: (-x[0], x[1]))
+        return file_results, len(candidates), n_indexed
+
+
+code_search_index = CodeSearchIndex(root_dir=LOCAL_USER_HOME_DIR)
+# The change summary filters with the ignore rules from the first turn on, long before a search builds the index
+code_search_index.load_ignore_specs()
+bind_mount_watcher.subscribe(code_search_index.on_changes)
+
+CHANGE_SUMMARY_MAX_ENTRIES = 30
+CHANGE_SUMMARY_LETTERS = { "created": "A", "modified": "M", "deleted": "D" }
+
+def summarize_changes_since_last_turn():
+    """
+    Compact `git status --short` style list of what changed in the home dir since the last call, or None if nothing did.
+    """
+    changes = []
+    for rel_path, change in bind_mount_watcher.pop_changes().items():
+        is_dir = rel_path.endswith(os.sep)
+        if not code_search_index.is_ignored(rel_path.rstrip(os.sep), is_dir=is_dir):
+            changes.append((rel_path, change))
+    if not changes:
+        return None
+    changes.sort()
+    header_str = f"[system] {len(changes)} path(s) changed in the home dir since your last turn:"
+    if len(changes) <= CHANGE_SUMMARY_MAX_ENTRIES:
+        return "\n".join([header_str] + [f"{CHANGE_SUMMARY_LETTERS[change]} {rel_path}" for rel_path, change in changes])
+    # Too many to list one by one (eg an install or a generator ran), group them by directory
+    by_dir = OrderedDict()
+    for rel_path, change in changes:
+        counts = by_dir.setdefault(os.path.dirname(rel_path.rstrip(os.sep)) or ".", defaultdict(int))
+        counts[CHANGE_SUMMARY_LETTERS[change]] += 1
+    result = [header_str]
+    for dir_path, counts in itertools.islice(by_dir.items(), CHANGE_SUMMARY_MAX_ENTRIES):
+        result.append(f"{dir_path}/ ({', '.join(f'{n} {letter}' for letter, n in sorted(counts.items()))})")
+    if len(by_dir) > CHANGE_SUMMARY_MAX_ENTRIES:
+        result.append(f"... and {len(by_dir) - CHANGE_SUMMARY_MAX_ENTRIES} more directories")
+    return "\n".join(result)
+
+def search_code(pattern, path_glob="", case_sensitive=False):
+    start_time = time.perf_counter()
+    file_results, n_scanned, n_indexed = code_search_index.search(pattern, path_glob=path_glob, case_sensitive=case_sensitive)
+    elapsed_ms = (time.perf_counter() - start_time) * 1000
+    n_matches = sum(len(matches) for _, _, matches in file_results)
+    header_str = f"Found {n_matches} matching lines in {len(file_results)} files ({n_scanned} of {n_indexed} indexed files scanned, {elapsed_ms:.0f} ms)."
+    if not file_results:
+        return header_str
+    result = [header_str]
+    for _, rel_path, matches in file_results[:SEARCH_MAX_FILES]:
+        result.append(f"\n{rel_path} ({len(matches)} matches)")
+        for line_no, line in matches[:SEARCH_MAX_LINES_PER_FILE]:
+            result.append(f"  {line_no}: {line.strip()[:SEARCH_MAX_LINE_CHARS]}")
+        if len(matches) > SEARCH_MAX_LINES_PER_FILE:
+            result.append(f"  ... {len(matches) - SEARCH_MAX_LINES_PER_FILE} more")
+    if len(file_results) > SEARCH_MAX_FILES:
+        result.append(f"\n[system] {len(file_results) - SEARCH_MAX_FILES} more files not shown. Narrow down with a more specific pattern or path_glob.")
+    return "\n".join(result)
+
+
+"""
+Symbol index
+
+Function/class definitions with their line spans, so that the agent can jump straight to a line range instead of reading whole files.
+Use tree-sitter when it is installed, otherwise fallback to the pygments lexers (which we already have for display).
+"""
+
+import bisect
+
+from pygments.token import Name, Keyword, Punctuation, Operator, Text as TokenText, Whitespace
+
+try:
+    from tree_sitter_languages import get_parser
+except ImportError:
+    get_parser = None
+
+SYMBOL_MAX_FILE_BYTES = 2 * 1024 * 1024
+SYMBOL_CACHE_SIZE = 2000
+FIND_SYMBOL_MAX_FILES = 500
+
+TREE_SITTER_LANGUAGES = {
+    ".py": "python", ".js": "javascript", ".jsx": "javascript", ".mjs": "javascript", ".ts": "typescript", ".tsx": "tsx",
+    ".go": "go", ".rs": "rust", ".java": "java", ".c": "c", ".h": "c", ".cpp": "cpp", ".rb": "ruby", ".php": "php",
+}
+TREE_SITTER_DEFINITION_NODES = {
+    "function_definition": "function", "class_definition": "class", "decorated_definition": None,
+    "function_declaration": "function", "generator_function_declaration": "function", "class_declaration": "class",
+    "method_definition": "method", "method_declaration": "method", "interface_declaration": "interface",
+    "type_alias_declaration": "type", "enum_declaration": "enum", "type_spec": "type",
+    "function_item": "function", "struct_item": "struct", "enum_item": "enum", "trait_item": "trait", "impl_item": "impl",
+    "class": "class", "module": "module", "method": "method",
+}
+PYGMENTS_DEFINITION_KEYWORDS = {
+    "def": "function", "function": "function", "fn": "function", "func": "function",
+    "class": "class", "struct": "struct", "interface": "interface", "trait": "trait", "enum": "enum", "type": "type",
+}
+INDENTATION_BASED_LEXERS = { "Python", "Python 2.x", "Cython", "CoffeeScript", "Nim", "YAML" }
+
+def extract_symbols_tree_sitter(data, language):
+    parser = get_parser(language)
+    tree = parser.parse(data)
+    symbols = []
+    def visit(node):
+        kind = TREE_SITTER_DEFINITION_NODES.get(node.type)
+        name_node = node.child_by_field_name("name") if kind else None
+        if name_node is not None:
+            symbols.append({ "name": name_node.text.decode("utf-8", errors="replace"), "kind": kind, "start": node.start_point[0] + 1, "end": node.end_point[0] + 1 })
+        for child in node.children:
+            visit(child)
+    visit(tree.root_node)
+    return symbols
+
+def find_block_end_by_indentation(lines, start_line):
+    def indentation(line):
+        return len(line) - len(line.lstrip())
+    def_indent = indentation(lines[start_line - 1])
+    # Skip to the end of the header, which may span multiple lines
+    body_start = start_line
+    while body_start <= len(lines) and not lines[body_start - 1].split("#")[0].rstrip().endswith(":"):
+        body_start += 1
+    end_line = min(body_start, len(lines))
+    for line_no in range(body_start + 1, len(lines) + 1):
+        line = lines[line_no - 1]
+        if not line.strip():
+            continue
+        if indentation(line) <= def_indent:
+            break
+        end_line = line_no
+    return end_line
+
+def find_block_end_by_braces(tokens, token_pos, line_of):
+    depth = 0
+    for index, ttype, value in tokens[token_pos + 1:]:
+        if ttype not in Punctuation and ttype not in Operator:
+            continue
+        for c in value:
+            if c == "{":
+                depth += 1
+            elif c == "}":
+                depth -= 1
+                if depth == 0:
+                    return line_of(index)
+            elif c == ";" and depth == 0:
+                # Only a declaration without a body
+                return line_of(index)
+    return None
+
+def extract_symbols_pygments(text, filepath):
+    lexer = lexer_for_filename(filepath)
+    if lexer is None:
+        return []
+    tokens = [x for x in lexer.get_tokens_unprocessed(text) if x[1] not in TokenText and x[1] not in Whitespace]
+    line_starts = [0] + [m.end() for m in re.finditer("\n", text)]
+    line_of = lambda index: bisect.bisect_right(line_starts, index)
+    lines = text.splitlines()
+    symbols = []
+    for pos, (index, ttype, value) in enumerate(tokens):
+        kind = None
+        if ttype in Name.Class:
+            kind = "class"
+        elif ttype in Name.Function:
+            kind = "function"
+        elif ttype in Name and pos > 0 and tokens[pos - 1][1] in Keyword:
+            kind = PYGMENTS_DEFINITION_KEYWORDS.get(tokens[pos - 1][2])
+        if kind is None:
+            continue
+        if pos > 0 and tokens[pos - 1][1] in Keyword:
+            kind = PYGMENTS_DEFINITION_KEYWORDS.get(tokens[pos - 1][2], kind)
+        start_line = line_of(index)
+        if lexer.name in INDENTATION_BASED_LEXERS:
+            end_line = find_block_end_by_indentation(lines, start_line)
+        else:
+            end_line = find_block_end_by_braces(tokens, pos, line_of) or start_line
+        symbols.append({ "name": value, "kind": kind, "start": start_line, "end": end_line })
+    return symbols
+
+class SymbolIndex:
+    def __init__(self, cache_size=SYMBOL_CACHE_SIZE):
+        self.cache = OrderedDict()
+        self.cache_size = cache_size
+        self.lock = threading.Lock()
+
+    def get_symbols(self, filepath):
+        open_path = resolve_home_path(filepath)
+        if os.path.getsize(open_path) > SYMBOL_MAX_FILE_BYTES:
+            return None
+        language = TREE_SITTER_LANGUAGES.get(os.path.splitext(filepath)[1].lower())
+        use_tree_sitter = get_parser is not None and language is not None
+        if use_tree_sitter:
+            parser_name = f"tree-sitter:{language}"
+        else:
+            lexer = lexer_for_filename(filepath)
+            parser_name = f"pygments:{lexer.name if lexer is not None else None}"
+        # Same content parsed as another language gives another outline
+        key = (read_cache.fingerprint(filepath, open_path), parser_name)
+        with self.lock:
+            if key in self.cache:
+                self.cache.move_to_end(key)
+                return self.cache[key]
+        with open(open_path, "rb") as f:
+            data = f.read()
+        if use_tree_sitter:
+            symbols = extract_symbols_tree_sitter(data, language)
+        else:
+            symbols = extract_symbols_pygments(data.decode("utf-8", errors="replace"), filepath)
+        # Nesting depth by span containment, for the indented outline
+        open_spans = []
+        for symbol in sorted(symbols, key=lambda x: (x["start"], -x["end"])):
+            while open_spans and open_spans[-1] < symbol["start"]:
+                open_spans.pop()
+            symbol["depth"] = len(open_spans)
+            open_spans.append(symbol["end"])
+        symbols.sort(key=lambda x: (x["start"], -x["end"]))
+        with self.lock:
+            self.cache[key] = symbols
+            if len(self.cache) > self.cache_size:
+                self.cache.popitem(last=False)
+        return symbols
+
+
+symbol_index = SymbolIndex()
+
+def format_symbol_outline(symbols):
+    return "\n".join(f"{'  ' * symbol['depth']}{symbol['kind']} {symbol['name']}  [lines {symbol['start']}-{symbol['end']}]" for symbol in symbols)
+
+def outline_file(filepath):
+    symbols = symbol_index.get_symbols(filepath)
+    if symbols is None:
+        return f"File {filepath} is too large to outline."
+    if not symbols:
+        return f"No function/class definition found in {filepath}."
+    return f"Outline of {filepath}:\n" + format_symbol_outline(symbols)
+
+def find_symbol(name, path_glob=""):
+    # Use the code search index to only look at files that contain the name at all
+    code_search_index.ensure_built()
+    candidates, _ = code_search_index.candidate_files(re.escape(name))
+    if path_glob:
+        candidates = [x for x in candidates if fnmatch.fnmatch(x, path_glob)]
+    found = []
+    for filepath in candidates[:FIND_SYMBOL_MAX_FILES]:
+        for symbol in symbol_index.get_symbols(filepath) or []:
+            if symbol["name"] == name:
+                found.append(f"{filepath}:{symbol['start']}-{symbol['end']} {symbol['kind']} {symbol['name']}")
+    note = ""
+    if len(candidates) > FIND_SYMBOL_MAX_FILES:
+        note = f"\n--\n[system] {len(candidates)} files mention {name}, only the first {FIND_SYMBOL_MAX_FILES} were searched for a definition. Narrow it down with path_glob to search the rest."
+    if not found:
+        return f"No definition of {name} found." + note
+    return "\n".join(found) + note
+
+
 """
 Subsection: Tool spec
 """
@@ -392,8 +1968,9 @@ web_search_tool_desc = 'Perform *one* web search using a metasearch engine.'
 
 
 tool_descs = {
-    "read_single_file_enriched": "Read the content of a single file in the container. Will return with line number annotation to make it easier for you to write patch.",
-    "write_files_unified_diff": "Write to one or more file at once that are all inside a single git repo. Accept git unified diff format.",
+    "read_single_file_enriched": "Read the content of a single file in the container. Will return with line number annotation to make it easier for you to write patch. Can optionally read only a range of lines; very large files will return a short preview instead of the full content, in which case read them in line ranges.",
+    "read_files_batch": "Read several files in one call. Accept a list of file paths and/or glob patterns (eg backend/app/**/*.py). Return the content of all matched files, each with the same line number annotation as `read_single_file_enriched`. There is a total size budget per call, files over it are listed as skipped.",
+    "write_files_unified_diff": "Write to one or more file at once that are all inside a single git repo. Accept git unified diff format. Hunks are located by their context lines, so slightly off line numbers in the @@ headers are tolerated. Either all files are patched or none are, and the result reports where each hunk was applied.",
     "write_single_file_vanilla_fallback": "Write to a single file. Will overwrite existing content if exists. Use as a fallback from `write_files_unified_diff`, or when creating new file.",
     "execute_command_simple": "Execute a terminal command and see the stdout/stderr. Underlying mechanism is similar to `docker exec`. Limitation: it is a direct execution in a non-shell enivornment. If you need shell, persistence, or interactivity, please use `execute_command_interactively` instead.",
     "execute_command_interactively": "In a persistent shell window, execute command interactively. Shell windows are identified by name, and new shells are created on demand if a non-existent shell name is specified. Actually, this is a slight misnomer as you can send control key sequence as well. Please be advised however that it uses tmux underneath for implementation, and due to some quirks, the command/key sequence you send may break if complex/deeply nested quoting is involved. Will return a capture of the shell after sending the commands and waiting for the specified time.",
@@ -401,11 +1978,23 @@ tool_descs = {
     "poll_interactive_command_shell_output": "Get the screen output of a shell window in text format using polling. Will wait for a time specified by you first to avoid thrashing/thundering herd problem.",
     "signal_agent_completed": "Indicate to the underlying system that you have completed the whole task.",
     "report_live_preview_url": "Report the live preview URL of the app you're working on. The underlying system will record it and present the URL to the user behind the scene through suitable UI, so that user may preview the app.",
+    "search_code": "Search the content of all files under the home directory with a regex, skipping files ignored by .gitignore (and node_modules, .venv etc). Much faster than grep. Return matching lines grouped by file, files with the most relevant matches (eg definitions) first.",
+    "outline_file": "List the functions/classes/etc defined in a file, with the line range of each. Use it to read only the relevant part of a long file with `read_single_file_enriched`.",
+    "find_symbol": "Find where a function/class/etc with the exact given name is defined, across all files under the home directory. Return file path and line range of each definition.",
+    "search_shell_log": "Search the full output log of a shell window with a regex, like `grep -b`. Unlike polling, it is not limited to the last screenful of output. Each match is returned as `<byte offset>:<line>`.",
 }
 
 class ReadSingleFileParam(BaseModel):
     model_config = dict(extra='forbid')
     filepath : str = Field(description="Path to the file to read. Relative to user home directory. Example: rust_template/src/main.rs (Will get translated to /home/pn/rust_template/src/main.rs by system behind the scene)")
+    start_line : int | None = Field(default=None, description="First line to read (1-based, inclusive). Leave empty to read from the beginning.")
+    end_line : int | None = Field(default=None, description="Last line to read (1-based, inclusive). Leave empty to read until the end.")
+    max_lines : int | None = Field(default=None, description=f"Maximum number of lines to return in one call. Defaults to {READ_DEFAULT_MAX_LINES}.")
+    refresh : bool = Field(default=False, description="Files you have read before are answered with a short note if unchanged, or a diff if changed. Set to true to always get the full content.")
+
+class ReadFilesBatchParam(BaseModel):
+    model_config = dict(extra='forbid')
+    paths : list[str] = Field(description="File paths or glob patterns (`**` for recursive match), relative to user home directory. Example: [\"backend/main.py\", \"frontend/src/*.tsx\"]")
 
 class WriteUnifiedDiffParam(BaseModel):
     model_config = dict(extra='forbid')
@@ -437,6 +2026,27 @@ class PollCommandShellParam(BaseModel):
     shell_name : str = Field(description="Name of the shell to poll from.")
     wait_seconds : int = Field(default=DEFAULT_SLEEP_SECONDS, description="How many seconds to wait before recording the terminal output once.")
 
+class SearchCodeParam(BaseModel):
+    model_config = dict(extra='forbid')
+    pattern : str = Field(description="Python regex to search for, matched line by line. Example: def handle_.*request")
+    path_glob : str = Field(default="", description="Only search files whose path (relative to home directory) matches this glob. Example: backend/**/*.py . Leave empty to search everything.")
+    case_sensitive : bool = Field(default=False, description="Whether the match is case sensitive.")
+
+class OutlineFileParam(BaseModel):
+    model_config = dict(extra='forbid')
+    filepath : str = Field(description="Path to the file to outline. Relative to user home directory.")
+
+class FindSymbolParam(BaseModel):
+    model_config = dict(extra='forbid')
+    name : str = Field(description="Exact name of the function/class/etc. Example: handle_request")
+    path_glob : str = Field(default="", description="Only look in files whose path (relative to home directory) matches this glob. Leave empty to look everywhere.")
+
+class SearchShellLogParam(BaseModel):
+    model_config = dict(extra='forbid')
+    shell_name : str = Field(description="Name of the shell whose log to search.")
+    pattern : str = Field(description="Python regex to search for, matched against each line of output (terminal escape codes stripped).")
+    start_offset : int = Field(default=0, description="Byte offset in the log to start searching from. Use the offset given when a previous search stopped early to continue past it.")
+
 class SignalCompleteParam(BaseModel):
     model_config = dict(extra='forbid')
     repos : list[str] = Field(description="List of git repos to export to the user, specified as path (of the git repo root directory) relative from home directory.")
@@ -448,11 +2058,16 @@ class ReportLivePreviewParam(BaseModel):
 
 
 central_tool_registry.register_tool(name="read_single_file_enriched", desc=tool_descs["read_single_file_enriched"], schema=ReadSingleFileParam, fn=read_single_file_enriched)
+central_tool_registry.register_tool(name="read_files_batch", desc=tool_descs["read_files_batch"], schema=ReadFilesBatchParam, fn=read_files_batch)
 
 central_tool_registry.register_tool(name="execute_command_simple", desc=tool_descs["execute_command_simple"], schema=ExecuteCommandSimpleParam, fn=execute_command_simple)
 central_tool_registry.register_tool(name="execute_command_interactively", desc=tool_descs["execute_command_interactively"], schema=ExecuteCommandInteractiveParam, fn=execute_command_interactively)
 central_tool_registry.register_tool(name="list_command_shell_sessions", desc=tool_descs["list_command_shell_sessions"], schema=ListCommandShellsParam, fn=list_command_shell_sessions)
 central_tool_registry.register_tool(name="poll_interactive_command_shell_output", desc=tool_descs["poll_interactive_command_shell_output"], schema=PollCommandShellParam, fn=poll_interactive_command_shell_output)
+central_tool_registry.register_tool(name="search_code", desc=tool_descs["search_code"], schema=SearchCodeParam, fn=search_code)
+central_tool_registry.register_tool(name="outline_file", desc=tool_descs["outline_file"], schema=OutlineFileParam, fn=outline_file)
+central_tool_registry.register_tool(name="find_symbol", desc=tool_descs["find_symbol"], schema=FindSymbolParam, fn=find_symbol)
+central_tool_registry.register_tool(name="search_shell_log", desc=tool_descs["search_shell_log"], schema=SearchShellLogParam, fn=search_shell_log)
 central_tool_registry.register_tool(name="signal_agent_completed", desc=tool_descs["signal_agent_completed"], schema=SignalCompleteParam, fn=signal_agent_completed)
 central_tool_registry.register_tool(name="report_live_preview_url", desc=tool_descs["report_live_preview_url"], schema=ReportLivePreviewParam, fn=report_live_preview_url)
 
@@ -546,17 +2161,19 @@ On the other hand, from the coding agent domain perspective, the tools can be cl
 
 1. File IO
 
-We settled down on three tools: read_single_file_enriched, write_files_unified_diff, write_single_file_vanilla_fallback.
+We settled down on four tools: read_single_file_enriched, read_files_batch, write_files_unified_diff, write_single_file_vanilla_fallback.
 
-Note that file or directory listing tool is absent because we believe that running suitable command line commands is more flexible, considering the possible variations of what you may exactly want to do. On the other hand, we DO strongly advise using the specialized tool to read file content (use parallel tool call if you want to read multiple files at once), because it will display the file contents annotated with line number. This is especially important because AI has a known weaknesses in keeping track of line numbers, which is essential to using the diff format correctly. For writing file, the tool requires the use of git unified diff format. This has many benefits: you can modify multiple files in one go, and you can skip the parts of the file that remain unchanged. Especially for long file, eliminating this redundancy is crucial because AI may get lost with superflorous repetitions, and because you may drool out when the text simply gets too long. That being said, using the diff format can be tricky and even best faith effort may fail, so we provide an escape hatch as a last resort. You are also allowed to use it in some special cases where it make sense (eg when creating a new file for the first time).
+To locate code, use search_code rather than running grep/find through a command, it is backed by an index and is both faster and cleaner. If you know the name of the function/class you want, find_symbol gives you its exact file and line range directly; outline_file does the same for everything defined in one file. Combine them with a line range read instead of reading whole long files. Note that file or directory listing tool is absent because we believe that running suitable command line commands is more flexible, considering the possible variations of what you may exactly want to do. On the other hand, we DO strongly advise using the specialized tools to read file content (use read_files_batch if you want to read multiple files at once, it accepts glob patterns too), because it will display the file contents annotated with line number. For long files, you can read just the part you need with start_line/end_line; the line numbers are the same as in the full file view. If you read a file again, you will only get a short note when it is unchanged, or a diff against the version you saw last time when it has changed. This is especially important because AI has a known weaknesses in keeping track of line numbers, which is essential to using the diff format correctly. For writing file, the tool requires the use of git unified diff format. This has many benefits: you can modify multiple files in one go, and you can skip the parts of the file that remain unchanged. Especially for long file, eliminating this redundancy is crucial because AI may get lost with superflorous repetitions, and because you may drool out when the text simply gets too long. That being said, using the diff format can be tricky and even best faith effort may fail, so we provide an escape hatch as a last resort. You are also allowed to use it in some special cases where it make sense (eg when creating a new file for the first time).
+
+After each round of tool calls, the last tool result also lists the files that changed in the home dir since your previous turn (including those changed by commands you ran), so you do not need to run git status or ls just to find out.
 
 2. Command execution
 
-There is one simple, plus three for interactive case: execute_command_simple, execute_command_interactively, list_command_shell_sessions, poll_interactive_command_shell_output.
+There is one simple, plus four for interactive case: execute_command_simple, execute_command_interactively, list_command_shell_sessions, poll_interactive_command_shell_output, search_shell_log.
 
 The interactive counterpart is more powerful but more complex, it does have many use cases: for long running/continously running process such as server, when interactive input is needed to operate the program started by the command, or when a persistent shell enviornment is necessary, such as python venv.
 
-You may create and use multiple interactive shell. Shell creation is implicit/implied whenever you specify an unused shell name, while calling the tool with a previously used shell name means sending the inputs/key combos to that existing shell. To see the outputs from an interactive shell, use the polling tool. To avoid the usual over-polling problem, you should set a reasonable wait time parameter.
+You may create and use multiple interactive shell. Shell creation is implicit/implied whenever you specify an unused shell name, while calling the tool with a previously used shell name means sending the inputs/key combos to that existing shell. To see the outputs from an interactive shell, use the polling tool. To avoid the usual over-polling problem, you should set a reasonable wait time parameter. Polling only shows the last screenful of output; to find something further back (eg the first error of a long build log), use search_shell_log, which searches the full output history of the shell.
 
 3. Indicator tools
 
@@ -724,6 +2341,20 @@ CONFIG_DIR = os.path.join( os.path.expanduser("~"), ".minicode")
 LLM_CONFIG_FILE = os.path.join( CONFIG_DIR, "llm_provider_config.json")
 Path(CONFIG_DIR).mkdir(parents=True, exist_ok=True)
 
+session_recorder = StreamingSessionRecorder(console=console, path=os.path.join( CONFIG_DIR, f"session_log_{formatted_date_time}.html" ))
+session_recorder.start()
+
+
+from dataclasses import field
+
+@dataclass
+class LLMEndpoint:
+    name : str
+    base_url : str
+    api_key : str
+    model_id : str
+    extra_body : dict
+    tier : str = "default"
 
 @dataclass
 class LLMConfig:
@@ -731,6 +2362,37 @@ class LLMConfig:
     api_key : str
     model_id : str
     extra_body : dict
+    # Optional additional endpoints to fail over to (eg replica pods, or a hosted gateway as backup).
+    # Each is a dict with base_url, and optionally name, tier, api_key, model_id and extra_body (default to the primary's).
+    endpoints : list = field(default_factory=list)
+    # Endpoints are tagged with a tier (eg "strong", "fast"), and each call site picks which tier it wants.
+    # Call sites: "agent_turn", "forced_tool_call", "final_message". A tier without endpoint falls back to all endpoints.
+    tier : str = "default"
+    call_site_tiers : dict = field(default_factory=dict)
+    # Context budget, should match the served model (eg `-c 88000` of the llama.cpp pod). Tokenizer is a HF hub repo id.
+    context_window : int = 88000
+    reserved_output_tokens : int = 8192
+    tokenizer : str = "Qwen/Qwen3-Coder-30B-A3B-Instruct"
+    # "split": a turn is one call without tools for the reasoning, then a forced tool call re-sending the whole conversation.
+    # "single": one call with tool_choice auto, the forced call is only made when the model did not call any tool.
+    turn_strategy : str = "split"
+    # Send a duplicate request to a second endpoint when the first one is slower than its usual (percentile) latency
+    hedge : bool = False
+    hedge_percentile : float = 0.9
+
+    def get_endpoints(self):
+        primary = LLMEndpoint(name="primary", base_url=self.base_url, api_key=self.api_key, model_id=self.model_id, extra_body=self.extra_body, tier=self.tier)
+        endpoints = [primary]
+        for i, endpoint in enumerate(self.endpoints, start=1):
+            endpoints.append(LLMEndpoint(
+                name=endpoint.get("name", f"endpoint_{i}"),
+                base_url=endpoint["base_url"],
+                api_key=endpoint.get("api_key", primary.api_key),
+                model_id=endpoint.get("model_id", primary.model_id),
+                extra_body=endpoint.get("extra_body", primary.extra_body),
+                tier=endpoint.get("tier", primary.tier),
+            ))
+        return endpoints
 
 # Eg 1: llama.cpp
 # extra_body = { "parse_tool_calls": True }
@@ -763,20 +2425,589 @@ llm_config = obtain_llm_config(console=console)
 console.log("LLM Provider configured.")
 console.log("Initializing OpenAI client...")
 
+"""
+LLM transport
+
+One explicitly configured httpx client shared by every OpenAI client, so that calls reuse warm keep-alive connections
+instead of paying the TCP/TLS handshake each time. HTTP/2 is used when the h2 package is installed and the endpoint negotiates it.
+"""
+
+import importlib.util
+import httpx
+
+LLM_HTTP_MAX_CONNECTIONS = 16
+LLM_HTTP_MAX_KEEPALIVE_CONNECTIONS = 8
+LLM_HTTP_KEEPALIVE_EXPIRY = 120
+LLM_HTTP_CONNECT_TIMEOUT = 10
+# Long, as a thinking model can be silent for minutes before the (non-streaming) response
+LLM_HTTP_READ_TIMEOUT = 600
+LLM_HTTP2 = importlib.util.find_spec("h2") is not None
+
+class TransportMetrics:
+    """
+    Request/response event hooks, to see whether connections are actually reused and how long endpoints take to answer.
+    """
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.n_requests = 0
+        self.n_errors = 0
+        self.total_ttfb = 0.0
+        self.max_ttfb = 0.0
+        self.status_counts = defaultdict(int)
+        self.http_versions = defaultdict(int)
+
+    def on_request(self, request):
+        request.extensions["start_time"] = time.perf_counter()
+        with self.lock:
+            self.n_requests += 1
+
+    def on_response(self, response):
+        # Called once the headers are in, so this is the time to first byte (for non-streaming calls, nearly the full latency)
+        ttfb = time.perf_counter() - response.request.extensions.get("start_time", time.perf_counter())
+        with self.lock:
+            self.total_ttfb += ttfb
+            self.max_ttfb = max(self.max_ttfb, ttfb)
+            self.status_counts[response.status_code] += 1
+            self.http_versions[response.http_version] += 1
+            if response.status_code >= 400:
+                self.n_errors += 1
+
+    def summary(self):
+        with self.lock:
+            n_responses = sum(self.status_counts.values())
+            avg_ttfb = self.total_ttfb / n_responses if n_responses else 0
+            return (f"LLM HTTP: {self.n_requests} requests, {n_responses} responses ({self.n_errors} errors), "
+                f"avg TTFB {avg_ttfb:.2f}s, max {self.max_ttfb:.2f}s, status {dict(self.status_counts)}, protocol {dict(self.http_versions)}")
+
+
+def create_llm_http_client(metrics, max_connections=LLM_HTTP_MAX_CONNECTIONS, max_keepalive_connections=LLM_HTTP_MAX_KEEPALIVE_CONNECTIONS):
+    return httpx.Client(
+        http2=LLM_HTTP2,
+        limits=httpx.Limits(max_connections=max_connections, max_keepalive_connections=max_keepalive_connections, keepalive_expiry=LLM_HTTP_KEEPALIVE_EXPIRY),
+        timeout=httpx.Timeout(LLM_HTTP_READ_TIMEOUT, connect=LLM_HTTP_CONNECT_TIMEOUT),
+        event_hooks={ "request": [metrics.on_request], "response": [metrics.on_response] },
+    )
+
+
+llm_transport_metrics = TransportMetrics()
+llm_http_client = create_llm_http_client(llm_transport_metrics)
+
 import openai
 from openai import OpenAI
 
-cli = OpenAI(base_url=llm_config.base_url, api_key=llm_config.api_key)
 
-console.log(f"OpenAI client version {openai.__version__} initialized.")
+"""
+Resilient LLM calls
+
+Every endpoint gets its own circuit breaker and latency history. Transient failures (connection errors, timeouts, 429, 5xx)
+are retried with jittered exponential backoff, moving on to the next healthy endpoint, so that one 502 does not kill a long session.
+Retries are done here rather than by the OpenAI SDK (max_retries=0), as only we know about the other endpoints.
+
+Within the tier asked for by the call site, calls are routed to the endpoint with the lowest expected wait,
+ie EWMA latency scaled by the number of calls already in flight there, so that replicas share the load.
+"""
+
+from concurrent.futures import wait, as_completed
+
+from tenacity import Retrying, retry_if_exception, stop_after_attempt, wait_random_exponential
+
+LLM_MAX_ATTEMPTS = 5
+LLM_RETRY_MAX_WAIT = 30
+LLM_BREAKER_FAILURE_THRESHOLD = 3
+LLM_BREAKER_COOLDOWN_SECONDS = 60
+LLM_LATENCY_HISTORY = 50
+LLM_HEDGE_MIN_SAMPLES = 5
+LLM_EWMA_ALPHA = 0.3
+
+class NoHealthyEndpointError(RuntimeError):
+    pass
+
+def is_retryable_llm_error(e):
+    if isinstance(e, (openai.APIConnectionError, openai.APITimeoutError, NoHealthyEndpointError)):
+        return True
+    if isinstance(e, openai.APIStatusError):
+        return e.status_code in (408, 409, 429) or e.status_code >= 500
+    return False
+
+class CircuitBreaker:
+    """
+    Closed: calls go through. Open (after too many consecutive failures): calls are skipped until the cooldown is over.
+    Half open: one trial call is let through, its outcome closes or re-opens the breaker.
+    """
+    def __init__(self, failure_threshold=LLM_BREAKER_FAILURE_THRESHOLD, cooldown_seconds=LLM_BREAKER_COOLDOWN_SECONDS):
+        self.failure_threshold = failure_threshold
+        self.cooldown_seconds = cooldown_seconds
+        self.lock = threading.Lock()
+        self.n_failures = 0
+        self.opened_at = None
+        self.trial_in_flight = False
+
+    def allow(self):
+        with self.lock:
+            if self.opened_at is None:
+                return True
+            if time.monotonic() - self.opened_at < self.cooldown_seconds or self.trial_in_flight:
+                return False
+            self.trial_in_flight = True
+            return True
+
+    def record_success(self):
+        with self.lock:
+            self.n_failures = 0
+            self.opened_at = None
+            self.trial_in_flight = False
+
+    def record_failure(self):
+        with self.lock:
+            self.n_failures += 1
+            self.trial_in_flight = False
+            if self.n_failures >= self.failure_threshold or self.opened_at is not None:
+                self.opened_at = time.monotonic()
+
+    def release_trial(self):
+        # The call let through never reached the endpoint (answered from cache), so it tells nothing either way
+        with self.lock:
+            self.trial_in_flight = False
+
+    def state(self):
+        with self.lock:
+            if self.opened_at is None:
+                return "closed"
+            return "half-open" if time.monotonic() - self.opened_at >= self.cooldown_seconds else "open"
+
+class EndpointState:
+    def __init__(self, endpoint, http_client):
+        self.endpoint = endpoint
+        self.name = endpoint.name
+        self.client = OpenAI(base_url=endpoint.base_url, api_key=endpoint.api_key, http_client=http_client, max_retries=0)
+        self.breaker = CircuitBreaker()
+        self.latencies = deque(maxlen=LLM_LATENCY_HISTORY)
+        self.ewma_latency = None
+        self.ewma_tokens_per_second = None
+        self.n_inflight = 0
+        self.lock = threading.Lock()
+
+    def record_latency(self, seconds, n_output_tokens=None):
+        with self.lock:
+            self.latencies.append(seconds)
+            self.ewma_latency = seconds if self.ewma_latency is None else LLM_EWMA_ALPHA * seconds + (1 - LLM_EWMA_ALPHA) * self.ewma_latency
+            if n_output_tokens and seconds > 0:
+                rate = n_output_tokens / seconds
+                self.ewma_tokens_per_second = rate if self.ewma_tokens_per_second is None else LLM_EWMA_ALPHA * rate + (1 - LLM_EWMA_ALPHA) * self.ewma_tokens_per_second
+
+    def expected_wait(self):
+        # Endpoints without any sample yet go first, so that every replica gets measured
+        with self.lock:
+            if self.ewma_latency is None:
+                return self.n_inflight * 1e-3
+            return self.ewma_latency * (1 + self.n_inflight)
+
+    def latency_percentile(self, percentile):
+        with self.lock:
+            if len(self.latencies) < LLM_HEDGE_MIN_SAMPLES:
+                return None
+            ordered = sorted(self.latencies)
+        return ordered[min(len(ordered) - 1, int(percentile * len(ordered)))]
+
+class ResilientLLMClient:
+    def __init__(self, endpoints, http_client, hedge=False, hedge_percentile=0.9, max_attempts=LLM_MAX_ATTEMPTS, response_cache=None):
+        self.endpoints = [EndpointState(endpoint, http_client) for endpoint in endpoints]
+        self.hedge = hedge
+        self.hedge_percentile = hedge_percentile
+        self.max_attempts = max_attempts
+        self.response_cache = response_cache
+        self.executor = ThreadPoolExecutor(max_workers=2 * len(self.endpoints) + 2, thread_name_prefix="llm-call")
+
+    def call_endpoint(self, state, request_kwargs):
+        endpoint = state.endpoint
+        kwargs = dict(request_kwargs)
+        kwargs["model"] = endpoint.model_id
+        kwargs["extra_body"] = { **(endpoint.extra_body or {}), **(request_kwargs.get("extra_body") or {}) }
+        if self.response_cache is None or kwargs.get("stream"):
+            return self.dispatch(state, kwargs)
+        # Keyed on the request as sent to this endpoint (its URL, model and extra body), so different models never share answers
+        key = self.response_cache.request_key({ **kwargs, "base_url": endpoint.base_url })
+        res = self.response_cache.lookup(key)
+        if res is not None:
+            state.breaker.release_trial()
+            return res
+        res = self.dispatch(state, kwargs)
+        self.response_cache.put(key, res)
+        return res
+
+    def dispatch(self, state, kwargs):
+        with state.lock:
+            state.n_inflight += 1
+        start_time = time.perf_counter()
+        # Every outcome is recorded, otherwise a half open breaker would wait for its trial call forever.
+        # A non retryable error (eg 400) is a problem with the request, the endpoint itself answered fine.
+        endpoint_ok = False
+        try:
+            res = state.client.chat.completions.create(**kwargs)
+            endpoint_ok = True
+        except Exception as e:
+            endpoint_ok = not is_retryable_llm_error(e)
+            raise
+        finally:
+            with state.lock:
+                state.n_inflight -= 1
+            if endpoint_ok:
+                state.breaker.record_success()
+            else:
+                state.breaker.record_failure()
+        state.record_latency(time.perf_counter() - start_time, res.usage.completion_tokens if res.usage else None)
+        return res
+
+    def pick_endpoints(self, attempt_no, tier="default"):
+        in_tier = [state for state in self.endpoints if state.endpoint.tier == tier] or self.endpoints
+        healthy = [state for state in in_tier if state.breaker.state() != "open"]
+        if not healthy:
+            raise NoHealthyEndpointError(f"All LLM endpoints for tier {tier} are failing, circuit breakers are open.")
+        healthy.sort(key=lambda state: state.expected_wait())
+        # Rotate the preference order on retries, so that a retry goes to another endpoint when there is one
+        shift = (attempt_no - 1) % len(healthy)
+        return healthy[shift:] + healthy[:shift]
+
+    @staticmethod
+    def next_allowed(candidates):
+        # allow() takes the trial slot of a half open breaker, so only ask for an endpoint that is then really called
+        while candidates:
+            state = candidates.pop(0)
+            if state.breaker.allow():
+                return state
+        return None
+
+    def call_once(self, request_kwargs, attempt_no, tier="default"):
+        candidates = self.pick_endpoints(attempt_no, tier)
+        primary = self.next_allowed(candidates)
+        if primary is None:
+            raise NoHealthyEndpointError("All LLM endpoints are failing, circuit breakers are open.")
+        threshold = primary.latency_percentile(self.hedge_percentile) if self.hedge and candidates else None
+        if threshold is None:
+            return self.call_endpoint(primary, request_kwargs)
+        first = self.executor.submit(self.call_endpoint, primary, request_kwargs)
+        done, _ = wait([first], timeout=threshold)
+        if done:
+            return first.result()
+        secondary = self.next_allowed(candidates)
+        if secondary is None:
+            return first.result()
+        console.log(f"[yellow]LLM endpoint {primary.name} slower than its p{int(self.hedge_percentile * 100)} ({threshold:.1f}s), hedging with {secondary.name}...")
+        second = self.executor.submit(self.call_endpoint, secondary, request_kwargs)
+        # First success wins, the other one is left to finish in the background and ignored
+        errors = []
+        for future in as_completed([first, second]):
+            try:
+                return future.result()
+            except Exception as e:
+                errors.append(e)
+        raise errors[0]
+
+    def create(self, tier="default", **request_kwargs):
+        retrying = Retrying(
+            retry=retry_if_exception(is_retryable_llm_error),
+            wait=wait_random_exponential(multiplier=1, max=LLM_RETRY_MAX_WAIT),
+            stop=stop_after_attempt(self.max_attempts),
+            before_sleep=lambda x: console.log(f"[yellow]LLM call failed ({x.outcome.exception()}), retrying in {x.next_action.sleep:.1f}s..."),
+            reraise=True,
+        )
+        for attempt in retrying:
+            with attempt:
+                return self.call_once(request_kwargs, attempt.retry_state.attempt_number, tier)
+
+    def summary(self):
+        parts = []
+        for state in self.endpoints:
+            stats = [state.endpoint.tier, state.breaker.state(), f"{len(state.latencies)} calls"]
+            if state.ewma_latency is not None:
+                stats.append(f"ewma {state.ewma_latency:.1f}s")
+            if state.ewma_tokens_per_second is not None:
+                stats.append(f"{state.ewma_tokens_per_second:.0f} tok/s")
+            parts.append(f"{state.name} ({', '.join(stats)})")
+        return "LLM endpoints: " + ", ".join(parts)
+
+
+llm_client = ResilientLLMClient(endpoints=llm_config.get_endpoints(), http_client=llm_http_client, hedge=llm_config.hedge, hedge_percentile=llm_config.hedge_percentile)
+
+console.log(f"OpenAI client version {openai.__version__} initialized with {len(llm_client.endpoints)} endpoint(s) (HTTP/2 {'enabled' if LLM_HTTP2 else 'unavailable, h2 not installed'}).")
+
+
+"""
+LLM response cache (opt-in, for development)
+
+Set MINICODE_LLM_CACHE=1 to replay identical LLM calls from disk, so that re-running a session up to a given turn is nearly instant and free.
+"""
+
+from openai.types.chat import ChatCompletion
+
+LLM_CACHE_ENABLED = os.environ.get("MINICODE_LLM_CACHE", "") not in ("", "0")
+LLM_CACHE_DIR = os.environ.get("MINICODE_LLM_CACHE_DIR", os.path.join( CONFIG_DIR, "llm_cache"))
+LLM_CACHE_MAX_BYTES = int(os.environ.get("MINICODE_LLM_CACHE_MAX_MB", "512")) * 1024 * 1024
+
+class LLMResponseCache:
+    """
+    Disk backed cache of chat completion responses, keyed by a canonical hash of the whole request (model, messages, tools, sampling params)
+    as sent to one endpoint. Used by ResilientLLMClient.call_endpoint, the only place that knows which endpoint and model serve a call.
+    Meant for development runs: an identical request replays the stored response, even if sampling is not deterministic.
+    Size bounded, least recently used entries (by file mtime, which is touched on every hit) are evicted first.
+    """
+    def __init__(self, cache_dir, max_bytes):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.lock = threading.Lock()
+        self.n_hits = 0
+        self.n_misses = 0
+        Path(cache_dir).mkdir(parents=True, exist_ok=True)
+        self.total_bytes = sum(entry.stat().st_size for entry in Path(cache_dir).glob("*/*.json"))
+
+    @staticmethod
+    def request_key(request_kwargs):
+        canonical = json.dumps(request_kwargs, sort_keys=True, separators=(",", ":"), ensure_ascii=False,
+            default=lambda x: x.model_dump() if hasattr(x, "model_dump") else str(x))
+        return hashlib.sha256(canonical.encode("utf-8")).hexdigest()
+
+    def entry_path(self, key):
+        return os.path.join(self.cache_dir, key[:2], f"{key}.json")
+
+    def get(self, key):
+        path = self.entry_path(key)
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                data = f.read()
+            os.utime(path)
+        except FileNotFoundError:
+            return None
+        return ChatCompletion.model_validate_json(data)
+
+    def put(self, key, response):
+        path = self.entry_path(key)
+        data = response.model_dump_json().encode("utf-8")
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with tempfile.NamedTemporaryFile(mode="wb", dir=os.path.dirname(path), delete=False) as tmp_file:
+            tmp_file.write(data)
+        os.replace(tmp_file.name, path)
+        with self.lock:
+            self.total_bytes += len(data)
+            if self.total_bytes > self.max_bytes:
+                self.evict()
+
+    def evict(self):
+        # Down to 90% so that we don't rescan on every put once full
+        entries = sorted(((entry.stat().st_mtime, entry.stat().st_size, entry) for entry in Path(self.cache_dir).glob("*/*.json")), key=lambda x: x[0])
+        self.total_bytes = sum(size for _, size, _ in entries)
+        for _, size, entry in entries:
+            if self.total_bytes <= self.max_bytes * 0.9:
+                break
+            entry.unlink(missing_ok=True)
+            self.total_bytes -= size
+
+    def lookup(self, key):
+        response = self.get(key)
+        with self.lock:
+            if response is not None:
+                self.n_hits += 1
+            else:
+                self.n_misses += 1
+        return response
+
+    def summary(self):
+        return f"LLM cache: {self.n_hits} hits, {self.n_misses} misses, {self.total_bytes / 1024 / 1024:.1f} MiB on disk in {self.cache_dir}"
+
+
+llm_response_cache = LLMResponseCache(cache_dir=LLM_CACHE_DIR, max_bytes=LLM_CACHE_MAX_BYTES) if LLM_CACHE_ENABLED else None
+if llm_response_cache is not None:
+    llm_client.response_cache = llm_response_cache
+    console.log(f"[bold yellow]LLM response cache enabled ({LLM_CACHE_DIR}), identical requests will be replayed.")
 
 from tenacity import retry, wait_exponential
 
 @retry(wait=wait_exponential(multiplier=1, min=4, max=20),
     before_sleep=lambda x: console.log("retrying..."))
 def smoke_test():
-    res = cli.chat.completions.create(model=llm_config.model_id, messages=[{"role": "user", "content": "this is a test, just say hi to me."}], stream=False)
-    console.log(res)
+    # Check every endpoint directly, one working endpoint is enough to start
+    n_healthy = 0
+    for state in llm_client.endpoints:
+        try:
+            res = llm_client.call_endpoint(state, { "messages": [{"role": "user", "content": "this is a test, just say hi to me."}], "stream": False })
+            console.log(f"Endpoint {state.name} OK:", res)
+            n_healthy += 1
+        except Exception as e:
+            console.log(f"[red]Endpoint {state.name} failed: {e}")
+    if n_healthy == 0:
+        raise NoHealthyEndpointError("No LLM endpoint is reachable.")
+
+
+"""
+Token budget
+
+Know the request size locally before the network call, instead of finding out when the server rejects it or slows to a crawl.
+Uses the HF tokenizer of the served model when the `tokenizers` package is installed (and the tokenizer can be fetched),
+otherwise a conservative chars per token estimate.
+"""
+
+import math
+
+try:
+    from tokenizers import Tokenizer
+except ImportError:
+    Tokenizer = None
+
+# Chat template tokens around each message/tool call (role markers etc), roughly
+MESSAGE_OVERHEAD_TOKENS = 8
+FALLBACK_CHARS_PER_TOKEN = 3
+TOKEN_COUNT_CACHE_SIZE = 20000
+# Recent messages are never elided to fit the budget
+BUDGET_KEEP_RECENT_MESSAGES = 6
+BUDGET_ELIDE_MIN_TOKENS = 200
+# Tools whose outputs the read cache refers back to
+READ_TOOL_NAMES = { "read_single_file_enriched", "read_files_batch" }
+# When the latest tool outputs alone blow the budget, they are cut down to share this fraction of it
+BUDGET_LAST_TOOL_OUTPUTS_SHARE = 0.25
+BUDGET_CUT_NOTE = "[system] Output cut to fit the context budget. Narrow down what you ask for (line ranges, search_code, grep etc) to see the rest."
+
+class ContextBudgetExceeded(RuntimeError):
+    pass
+
+def load_tokenizer(tokenizer_name):
+    if Tokenizer is None or not tokenizer_name:
+        return None
+    try:
+        return Tokenizer.from_pretrained(tokenizer_name)
+    except Exception:
+        return None
+
+class TokenBudget:
+    """
+    Count the tokens of a request before sending it. Counts are cached per message (by content hash),
+    so that as the conversation grows only the new messages need to be tokenized.
+    """
+    def __init__(self, tokenizer, ceiling, cache_size=TOKEN_COUNT_CACHE_SIZE):
+        self.tokenizer = tokenizer
+        self.ceiling = ceiling
+        self.cache = OrderedDict()
+        self.cache_size = cache_size
+        self.lock = threading.Lock()
+
+    def count_text(self, text):
+        if not text:
+            return 0
+        if self.tokenizer is None:
+            return math.ceil(len(text) / FALLBACK_CHARS_PER_TOKEN)
+        return len(self.tokenizer.encode(text, add_special_tokens=False).ids)
+
+    def cached_count(self, obj, count_fn):
+        if hasattr(obj, "model_dump"):
+            obj = obj.model_dump()
+        key = hashlib.sha256(json.dumps(obj, sort_keys=True, ensure_ascii=False, default=str).encode("utf-8")).hexdigest()
+        with self.lock:
+            if key in self.cache:
+                self.cache.move_to_end(key)
+                return self.cache[key]
+        n_tokens = count_fn(obj)
+        with self.lock:
+            self.cache[key] = n_tokens
+            if len(self.cache) > self.cache_size:
+                self.cache.popitem(last=False)
+        return n_tokens
+
+    def count_message(self, message):
+        def count_fn(message):
+            content = message.get("content")
+            n_tokens = MESSAGE_OVERHEAD_TOKENS + self.count_text(content if isinstance(content, str) else json.dumps(content))
+            n_tokens += self.count_text(message.get("reasoning_content"))
+            for tool_call in message.get("tool_calls") or []:
+                n_tokens += MESSAGE_OVERHEAD_TOKENS + self.count_text(tool_call["function"]["name"]) + self.count_text(tool_call["function"]["arguments"])
+            return n_tokens
+        return self.cached_count(message, count_fn)
+
+    def count_request(self, messages, tools=None):
+        n_tokens = sum(self.count_message(message) for message in messages)
+        if tools:
+            n_tokens += self.cached_count(tools, lambda tools: self.count_text(json.dumps(tools)))
+        return n_tokens
+
+    def truncate_text(self, text, max_tokens):
+        """
+        Return (text cut to at most max_tokens, whether it was cut).
+        """
+        if self.tokenizer is None:
+            max_chars = int(max_tokens * FALLBACK_CHARS_PER_TOKEN)
+            return text[:max_chars], len(text) > max_chars
+        encoding = self.tokenizer.encode(text, add_special_tokens=False)
+        if len(encoding.ids) <= max_tokens:
+            return text, False
+        return text[:encoding.offsets[max_tokens][0]], True
+
+
+def fit_conversation_to_budget(messages, tools=None):
+    """
+    Return (messages, n_tokens) within the budget ceiling. When over, the outputs of the oldest tool calls are elided
+    (in the copy sent to the LLM only, the conversation itself is untouched) until it fits.
+    """
+    n_tokens = token_budget.count_request(messages, tools)
+    if n_tokens <= token_budget.ceiling:
+        return messages, n_tokens
+    messages = list(messages)
+    n_elided = 0
+    tool_names = {}
+    turn = 0
+    for i in range(len(messages) - BUDGET_KEEP_RECENT_MESSAGES):
+        if n_tokens <= token_budget.ceiling:
+            break
+        message = messages[i]
+        if message.get("role") == "assistant":
+            # One assistant message per agent turn
+            turn += 1
+            for tool_call in message.get("tool_calls") or []:
+                tool_names[tool_call["id"]] = tool_call["function"]["name"]
+        if message.get("role") != "tool":
+            continue
+        n_message_tokens = token_budget.count_message(message)
+        if n_message_tokens < BUDGET_ELIDE_MIN_TOKENS:
+            continue
+        messages[i] = { **message, "content": f"[system] Tool output elided ({n_message_tokens} tokens) to fit the context budget. Re-run the tool if you still need it." }
+        n_tokens += token_budget.count_message(messages[i]) - n_message_tokens
+        n_elided += 1
+        if tool_names.get(message.get("tool_call_id")) in READ_TOOL_NAMES:
+            # Otherwise a re-read would be answered with "unchanged since turn N" pointing at the elided output
+            read_cache.forget_turn(turn)
+    if n_tokens > token_budget.ceiling:
+        raise ContextBudgetExceeded(f"Request has {n_tokens} tokens, over the budget of {token_budget.ceiling} even after eliding {n_elided} old tool outputs.")
+    console.log(f"[yellow]Context budget: elided {n_elided} old tool outputs, request is now {n_tokens} tokens.")
+    return messages, n_tokens
+
+def truncate_last_tool_outputs(messages):
+    """
+    The recent messages are never elided, so a single huge tool output can keep the request over the budget.
+    Cut the outputs of the last turn's tool calls (in the conversation itself, and telling the agent), return whether any was cut.
+    """
+    last_assistant = next((i for i in range(len(messages) - 1, -1, -1) if messages[i].get("role") == "assistant"), None)
+    if last_assistant is None:
+        return False
+    tool_names = { tool_call["id"]: tool_call["function"]["name"] for tool_call in messages[last_assistant].get("tool_calls") or [] }
+    tool_indices = [i for i in range(last_assistant + 1, len(messages)) if messages[i].get("role") == "tool"]
+    if not tool_indices:
+        return False
+    # Same turn numbering as the read cache, one assistant message per agent turn
+    turn = sum(1 for message in messages[:last_assistant + 1] if message.get("role") == "assistant")
+    max_tokens = max(int(token_budget.ceiling * BUDGET_LAST_TOOL_OUTPUTS_SHARE) // len(tool_indices), BUDGET_ELIDE_MIN_TOKENS)
+    any_cut = False
+    for i in tool_indices:
+        if messages[i]["content"].endswith(BUDGET_CUT_NOTE):
+            continue
+        text, is_cut = token_budget.truncate_text(messages[i]["content"], max_tokens)
+        if not is_cut:
+            continue
+        any_cut = True
+        messages[i] = { **messages[i], "content": f"{text}\n--\n{BUDGET_CUT_NOTE}" }
+        if tool_names.get(messages[i]["tool_call_id"]) in READ_TOOL_NAMES:
+            # The read cache must not claim the agent has seen the whole file
+            read_cache.forget_turn(turn)
+    return any_cut
+
+
+token_budget = TokenBudget(tokenizer=load_tokenizer(llm_config.tokenizer), ceiling=llm_config.context_window - llm_config.reserved_output_tokens)
+console.log(f"Token budget: {token_budget.ceiling} tokens per request, counted with {'tokenizer ' + llm_config.tokenizer if token_budget.tokenizer is not None else 'a chars/token estimate (tokenizer unavailable)'}.")
 
 
 """
@@ -787,25 +3018,34 @@ from rich.markdown import Markdown
 from rich.pretty import Pretty
 
 
-def main_call_llm(message_list, tool_required=True):
-    if tool_required:
-        tool_choice = "required"
-    else:
-        tool_choice = "none"
-    #tool_choice = "auto"
-    with console.status("[bold green]LLM is thinking...", spinner='dots2') as status:
-        res = cli.chat.completions.create(
+def main_call_llm(message_list, tool_required=True, call_site="agent_turn", tool_choice=None):
+    if tool_choice is None:
+        tool_choice = "required" if tool_required else "none"
+    tool_list = central_tool_registry.get_tool_list()
+    message_list, n_tokens = fit_conversation_to_budget(message_list, tool_list)
+    with console.status(f"[bold green]LLM is thinking... ({n_tokens / 1000:.1f}k tokens)", spinner='dots2') as status:
+        res = llm_client.create(
+            tier=llm_config.call_site_tiers.get(call_site, llm_config.tier),
             model=llm_config.model_id,
             messages=message_list,
-            tools=central_tool_registry.get_tool_list(),
+            tools=tool_list,
             parallel_tool_calls=True,
             tool_choice=tool_choice,
-            extra_body=llm_config.extra_body,
             stream=False,
         )
     return res
 
 
+def main_call_llm_within_budget(message_list, **kwargs):
+    try:
+        return main_call_llm(message_list, **kwargs)
+    except ContextBudgetExceeded as e:
+        if not truncate_last_tool_outputs(message_list):
+            raise
+        console.log(f"[yellow]{e} Cut down the last tool outputs and retrying.")
+        return main_call_llm(message_list, **kwargs)
+
+
 conversation = [
     { "role": "system", "content": construct_system_prompt() }
 ]
@@ -813,28 +3053,35 @@ conversation = [
 TERMINATOR_TOOL_NAME = "signal_agent_completed"
 
 def main_agent_loop():
+    global agent_turn_no
     done = False
     while not done:
+        agent_turn_no += 1
         # Call LLM
-        res = main_call_llm(conversation, tool_required=False) # will be False if 2 round method
+        if llm_config.turn_strategy == "single":
+            # Reasoning text and tool calls in one generation
+            res = main_call_llm_within_budget(conversation, tool_choice="auto")
+        else:
+            res = main_call_llm_within_budget(conversation, tool_required=False)
         conversation.append(res.choices[0].message.model_dump())
         # Frontend hook: print content
-        console.print( Markdown( str(res.choices[0].message.content) ))
-        # Second round to enforce tool calling if using split method
-        #res = main_call_llm(conversation)
-        if res.choices[0].finish_reason != 'tool_calls':
-            # New fix
-            res2 = main_call_llm(conversation, tool_required=True)
-            conversation[-1]["tool_calls"] = [ x.model_dump() for x in res2.choices[0].message.tool_calls ]
+        if res.choices[0].message.content:
+            renderer.print( Markdown( clip_text(str(res.choices[0].message.content)) ))
+        tool_calls = res.choices[0].message.tool_calls
+        # Second round to enforce tool calling: always in split method, and as fallback when the model only talked in single method
+        if not tool_calls:
+            res2 = main_call_llm_within_budget(conversation, tool_required=True, call_site="forced_tool_call")
+            tool_calls = res2.choices[0].message.tool_calls
+            conversation[-1]["tool_calls"] = [ x.model_dump() for x in tool_calls ]
         
         #conversation.append(res.choices[0].message) #Second round append
         # Parallel tool call
-        for idx, tool_call in enumerate(res.choices[0].message.tool_calls):
+        for idx, tool_call in enumerate(tool_calls):
             fn = tool_call.function
             f_args = json.loads(fn.arguments)
             f_id = tool_call.id
             # Frontend hook: print tool call
-            console.print( Panel( Pretty(f_args), title=f"Tool call: {fn.name}") )
+            renderer.print( Panel( Pretty(clip_pretty(f_args)), title=f"Tool call: {fn.name}") )
             # Backend: run the tool
             # First check if it is edit mode tool
             tool_meta = central_tool_registry.get_metadata(fn.name) #DONE
@@ -847,12 +3094,12 @@ def main_agent_loop():
             #    # Frontend hook: display
             #    rich_print_source_code(console=console, content=additional_arg) #TODO: hardcode as we know it must be file, but in future?
             if "editmode" in tool_meta:
-                rich_print_source_code(console=console, content=f_args[tool_meta["editmode"]["param_name"]])
+                rich_print_source_code(console=console, content=f_args[tool_meta["editmode"]["param_name"]], filepath=f_args.get("filepath"))
             # Then actual call
             with console.status(f"[bold blue]Calling tool {fn.name}...", spinner='dots2') as status:
                 f_ret = central_tool_registry.call_tool_dynamic_single_sync_raw(fn.name, f_args)
             # Frontend hook: just print
-            console.print( Panel( f_ret, title=f"Tool call result for {fn.name}"))
+            renderer.print( text_panel(f_ret, title=f"Tool call result for {fn.name}"))
             # Backend: append reply to prepare next round
             conversation.append({ "role": "tool", "tool_call_id": f_id, "content": f_ret })
             # Check terminal state
@@ -862,14 +3109,20 @@ def main_agent_loop():
             time.sleep(1)
             #if not done:
             #    conversation.append({ "role": "user", "content": next_turn_prompt })
+        # Tell the agent what changed on disk, so it does not need a `git status` round trip for that
+        changes_summary = summarize_changes_since_last_turn()
+        if changes_summary is not None and conversation[-1]["role"] == "tool":
+            conversation[-1]["content"] = f"{conversation[-1]['content']}\n\n{changes_summary}"
+            renderer.print( text_panel(changes_summary, title="Files changed"))
         #else:
         #    # TODO: should be impossible but what if provider doesn't fully comply with OpenAI spec
         #    raise ValueError("Opps")
     # One last round
+    renderer.flush()
     console.rule("[bold green]Task completed!")
     console.print("LLM will now generates a final hand-off message...")
     conversation.append({ "role": "user", "content": final_prompt })
-    res_final = main_call_llm(conversation, tool_required=False)
+    res_final = main_call_llm_within_budget(conversation, tool_required=False, call_site="final_message")
     console.print( Markdown( str(res_final.choices[0].message.content) ))
 
 
@@ -880,9 +3133,21 @@ try:
     console.log("Health check LLM API...")
     smoke_test()
     main_agent_loop()
-    console.save_html(path= os.path.join( CONFIG_DIR, f"session_log_{formatted_date_time}.html" ))
+except ContextBudgetExceeded as e:
+    # Nothing left to cut, the conversation does not fit anymore. End the session cleanly, the work on disk is kept
+    console.rule("[bold red]Context budget exceeded")
+    console.log(f"[red]{e} Stopping the session.")
 finally:
+    renderer.stop()
     console.log(conversation)
     with open(os.path.join( CONFIG_DIR, f"debug_dump_{formatted_date_time}.json"), "w", encoding="utf-8") as f:
         json.dump(conversation, f)
+    bind_mount_watcher.stop()
+    console.log(llm_client.summary())
+    console.log(llm_transport_metrics.summary())
+    if llm_response_cache is not None:
+        console.log(llm_response_cache.summary())
+    llm_http_client.close()
     sandbox.stop_session()
+    # Last, so that everything logged above still makes it into the session log
+    session_recorder.close()
@@ -0,0 +1,339 @@
+"""
+Mock OpenAI compatible LLM server, for offline end-to-end benchmark of the agent loop / chatbot without a GPU endpoint.
+
+Replays a recorded session, with a configurable latency model (time to first token + tokens per second) so that
+orchestration overhead, tool latency and concurrency scaling can be measured on a plain CPU box.
+Only the standard library is used.
+
+Sources to replay (pick one):
+- `--conversation debug_dump_xxx.json`: the conversation dump written by main_v2_2.py at exit.
+- `--journal journal.jsonl`: request/response pairs, recorded by running this server as a proxy with `--record --upstream <base url>`.
+- `--markdown a.md b.md`: each file is one plain assistant answer (eg the qwen3_coder_30b_smoke_test_result transcript).
+
+The n-th assistant turn of the recording answers a request that already contains n assistant messages,
+so replay is stateless and works for any number of concurrent clients. `tool_choice` is respected:
+"none" only returns the content, "required" only the tool calls, "auto" returns both.
+
+Example:
+    python mock_openai_server.py --conversation ~/.minicode/debug_dump_20250101_120000.json --ttft-ms 400 --tokens-per-second 60
+"""
+
+import argparse
+import hashlib
+import json
+import random
+import threading
+import time
+import urllib.request
+import uuid
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+
+def estimate_tokens(text):
+    # Good enough for latency modelling, roughly 4 chars per token for English and code
+    return max(1, len(text) // 4) if text else 0
+
+def request_key(request):
+    canonical = json.dumps({ k: v for k, v in request.items() if k not in ("stream", "stream_options") }, sort_keys=True, separators=(",", ":"), ensure_ascii=False)
+    return hashlib.sha256(canonical.encode("utf-8")).hexdigest()
+
+def placeholder_arguments(schema):
+    # Minimal valid arguments for a tool, used when the recording has no tool call to give
+    defaults = { "string": "", "integer": 0, "number": 0, "boolean": False, "array": [], "object": {} }
+    properties = schema.get("properties", {})
+    return { name: properties[name].get("default", defaults.get(properties[name].get("type"), None)) for name in schema.get("required", []) }
+
+
+"""
+Recorded sessions
+"""
+
+class Recording:
+    """
+    A list of assistant turns, each a dict with optional "content", "reasoning_content", "tool_calls", and "timing" (recorded latency).
+    """
+    def __init__(self, turns, by_request_key=None, loop=False, finish_tool="signal_agent_completed"):
+        self.turns = turns
+        self.by_request_key = by_request_key or {}
+        self.loop = loop
+        self.finish_tool = finish_tool
+
+    @classmethod
+    def from_conversation(cls, path, **kwargs):
+        with open(path, "r", encoding="utf-8") as f:
+            conversation = json.load(f)
+        turns = [message for message in conversation if isinstance(message, dict) and message.get("role") == "assistant"]
+        return cls(turns, **kwargs)
+
+    @classmethod
+    def from_journal(cls, path, **kwargs):
+        turns = []
+        by_request_key = {}
+        with open(path, "r", encoding="utf-8") as f:
+            for line in f:
+                if not line.strip():
+                    continue
+                record = json.loads(line)
+                turn = dict(record["response"]["choices"][0]["message"])
+                turn["timing"] = record.get("timing")
+                turns.append(turn)
+                by_request_key[request_key(record["request"])] = turn
+        return cls(turns, by_request_key=by_request_key, **kwargs)
+
+    @classmethod
+    def from_markdown(cls, paths, **kwargs):
+        turns = []
+        for path in paths:
+            with open(path, "r", encoding="utf-8") as f:
+                turns.append({ "role": "assistant", "content": f.read() })
+        return cls(turns, **kwargs)
+
+    def pick_turn(self, request):
+        """
+        Return (turn, served_content_already). In the split method the content and the forced tool call of one turn
+        are two requests, the second one having the assistant message of the first one at the end.
+        """
+        exact = self.by_request_key.get(request_key(request))
+        if exact is not None:
+            return exact, False
+        messages = request.get("messages", [])
+        n_assistant = sum(1 for message in messages if message.get("role") == "assistant")
+        trailing_assistant = bool(messages) and messages[-1].get("role") == "assistant"
+        index = n_assistant - 1 if trailing_assistant else n_assistant
+        if index >= len(self.turns):
+            if not self.loop or not self.turns:
+                return { "role": "assistant", "content": "[mock] End of the recorded session." }, trailing_assistant
+            index %= len(self.turns)
+        return self.turns[index], trailing_assistant
+
+    def make_message(self, request):
+        turn, served_content = self.pick_turn(request)
+        tool_choice = request.get("tool_choice", "auto" if request.get("tools") else "none")
+        message = { "role": "assistant", "content": None }
+        if tool_choice != "required" and not served_content:
+            message["content"] = turn.get("content") or ""
+            if turn.get("reasoning_content"):
+                message["reasoning_content"] = turn["reasoning_content"]
+        if tool_choice != "none" and request.get("tools"):
+            tool_calls = [{ "id": x.get("id") or f"call_{uuid.uuid4().hex[:24]}", "type": "function", "function": { "name": x["function"]["name"], "arguments": x["function"]["arguments"] } } for x in turn.get("tool_calls") or []]
+            if not tool_calls and tool_choice == "required":
+                tool_calls = [self.placeholder_tool_call(request["tools"])]
+            if tool_calls:
+                message["tool_calls"] = tool_calls
+        return message, turn.get("timing")
+
+    def placeholder_tool_call(self, tools):
+        functions = [tool["function"] for tool in tools if tool.get("type") == "function"]
+        function = next((x for x in functions if x["name"] == self.finish_tool), functions[0])
+        return { "id": f"call_{uuid.uuid4().hex[:24]}", "type": "function", "function": { "name": function["name"], "arguments": json.dumps(placeholder_arguments(function.get("parameters", {}))) } }
+
+
+"""
+Latency model
+"""
+
+class LatencyModel:
+    def __init__(self, ttft_ms=300, tokens_per_second=50, jitter=0.1, use_recorded=False):
+        self.ttft = ttft_ms / 1000
+        self.tokens_per_second = tokens_per_second
+        self.jitter = jitter
+        self.use_recorded = use_recorded
+
+    def sample(self, n_output_tokens, recorded_timing=None):
+        """
+        Return (time to first token, seconds per output token).
+        """
+        if self.use_recorded and recorded_timing:
+            ttft = recorded_timing.get("ttft", self.ttft)
+            per_token = recorded_timing.get("seconds", ttft) - ttft
+            return ttft, max(per_token, 0) / max(n_output_tokens, 1)
+        factor = 1 + random.uniform(-self.jitter, self.jitter)
+        per_token = 1 / self.tokens_per_second if self.tokens_per_second > 0 else 0
+        return self.ttft * factor, per_token * factor
+
+
+"""
+Server
+"""
+
+class MockState:
+    def __init__(self, recording, latency_model, error_rate=0.0, upstream=None, upstream_api_key="", record_path=None):
+        self.recording = recording
+        self.latency_model = latency_model
+        self.error_rate = error_rate
+        self.upstream = upstream
+        self.upstream_api_key = upstream_api_key
+        self.record_path = record_path
+        self.lock = threading.Lock()
+        self.stats = { "requests": 0, "streamed": 0, "errors_injected": 0, "output_tokens": 0 }
+
+    def count(self, key, n=1):
+        with self.lock:
+            self.stats[key] += n
+
+
+class MockHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    state : MockState = None
+
+    def log_message(self, format, *args):
+        pass
+
+    def send_json(self, status, data):
+        body = json.dumps(data).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        path = self.path.split("?")[0].rstrip("/")
+        if path in ("/v1/models", "/models"):
+            self.send_json(200, { "object": "list", "data": [{ "id": "mock", "object": "model", "created": 0, "owned_by": "mock" }] })
+        elif path in ("/health", "/mock/stats"):
+            with self.state.lock:
+                stats = dict(self.state.stats)
+            self.send_json(200, stats)
+        else:
+            self.send_json(404, { "error": { "message": f"Unknown path {self.path}" } })
+
+    def do_POST(self):
+        path = self.path.split("?")[0].rstrip("/")
+        if path not in ("/v1/chat/completions", "/chat/completions"):
+            self.send_json(404, { "error": { "message": f"Unknown path {self.path}" } })
+            return
+        request = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))) or b"{}")
+        self.state.count("requests")
+        if self.state.error_rate and random.random() < self.state.error_rate:
+            self.state.count("errors_injected")
+            self.send_json(502, { "error": { "message": "[mock] Injected upstream failure." } })
+            return
+        if self.state.upstream:
+            message, timing = self.proxy_and_record(request)
+        else:
+            message, timing = self.state.recording.make_message(request)
+        completion_id = f"chatcmpl-{uuid.uuid4().hex}"
+        n_output_tokens = estimate_tokens((message.get("content") or "") + (message.get("reasoning_content") or "") + json.dumps(message.get("tool_calls") or []))
+        usage = { "prompt_tokens": estimate_tokens(json.dumps(request.get("messages", []))), "completion_tokens": n_output_tokens }
+        usage["total_tokens"] = usage["prompt_tokens"] + usage["completion_tokens"]
+        self.state.count("output_tokens", n_output_tokens)
+        ttft, per_token = self.state.latency_model.sample(n_output_tokens, None if self.state.upstream else timing)
+        finish_reason = "tool_calls" if message.get("tool_calls") else "stop"
+        if request.get("stream"):
+            self.state.count("streamed")
+            self.stream_message(request, completion_id, message, finish_reason, usage, ttft, per_token)
+        else:
+            time.sleep(ttft + per_token * n_output_tokens)
+            self.send_json(200, {
+                "id": completion_id, "object": "chat.completion", "created": int(time.time()), "model": request.get("model", "mock"),
+                "choices": [{ "index": 0, "message": message, "finish_reason": finish_reason }],
+                "usage": usage,
+            })
+
+    def stream_message(self, request, completion_id, message, finish_reason, usage, ttft, per_token):
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Cache-Control", "no-cache")
+        self.send_header("Connection", "close")
+        self.end_headers()
+        self.close_connection = True
+        def send_chunk(delta, finish=None, extra=None):
+            chunk = { "id": completion_id, "object": "chat.completion.chunk", "created": int(time.time()), "model": request.get("model", "mock"),
+                "choices": [{ "index": 0, "delta": delta, "finish_reason": finish }] }
+            if extra:
+                chunk.update(extra)
+            self.wfile.write(f"data: {json.dumps(chunk)}\n\n".encode("utf-8"))
+            self.wfile.flush()
+        def send_text(field, text):
+            # One chunk per ~token, at the modelled rate
+            for i in range(0, len(text), 4):
+                send_chunk({ field: text[i:i + 4] })
+                time.sleep(per_token)
+        time.sleep(ttft)
+        send_chunk({ "role": "assistant", "content": "" })
+        if message.get("reasoning_content"):
+            send_text("reasoning_content", message["reasoning_content"])
+        if message.get("content"):
+            send_text("content", message["content"])
+        for index, tool_call in enumerate(message.get("tool_calls") or []):
+            send_chunk({ "tool_calls": [{ "index": index, "id": tool_call["id"], "type": "function", "function": { "name": tool_call["function"]["name"], "arguments": "" } }] })
+            arguments = tool_call["function"]["arguments"]
+            for i in range(0, len(arguments), 16):
+                send_chunk({ "tool_calls": [{ "index": index, "function": { "arguments": arguments[i:i + 16] } }] })
+                time.sleep(per_token * 4)
+        send_chunk({}, finish=finish_reason)
+        if (request.get("stream_options") or {}).get("include_usage"):
+            chunk = { "id": completion_id, "object": "chat.completion.chunk", "created": int(time.time()), "model": request.get("model", "mock"), "choices": [], "usage": usage }
+            self.wfile.write(f"data: {json.dumps(chunk)}\n\n".encode("utf-8"))
+        self.wfile.write(b"data: [DONE]\n\n")
+        self.wfile.flush()
+
+    def proxy_and_record(self, request):
+        # Always non-streaming upstream, the streaming (if asked) is then simulated locally
+        upstream_request = { k: v for k, v in request.items() if k not in ("stream", "stream_options") }
+        http_request = urllib.request.Request(f"{self.state.upstream.rstrip('/')}/chat/completions", data=json.dumps(upstream_request).encode("utf-8"),
+            headers={ "Content-Type": "application/json", "Authorization": f"Bearer {self.state.upstream_api_key}" }, method="POST")
+        start_time = time.perf_counter()
+        with urllib.request.urlopen(http_request) as response:
+            ttft = time.perf_counter() - start_time
+            data = json.loads(response.read())
+        timing = { "ttft": ttft, "seconds": time.perf_counter() - start_time }
+        with self.state.lock:
+            with open(self.state.record_path, "a", encoding="utf-8") as f:
+                f.write(json.dumps({ "request": upstream_request, "response": data, "timing": timing }) + "\n")
+        return data["choices"][0]["message"], timing
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Mock OpenAI compatible server replaying recorded LLM sessions.")
+    source = parser.add_mutually_exclusive_group(required=True)
+    source.add_argument("--conversation", help="Conversation dump (debug_dump_*.json) to replay.")
+    source.add_argument("--journal", help="JSONL journal to replay, or to append to with --record.")
+    source.add_argument("--markdown", nargs="+", help="Markdown files, each is one assistant answer.")
+    parser.add_argument("--record", action="store_true", help="Proxy to --upstream and append every exchange to --journal.")
+    parser.add_argument("--upstream", default="", help="Base URL of the real endpoint, for --record.")
+    parser.add_argument("--upstream-api-key", default="", help="API key of the real endpoint, for --record.")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8099)
+    parser.add_argument("--ttft-ms", type=float, default=300, help="Time to first token.")
+    parser.add_argument("--tokens-per-second", type=float, default=50, help="Output token rate, 0 for instant.")
+    parser.add_argument("--jitter", type=float, default=0.1, help="Relative random variation of the latency.")
+    parser.add_argument("--recorded-latency", action="store_true", help="Use the latency recorded in the journal when available.")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="Fraction of requests answered with HTTP 502, to exercise retries.")
+    parser.add_argument("--loop", action="store_true", help="Wrap around at the end of the recording instead of returning a final message.")
+    parser.add_argument("--finish-tool", default="signal_agent_completed", help="Tool to call when a tool call is required but the recording has none.")
+    args = parser.parse_args()
+
+    if args.record:
+        if not (args.journal and args.upstream):
+            parser.error("--record needs --journal and --upstream")
+        recording = None
+    elif args.conversation:
+        recording = Recording.from_conversation(args.conversation, loop=args.loop, finish_tool=args.finish_tool)
+    elif args.journal:
+        recording = Recording.from_journal(args.journal, loop=args.loop, finish_tool=args.finish_tool)
+    else:
+        recording = Recording.from_markdown(args.markdown, loop=args.loop, finish_tool=args.finish_tool)
+
+    MockHandler.state = MockState(
+        recording=recording,
+        latency_model=LatencyModel(ttft_ms=args.ttft_ms, tokens_per_second=args.tokens_per_second, jitter=args.jitter, use_recorded=args.recorded_latency),
+        error_rate=args.error_rate,
+        upstream=args.upstream if args.record else None,
+        upstream_api_key=args.upstream_api_key,
+        record_path=args.journal if args.record else None,
+    )
+    server = ThreadingHTTPServer((args.host, args.port), MockHandler)
+    mode = "recording" if args.record else f"replaying {len(recording.turns)} turns"
+    print(f"Mock OpenAI server on http://{args.host}:{args.port}/v1 ({mode})")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+if __name__ == "__main__":
+    main()
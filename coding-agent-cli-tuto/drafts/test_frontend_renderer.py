@@ -0,0 +1,77 @@
+import ast
+import io
+import os
+import threading
+
+from rich.console import Console
+from rich.text import Text
+
+from frontend_renderer import FrontendRenderer, clip_lines, text_panel
+
+MAIN_SCRIPT = os.path.join(os.path.dirname(__file__), "main_v2_2.py")
+
+
+def render(renderable):
+    console = Console(file=io.StringIO(), width=100, color_system=None)
+    console.print(renderable)
+    return console.file.getvalue()
+
+
+def test_tool_result_panel_renders():
+    output = render(text_panel("total 12\n[bold]not markup[/bold]\n--\n[system] Exited with code 0.", title="Tool call result for execute_command_simple"))
+    assert "Tool call result for execute_command_simple" in output
+    assert "[bold]not markup[/bold]" in output
+
+
+def test_tool_result_panel_clips_long_output():
+    content = "\n".join(f"line {i}" for i in range(1000))
+    output = render(text_panel(content, title="Files changed"))
+    assert "lines not shown" in output
+    assert "line 999" in output
+
+
+def test_clip_lines_keeps_head_and_tail():
+    content = "".join(f"{i}\n" for i in range(10))
+    assert clip_lines(content, head_lines=3, tail_lines=2) == ("0\n1\n2\n", 5, "8\n9\n")
+    assert clip_lines(content, head_lines=8, tail_lines=2) == (content, 0, "")
+
+
+def test_renderer_runs_on_ui_thread_in_order():
+    console = Console(file=io.StringIO(), width=100, color_system=None)
+    renderer = FrontendRenderer(console=console)
+    renderer.start()
+    threads = []
+    renderer.submit(lambda console: threads.append(threading.current_thread().name))
+    renderer.print("first")
+    renderer.print(text_panel("second", title="Panel"))
+    renderer.flush()
+    renderer.stop()
+    assert threads == ["frontend-renderer"]
+    output = console.file.getvalue()
+    assert output.index("first") < output.index("second")
+
+
+def test_renderer_drops_when_full_and_reports_it():
+    console = Console(file=io.StringIO(), width=100, color_system=None)
+    renderer = FrontendRenderer(console=console, queue_size=2)
+    # Not started yet, so nothing is consumed
+    for i in range(5):
+        renderer.print(f"output {i}")
+    assert renderer.n_dropped == 3
+    renderer.start()
+    renderer.flush()
+    renderer.stop()
+    output = console.file.getvalue()
+    assert "3 outputs not shown" in output
+    assert "output 1" in output and "output 2" not in output
+
+
+def test_main_script_does_not_rebind_rich_text():
+    # The frontend code in the script uses rich's Text, a later module level import of another Text would silently replace it
+    with open(MAIN_SCRIPT, "r", encoding="utf-8") as f:
+        tree = ast.parse(f.read())
+    text_bindings = []
+    for node in tree.body:
+        if isinstance(node, ast.ImportFrom):
+            text_bindings += [f"{node.module}.{alias.name}" for alias in node.names if (alias.asname or alias.name) == "Text"]
+    assert text_bindings == [f"{Text.__module__}.{Text.__name__}"]
@@ -0,0 +1,152 @@
+import json
+import threading
+from http.server import ThreadingHTTPServer
+
+import openai
+import pytest
+from openai import OpenAI
+
+from mock_openai_server import Recording, LatencyModel, MockState, MockHandler
+
+
+TOOLS = [
+    { "type": "function", "function": { "name": "read_single_file_enriched", "parameters": { "type": "object", "properties": { "filepath": { "type": "string" } }, "required": ["filepath"] } } },
+    { "type": "function", "function": { "name": "signal_agent_completed", "parameters": { "type": "object", "properties": { "repos": { "type": "array" }, "additional_files": { "type": "array" } }, "required": ["repos", "additional_files"] } } },
+]
+
+RECORDED_TOOL_CALL = { "id": "call_read", "type": "function", "function": { "name": "read_single_file_enriched", "arguments": json.dumps({ "filepath": "app/main.py" }) } }
+
+CONVERSATION = [
+    { "role": "system", "content": "You are a coding agent." },
+    { "role": "user", "content": "Fix the bug." },
+    { "role": "assistant", "content": "Let me look at the code first.", "reasoning_content": "Need to read main.py", "tool_calls": [RECORDED_TOOL_CALL] },
+    { "role": "tool", "tool_call_id": "call_read", "content": "Content of app/main.py: ..." },
+    { "role": "assistant", "content": "The bug is fixed." },
+]
+
+
+def start_server(state):
+    handler = type("Handler", (MockHandler,), { "state": state })
+    server = ThreadingHTTPServer(("127.0.0.1", 0), handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def instant_state(recording, **kwargs):
+    return MockState(recording=recording, latency_model=LatencyModel(ttft_ms=0, tokens_per_second=0, jitter=0), **kwargs)
+
+
+@pytest.fixture
+def replay_server(tmp_path):
+    path = tmp_path / "debug_dump.json"
+    path.write_text(json.dumps(CONVERSATION), encoding="utf-8")
+    server = start_server(instant_state(Recording.from_conversation(str(path))))
+    yield f"http://127.0.0.1:{server.server_port}/v1"
+    server.shutdown()
+    server.server_close()
+
+
+def client_for(base_url):
+    return OpenAI(base_url=base_url, api_key="mock", max_retries=0)
+
+
+def test_replay_picks_turn_by_number_of_assistant_messages(replay_server):
+    client = client_for(replay_server)
+    res = client.chat.completions.create(model="m", messages=CONVERSATION[:2], tools=TOOLS, tool_choice="none")
+    assert res.choices[0].message.content == "Let me look at the code first."
+    assert res.choices[0].message.tool_calls is None
+    res = client.chat.completions.create(model="m", messages=CONVERSATION[:4], tools=TOOLS, tool_choice="auto")
+    assert res.choices[0].message.content == "The bug is fixed."
+    assert res.usage.completion_tokens > 0
+    res = client.chat.completions.create(model="m", messages=CONVERSATION + [{ "role": "user", "content": "Thanks." }], tools=TOOLS, tool_choice="none")
+    assert res.choices[0].message.content == "[mock] End of the recorded session."
+
+
+def test_forced_tool_call_after_content_only_turn(replay_server):
+    client = client_for(replay_server)
+    # Split method: the forced call re-sends the conversation with the content-only answer at the end
+    messages = CONVERSATION[:2] + [{ "role": "assistant", "content": "Let me look at the code first." }]
+    res = client.chat.completions.create(model="m", messages=messages, tools=TOOLS, tool_choice="required")
+    message = res.choices[0].message
+    assert message.content is None
+    assert [(x.id, x.function.name, x.function.arguments) for x in message.tool_calls] == [("call_read", "read_single_file_enriched", RECORDED_TOOL_CALL["function"]["arguments"])]
+    assert res.choices[0].finish_reason == "tool_calls"
+
+
+def test_forced_tool_call_without_recorded_one_calls_finish_tool(replay_server):
+    client = client_for(replay_server)
+    res = client.chat.completions.create(model="m", messages=CONVERSATION[:4], tools=TOOLS, tool_choice="required")
+    tool_call = res.choices[0].message.tool_calls[0]
+    assert tool_call.function.name == "signal_agent_completed"
+    assert json.loads(tool_call.function.arguments) == { "repos": [], "additional_files": [] }
+
+
+def test_streamed_chunks_reassemble_the_turn(replay_server):
+    client = client_for(replay_server)
+    stream = client.chat.completions.create(model="m", messages=CONVERSATION[:2], tools=TOOLS, tool_choice="auto", stream=True, stream_options={ "include_usage": True })
+    content, reasoning, arguments = [], [], []
+    tool_call_ids, finish_reasons, usages = [], [], []
+    n_chunks = 0
+    for chunk in stream:
+        n_chunks += 1
+        if chunk.usage is not None:
+            usages.append(chunk.usage)
+        for choice in chunk.choices:
+            delta = choice.delta
+            content.append(delta.content or "")
+            reasoning.append(getattr(delta, "reasoning_content", None) or "")
+            for tool_call in delta.tool_calls or []:
+                if tool_call.id:
+                    tool_call_ids.append(tool_call.id)
+                arguments.append(tool_call.function.arguments or "")
+            if choice.finish_reason:
+                finish_reasons.append(choice.finish_reason)
+    assert "".join(content) == "Let me look at the code first."
+    assert "".join(reasoning) == "Need to read main.py"
+    assert tool_call_ids == ["call_read"]
+    assert "".join(arguments) == RECORDED_TOOL_CALL["function"]["arguments"]
+    assert finish_reasons == ["tool_calls"]
+    assert len(usages) == 1 and usages[0].completion_tokens > 0
+    # Roughly one chunk per token, not the whole answer at once
+    assert n_chunks > 10
+
+
+def test_record_through_proxy_then_replay_journal(replay_server, tmp_path):
+    journal = tmp_path / "journal.jsonl"
+    proxy = start_server(instant_state(None, upstream=replay_server, record_path=str(journal)))
+    try:
+        recorded = client_for(f"http://127.0.0.1:{proxy.server_port}/v1").chat.completions.create(model="m", messages=CONVERSATION[:2], tools=TOOLS, tool_choice="auto")
+    finally:
+        proxy.shutdown()
+        proxy.server_close()
+    records = [json.loads(line) for line in journal.read_text(encoding="utf-8").splitlines()]
+    assert len(records) == 1
+    assert records[0]["request"]["messages"] == CONVERSATION[:2]
+    assert records[0]["timing"]["seconds"] >= records[0]["timing"]["ttft"]
+
+    replay = start_server(instant_state(Recording.from_journal(str(journal))))
+    try:
+        client = client_for(f"http://127.0.0.1:{replay.server_port}/v1")
+        # The exact same request is answered from the journal entry, streamed or not
+        res = client.chat.completions.create(model="m", messages=CONVERSATION[:2], tools=TOOLS, tool_choice="auto")
+        chunks = list(client.chat.completions.create(model="m", messages=CONVERSATION[:2], tools=TOOLS, tool_choice="auto", stream=True))
+    finally:
+        replay.shutdown()
+        replay.server_close()
+    assert res.choices[0].message.content == recorded.choices[0].message.content == "Let me look at the code first."
+    assert res.choices[0].message.tool_calls[0].function.name == "read_single_file_enriched"
+    assert "".join(chunk.choices[0].delta.content or "" for chunk in chunks if chunk.choices) == "Let me look at the code first."
+
+
+def test_injected_errors_and_stats():
+    server = start_server(instant_state(Recording([{ "role": "assistant", "content": "hi" }]), error_rate=1.0))
+    try:
+        client = client_for(f"http://127.0.0.1:{server.server_port}/v1")
+        with pytest.raises(openai.APIStatusError) as exc_info:
+            client.chat.completions.create(model="m", messages=[{ "role": "user", "content": "hello" }])
+        assert exc_info.value.status_code == 502
+        assert server.RequestHandlerClass.state.stats["errors_injected"] == 1
+    finally:
+        server.shutdown()
+        server.server_close()
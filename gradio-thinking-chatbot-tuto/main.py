@@ -1,4 +1,3 @@
-import requests
 import time
 
 """
@@ -101,30 +100,44 @@ def read_webpage_prompt_template(doc, topic_question):
 Define the tools fn and register
 """
 
-from selenium import webdriver
-from bs4 import BeautifulSoup
+import os
+
 from markdownify import markdownify as md
 
-import urllib.parse
+from web_search_backends import BackgroundEventLoop, SearxngJsonBackend, SeleniumSearxngBackend, FallbackSearchBackend, CachedSearchBackend, WebDriverPool, format_search_results
+from page_fetcher import PageFetcher
+
+SEARXNG_URL = "https://search.hbubli.cc"
+# Concurrent chat sessions that can use the browser search path at once
+WEBDRIVER_POOL_SIZE = 4
+SEARCH_CACHE_ENABLED = os.environ.get("SEARCH_CACHE", "1") not in ("", "0")
+SEARCH_CACHE_DIR = os.environ.get("SEARCH_CACHE_DIR", ".search_cache")
+
+# JSON API first, a browser is only started if that fails (eg instance with JSON format disabled)
+webdriver_pool = WebDriverPool(size=WEBDRIVER_POOL_SIZE)
+# One background event loop for all the async HTTP clients (search JSON API and page reads)
+http_event_loop = BackgroundEventLoop()
+search_backend = FallbackSearchBackend([SearxngJsonBackend(SEARXNG_URL, event_loop=http_event_loop), SeleniumSearxngBackend(SEARXNG_URL, driver_pool=webdriver_pool)])
+if SEARCH_CACHE_ENABLED:
+    search_backend = CachedSearchBackend(search_backend, cache_dir=SEARCH_CACHE_DIR)
 
-driver = webdriver.Firefox()
+page_fetcher = PageFetcher(event_loop=http_event_loop)
 
 def web_search(query, language="en", time_range="year"):
-    q_escaped = urllib.parse.quote(query, safe='')
-    driver.get(f"https://search.hbubli.cc/search?q=%21br%20{q_escaped}&language={language}&time_range={time_range}&safesearch=0&pageno=1&categories=none")
-    html = driver.page_source
-    dom = BeautifulSoup(html, 'html.parser')
-    mydivs = dom.find_all("article", {"class": "result"})
-    search_result = []
-    for entry in mydivs:
-        search_result.append( md(str(entry), strip=['img', 'svg']) )
-    return "\n\n\n".join(search_result)
+    results = search_backend.search(f"!br {query}", language=language, time_range=time_range)
+    return format_search_results(results)
 
 def extract_webpage(url : str, topic_question="Please provide a concise summary of the key information and/or viewpoint presented in the document."):
-    get_res = requests.get(url)
-    doc = md(get_res.content)
-    res_side = cli.chat.completions.create(
-        model="qwen3",
+    page = page_fetcher.fetch(url)
+    doc = md(page.text)
+    if page.truncated:
+        doc += "\n\n[Page too large, only the beginning was downloaded]"
+    # Long pages would be rejected by the server (or crawl), keep the beginning which usually has the main content
+    doc, is_truncated = token_budget.truncate_text(doc, token_budget.ceiling - SUMMARIZER_PROMPT_TOKENS)
+    if is_truncated:
+        doc += "\n\n[Document truncated to fit the context window]"
+    res_side = chat_completions_create(
+        "extract_webpage",
         messages=read_webpage_prompt_template(doc, topic_question)
     )
     return f"### Document summary info for {url}\n\n" + res_side.choices[0].message.content
@@ -134,15 +147,402 @@ central_tool_registry.register_tool(name='web_search', desc=web_search_tool_desc
 central_tool_registry.register_tool(name='extract_webpage', desc=extract_webpage_tool_desc, schema=ExtractWebpageParam, fn=extract_webpage, ui_display_fn=lambda tool_args: f"Reading webpage {tool_args["url"]}")
 
 
+"""
+LLM transport
+
+One explicitly configured httpx client shared by the main chat and all the parallel summarization calls,
+so that they reuse warm keep-alive connections. HTTP/2 is used when the h2 package is installed and the endpoint supports it.
+"""
+
+import importlib.util
+import threading
+from collections import defaultdict
+
+import httpx
+
+# Sized for the fan out of extract_webpage (up to 10 pages at once, per chat session)
+LLM_HTTP_MAX_CONNECTIONS = 64
+LLM_HTTP_MAX_KEEPALIVE_CONNECTIONS = 32
+LLM_HTTP_KEEPALIVE_EXPIRY = 120
+LLM_HTTP_CONNECT_TIMEOUT = 10
+LLM_HTTP_READ_TIMEOUT = 600
+LLM_HTTP2 = importlib.util.find_spec("h2") is not None
+
+class TransportMetrics:
+    """
+    Per endpoint host, as the router spreads calls over several endpoints. The main chat streams, so the time to response
+    headers is about when the model starts answering; summarizer calls are not streamed, their TTFB is the whole generation.
+    """
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.hosts = defaultdict(lambda: { "requests": 0, "responses": 0, "errors": 0, "total_ttfb": 0.0, "max_ttfb": 0.0, "http_versions": set() })
+
+    def on_request(self, request):
+        request.extensions["start_time"] = time.perf_counter()
+        with self.lock:
+            self.hosts[request.url.host]["requests"] += 1
+
+    def on_response(self, response):
+        ttfb = time.perf_counter() - response.request.extensions.get("start_time", time.perf_counter())
+        with self.lock:
+            stats = self.hosts[response.request.url.host]
+            stats["responses"] += 1
+            stats["total_ttfb"] += ttfb
+            stats["max_ttfb"] = max(stats["max_ttfb"], ttfb)
+            stats["http_versions"].add(response.http_version)
+            if response.status_code >= 400:
+                stats["errors"] += 1
+
+    def summary(self):
+        with self.lock:
+            parts = []
+            for host, stats in self.hosts.items():
+                avg_ttfb = stats["total_ttfb"] / stats["responses"] if stats["responses"] else 0
+                parts.append(f"{host} ({stats['requests']} requests, {stats['errors']} errors, avg TTFB {avg_ttfb:.2f}s, max {stats['max_ttfb']:.2f}s, {'/'.join(sorted(stats['http_versions']))})")
+            return "LLM HTTP: " + (", ".join(parts) or "no request")
+
+
+def create_llm_http_client(metrics, max_connections=LLM_HTTP_MAX_CONNECTIONS, max_keepalive_connections=LLM_HTTP_MAX_KEEPALIVE_CONNECTIONS):
+    return httpx.Client(
+        http2=LLM_HTTP2,
+        limits=httpx.Limits(max_connections=max_connections, max_keepalive_connections=max_keepalive_connections, keepalive_expiry=LLM_HTTP_KEEPALIVE_EXPIRY),
+        timeout=httpx.Timeout(LLM_HTTP_READ_TIMEOUT, connect=LLM_HTTP_CONNECT_TIMEOUT),
+        event_hooks={ "request": [metrics.on_request], "response": [metrics.on_response] },
+    )
+
+
+llm_transport_metrics = TransportMetrics()
+llm_http_client = create_llm_http_client(llm_transport_metrics)
+
+
 """
 Init OpenAI Client
+
+Endpoints are tagged with a tier, and each call site picks a tier, so that the many cheap summarization calls
+do not queue behind the main chat on the strong model. Within a tier, calls go to the endpoint with the lowest
+expected wait (EWMA latency scaled by the calls in flight), which balances the load across replicas.
 """
 from openai import OpenAI
 
-cli = OpenAI(
-    base_url="<your base url>",
-    api_key="<your api key, should use env var etc>"
-)
+LLM_ENDPOINTS = [
+    { "name": "main", "tier": "main", "model": "qwen3", "base_url": "<your base url>", "api_key": "<your api key, should use env var etc>" },
+    # Eg a small fast model, or more replicas, for the webpage summarizer. Without any, the summarizer shares the main endpoints.
+    #{ "name": "fast", "tier": "summarizer", "model": "qwen3-4b", "base_url": "<your base url>", "api_key": "<your api key>" },
+]
+CALL_SITE_TIERS = { "main_chat": "main", "extract_webpage": "summarizer" }
+LLM_EWMA_ALPHA = 0.3
+
+class RoutedEndpoint:
+    def __init__(self, config, http_client):
+        self.name = config["name"]
+        self.tier = config["tier"]
+        self.model = config["model"]
+        self.base_url = config["base_url"]
+        self.client = OpenAI(base_url=config["base_url"], api_key=config["api_key"], http_client=http_client)
+        self.lock = threading.Lock()
+        self.n_calls = 0
+        self.n_inflight = 0
+        self.ewma_latency = None
+        self.ewma_tokens_per_second = None
+
+    def expected_wait(self):
+        # Endpoints without any sample yet go first, so that every replica gets measured
+        with self.lock:
+            if self.ewma_latency is None:
+                return self.n_inflight * 1e-3
+            return self.ewma_latency * (1 + self.n_inflight)
+
+    def record(self, seconds, n_output_tokens):
+        with self.lock:
+            self.n_calls += 1
+            self.ewma_latency = seconds if self.ewma_latency is None else LLM_EWMA_ALPHA * seconds + (1 - LLM_EWMA_ALPHA) * self.ewma_latency
+            if n_output_tokens and seconds > 0:
+                rate = n_output_tokens / seconds
+                self.ewma_tokens_per_second = rate if self.ewma_tokens_per_second is None else LLM_EWMA_ALPHA * rate + (1 - LLM_EWMA_ALPHA) * self.ewma_tokens_per_second
+
+class RoutedStream:
+    """
+    Wrap a streamed completion so that the endpoint stays counted as in flight until the stream is consumed (or closed),
+    and its latency sample is the whole generation, same as for non streamed calls.
+    """
+    def __init__(self, stream, endpoint, start_time):
+        self.stream = stream
+        self.endpoint = endpoint
+        self.start_time = start_time
+        self.is_closed = False
+
+    def __iter__(self):
+        n_output_tokens = 0
+        try:
+            for chunk in self.stream:
+                if chunk.usage is not None:
+                    n_output_tokens = chunk.usage.completion_tokens
+                elif chunk.choices and (chunk.choices[0].delta.content or getattr(chunk.choices[0].delta, "reasoning_content", None)):
+                    # Roughly one token per chunk when the server does not send usage
+                    n_output_tokens += 1
+                yield chunk
+            self.endpoint.record(time.perf_counter() - self.start_time, n_output_tokens or None)
+        finally:
+            self.close()
+
+    def close(self):
+        if self.is_closed:
+            return
+        self.is_closed = True
+        self.stream.close()
+        with self.endpoint.lock:
+            self.endpoint.n_inflight -= 1
+
+class LatencyRouter:
+    def __init__(self, endpoint_configs, http_client, response_cache=None):
+        self.endpoints = [RoutedEndpoint(config, http_client) for config in endpoint_configs]
+        self.response_cache = response_cache
+
+    def pick(self, tier):
+        candidates = [x for x in self.endpoints if x.tier == tier] or self.endpoints
+        return min(candidates, key=lambda x: x.expected_wait())
+
+    def create(self, tier, **request_kwargs):
+        endpoint = self.pick(tier)
+        request_kwargs = { **request_kwargs, "model": endpoint.model }
+        if self.response_cache is None or request_kwargs.get("stream"):
+            return self.dispatch(endpoint, request_kwargs)
+        # Keyed on the endpoint and model the call was routed to, so replicas serving different models never share answers
+        key = self.response_cache.request_key({ **request_kwargs, "base_url": endpoint.base_url })
+        res = self.response_cache.lookup(key)
+        if res is None:
+            res = self.dispatch(endpoint, request_kwargs)
+            self.response_cache.put(key, res)
+        return res
+
+    def dispatch(self, endpoint, request_kwargs):
+        with endpoint.lock:
+            endpoint.n_inflight += 1
+        start_time = time.perf_counter()
+        try:
+            res = endpoint.client.chat.completions.create(**request_kwargs)
+        except Exception:
+            with endpoint.lock:
+                endpoint.n_inflight -= 1
+            raise
+        if request_kwargs.get("stream"):
+            # Still generating, released once consumed
+            return RoutedStream(res, endpoint, start_time)
+        with endpoint.lock:
+            endpoint.n_inflight -= 1
+        endpoint.record(time.perf_counter() - start_time, res.usage.completion_tokens if res.usage else None)
+        return res
+
+    def summary(self):
+        parts = []
+        for x in self.endpoints:
+            stats = [x.tier, f"{x.n_calls} calls"]
+            if x.ewma_latency is not None:
+                stats.append(f"ewma {x.ewma_latency:.1f}s")
+            if x.ewma_tokens_per_second is not None:
+                stats.append(f"{x.ewma_tokens_per_second:.0f} tok/s")
+            parts.append(f"{x.name} ({', '.join(stats)})")
+        return "LLM endpoints: " + ", ".join(parts)
+
+
+llm_router = LatencyRouter(LLM_ENDPOINTS, llm_http_client)
+
+
+"""
+LLM response cache (opt-in, for development)
+
+Set LLM_CACHE=1 to replay identical LLM calls (main chat and webpage summaries) from disk while iterating on prompts and tools.
+"""
+
+import hashlib
+import tempfile
+from pathlib import Path
+
+from openai.types.chat import ChatCompletion, ChatCompletionMessage
+
+LLM_CACHE_ENABLED = os.environ.get("LLM_CACHE", "") not in ("", "0")
+LLM_CACHE_DIR = os.environ.get("LLM_CACHE_DIR", ".llm_cache")
+LLM_CACHE_MAX_BYTES = int(os.environ.get("LLM_CACHE_MAX_MB", "512")) * 1024 * 1024
+
+class LLMResponseCache:
+    """
+    Completions stored as json, keyed by a hash of the whole request as sent to the endpoint it was routed to (see
+    LatencyRouter.create). Only non streamed calls go through it:
+    main_call_llm asks for the whole turn at once when the cache is on, and replays it into the UI.
+    Size bounded, least recently used entries (by file mtime, touched on every hit) are evicted first.
+    """
+    def __init__(self, cache_dir, max_bytes):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.lock = threading.Lock()
+        self.n_hits = 0
+        self.n_misses = 0
+        Path(cache_dir).mkdir(parents=True, exist_ok=True)
+        self.total_bytes = sum(entry.stat().st_size for entry in Path(cache_dir).glob("*/*.json"))
+
+    @staticmethod
+    def request_key(request_kwargs):
+        canonical = json.dumps(request_kwargs, sort_keys=True, separators=(",", ":"), ensure_ascii=False,
+            default=lambda x: x.model_dump() if hasattr(x, "model_dump") else str(x))
+        return hashlib.sha256(canonical.encode("utf-8")).hexdigest()
+
+    def entry_path(self, key):
+        return os.path.join(self.cache_dir, key[:2], f"{key}.json")
+
+    def get(self, key):
+        path = self.entry_path(key)
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                data = f.read()
+            os.utime(path)
+        except FileNotFoundError:
+            return None
+        return ChatCompletion.model_validate_json(data)
+
+    def put(self, key, response):
+        path = self.entry_path(key)
+        data = response.model_dump_json().encode("utf-8")
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with tempfile.NamedTemporaryFile(mode="wb", dir=os.path.dirname(path), delete=False) as tmp_file:
+            tmp_file.write(data)
+        os.replace(tmp_file.name, path)
+        with self.lock:
+            self.total_bytes += len(data)
+            if self.total_bytes > self.max_bytes:
+                self.evict()
+
+    def evict(self):
+        # Down to 90% so that we don't rescan on every put once full
+        entries = sorted(((entry.stat().st_mtime, entry.stat().st_size, entry) for entry in Path(self.cache_dir).glob("*/*.json")), key=lambda x: x[0])
+        self.total_bytes = sum(size for _, size, _ in entries)
+        for _, size, entry in entries:
+            if self.total_bytes <= self.max_bytes * 0.9:
+                break
+            entry.unlink(missing_ok=True)
+            self.total_bytes -= size
+
+    def lookup(self, key):
+        response = self.get(key)
+        with self.lock:
+            if response is not None:
+                self.n_hits += 1
+            else:
+                self.n_misses += 1
+        return response
+
+    def summary(self):
+        return f"LLM cache: {self.n_hits} hits, {self.n_misses} misses, {self.total_bytes / 1024 / 1024:.1f} MiB on disk in {self.cache_dir}"
+
+
+llm_response_cache = LLMResponseCache(cache_dir=LLM_CACHE_DIR, max_bytes=LLM_CACHE_MAX_BYTES) if LLM_CACHE_ENABLED else None
+llm_router.response_cache = llm_response_cache
+
+def chat_completions_create(call_site, **request_kwargs):
+    return llm_router.create(CALL_SITE_TIERS.get(call_site, "main"), **request_kwargs)
+
+"""
+Token budget
+
+Know the request size locally before the network call. Uses the HF tokenizer of the served model when the `tokenizers`
+package is installed (and the tokenizer can be fetched), otherwise a conservative chars per token estimate.
+"""
+
+import math
+
+try:
+    from tokenizers import Tokenizer
+except ImportError:
+    Tokenizer = None
+
+# Should match the served model (context size of the server, and its tokenizer on HF hub)
+LLM_CONTEXT_WINDOW = 32768
+LLM_RESERVED_OUTPUT_TOKENS = 8192
+LLM_TOKENIZER = "Qwen/Qwen3-30B-A3B"
+# Chat template tokens around each message/tool call (role markers etc), roughly
+MESSAGE_OVERHEAD_TOKENS = 8
+FALLBACK_CHARS_PER_TOKEN = 3
+# Tokens are rarely longer than this, so only that much of a long text is tokenized to cut it (odd text may be cut a bit early)
+MAX_CHARS_PER_TOKEN = 16
+TOKEN_COUNT_CACHE_SIZE = 20000
+# Room for the summarizer prompt around the webpage itself
+SUMMARIZER_PROMPT_TOKENS = 1024
+
+class ContextBudgetExceeded(RuntimeError):
+    pass
+
+def load_tokenizer(tokenizer_name):
+    if Tokenizer is None or not tokenizer_name:
+        return None
+    try:
+        return Tokenizer.from_pretrained(tokenizer_name)
+    except Exception:
+        return None
+
+class TokenBudget:
+    """
+    Each chat turn is checked against the context window before it is sent, the user is told to start a new chat when over
+    (the history is theirs, nothing is dropped silently). Webpages are cut down to fit the summarizer call.
+    Counts are cached per message, as every turn re-sends the history of the session. The tool list is fixed at startup,
+    so it is counted once.
+    """
+    def __init__(self, tokenizer, ceiling, tools, cache_size=TOKEN_COUNT_CACHE_SIZE):
+        self.tokenizer = tokenizer
+        self.ceiling = ceiling
+        self.cache = OrderedDict()
+        self.cache_size = cache_size
+        self.lock = threading.Lock()
+        self.tool_tokens = self.count_text(json.dumps(tools))
+
+    def count_text(self, text):
+        if not text:
+            return 0
+        if self.tokenizer is None:
+            return math.ceil(len(text) / FALLBACK_CHARS_PER_TOKEN)
+        return len(self.tokenizer.encode(text, add_special_tokens=False).ids)
+
+    def count_message(self, message):
+        # The history mixes plain dicts (user, tool) and ChatCompletionMessage (assistant)
+        if hasattr(message, "model_dump"):
+            message = message.model_dump()
+        key = hashlib.sha256(json.dumps(message, sort_keys=True, ensure_ascii=False, default=str).encode("utf-8")).hexdigest()
+        with self.lock:
+            if key in self.cache:
+                self.cache.move_to_end(key)
+                return self.cache[key]
+        content = message.get("content")
+        n_tokens = MESSAGE_OVERHEAD_TOKENS + self.count_text(content if isinstance(content, str) else json.dumps(content))
+        n_tokens += self.count_text(message.get("reasoning_content"))
+        for tool_call in message.get("tool_calls") or []:
+            n_tokens += MESSAGE_OVERHEAD_TOKENS + self.count_text(tool_call["function"]["name"]) + self.count_text(tool_call["function"]["arguments"])
+        with self.lock:
+            self.cache[key] = n_tokens
+            if len(self.cache) > self.cache_size:
+                self.cache.popitem(last=False)
+        return n_tokens
+
+    def check_conversation(self, messages):
+        n_tokens = self.tool_tokens + sum(self.count_message(message) for message in messages)
+        if n_tokens > self.ceiling:
+            raise ContextBudgetExceeded(f"Conversation has {n_tokens} tokens, over the budget of {self.ceiling}. Please start a new chat.")
+        return n_tokens
+
+    def truncate_text(self, text, max_tokens):
+        """
+        Return (text cut to at most max_tokens, whether it was cut).
+        """
+        if self.tokenizer is None:
+            max_chars = int(max_tokens * FALLBACK_CHARS_PER_TOKEN)
+            return text[:max_chars], len(text) > max_chars
+        # Pages can be megabytes, only tokenize what could possibly be kept
+        head = text[:max_tokens * MAX_CHARS_PER_TOKEN]
+        encoding = self.tokenizer.encode(head, add_special_tokens=False)
+        if len(encoding.ids) <= max_tokens:
+            return head, len(head) < len(text)
+        return head[:encoding.offsets[max_tokens][0]], True
+
+
+token_budget = TokenBudget(tokenizer=load_tokenizer(LLM_TOKENIZER), ceiling=LLM_CONTEXT_WINDOW - LLM_RESERVED_OUTPUT_TOKENS, tools=central_tool_registry.get_tool_list())
+
 
 """
 Gradio Demo (Frontend)
@@ -152,6 +552,16 @@ import gradio as gr
 from gradio import ChatMessage
 
 import uuid
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+# Shared by all chat sessions, so that the total load on search engine/LLM stays bounded
+TOOL_CALL_MAX_WORKERS = 8
+tool_call_executor = ThreadPoolExecutor(max_workers=TOOL_CALL_MAX_WORKERS, thread_name_prefix="tool-call")
+
+def timed_tool_call(name, tool_args):
+    start_time = time.perf_counter()
+    result = central_tool_registry.call_tool_dynamic_single_sync_raw(name, tool_args)
+    return result, time.perf_counter() - start_time
 
 """
 @dataclass
@@ -173,15 +583,74 @@ class OptionDict(TypedDict):
    value: str
 """
 
+# Yield to gradio at most this often while streaming, every yield sends the whole chat over the websocket
+STREAM_YIELD_SECONDS = 0.15
+
+class StreamedCompletion:
+    """
+    Accumulate the chunks of a streamed chat completion.
+    """
+    def __init__(self):
+        self.id = None
+        self.content = ""
+        self.reasoning_content = ""
+        self.tool_calls = {}
+        self.finish_reason = None
+
+    def add_chunk(self, chunk):
+        self.id = self.id or chunk.id
+        if not chunk.choices:
+            return
+        choice = chunk.choices[0]
+        delta = choice.delta
+        self.content += delta.content or ""
+        # Not part of the OpenAI spec, but sent by llama.cpp/vLLM etc for thinking models
+        self.reasoning_content += getattr(delta, "reasoning_content", None) or ""
+        for tool_call_delta in delta.tool_calls or []:
+            tool_call = self.tool_calls.setdefault(tool_call_delta.index, { "id": None, "type": "function", "function": { "name": "", "arguments": "" } })
+            tool_call["id"] = tool_call_delta.id or tool_call["id"]
+            if tool_call_delta.function is not None:
+                tool_call["function"]["name"] += tool_call_delta.function.name or ""
+                tool_call["function"]["arguments"] += tool_call_delta.function.arguments or ""
+        self.finish_reason = choice.finish_reason or self.finish_reason
+
+    def add_completion(self, res):
+        message = res.choices[0].message
+        self.id = res.id
+        self.content = message.content or ""
+        self.reasoning_content = getattr(message, "reasoning_content", None) or ""
+        self.tool_calls = { i: x.model_dump() for i, x in enumerate(message.tool_calls or []) }
+        self.finish_reason = res.choices[0].finish_reason
+
+    def message(self):
+        data = { "role": "assistant", "content": self.content }
+        if self.reasoning_content:
+            data["reasoning_content"] = self.reasoning_content
+        if self.tool_calls:
+            data["tool_calls"] = [self.tool_calls[i] for i in sorted(self.tool_calls)]
+        return ChatCompletionMessage.model_validate(data)
+
+
 def main_call_llm(message_list):
-    res = cli.chat.completions.create(
-        model="qwen3",
+    tool_list = central_tool_registry.get_tool_list()
+    token_budget.check_conversation(message_list)
+    request_kwargs = dict(
         messages=message_list,
-        tools=central_tool_registry.get_tool_list(),
+        tools=tool_list,
         parallel_tool_calls=True,
         extra_body={ "parse_tool_calls": True }
     )
-    return res
+    completion = StreamedCompletion()
+    if llm_response_cache is not None:
+        # Cached responses are replayed in one go
+        completion.add_completion(chat_completions_create("main_chat", **request_kwargs))
+        yield completion
+        return
+    for chunk in chat_completions_create("main_chat", stream=True, **request_kwargs):
+        completion.add_chunk(chunk)
+        yield completion
+    # Also covers an empty stream
+    yield completion
 
 
 def gradio_chat_fn(message, history, conversation):
@@ -194,36 +663,59 @@ def gradio_chat_fn(message, history, conversation):
     yield ui_msg
     
     while not done:
+        # Frontend: add reasoning step, and stream into it (and into the answer once it starts)
+        reasoning_msg = { "role": "assistant", "content": "", "metadata": { "title": "", "id": str(uuid.uuid4()), "parent_id": full_msg_id } }
+        ui_msg.append(reasoning_msg)
+        answer_msg = None
+        last_yield_time = 0
         # Call LLM
-        res = main_call_llm(conversation)
-        conversation.append(res.choices[0].message)
-        if res.choices[0].finish_reason == 'tool_calls':
-            # Frontend: add reasoning step
-            ui_msg.append({ "role": "assistant", "content": res.choices[0].message.reasoning_content, "metadata": { "title": "", "id": res.id, "parent_id": full_msg_id } })
-            n_parallel_call = len(res.choices[0].message.tool_calls)
-            for tool_call in res.choices[0].message.tool_calls:
+        for completion in main_call_llm(conversation):
+            reasoning_msg["content"] = completion.reasoning_content
+            if completion.content and not completion.tool_calls:
+                if answer_msg is None:
+                    answer_msg = { "role": "assistant", "content": "" }
+                    ui_msg.append(answer_msg)
+                answer_msg["content"] = completion.content
+            if time.perf_counter() - last_yield_time >= STREAM_YIELD_SECONDS:
+                last_yield_time = time.perf_counter()
+                yield ui_msg
+        message = completion.message()
+        conversation.append(message)
+        if message.tool_calls:
+            # Any text before the tool calls is part of the thinking, not the answer
+            if answer_msg is not None:
+                ui_msg.remove(answer_msg)
+            if message.content:
+                reasoning_msg["content"] = (reasoning_msg["content"] + "\n\n" + message.content).strip()
+            tool_calls = message.tool_calls
+            ui_index = {}
+            futures = {}
+            for tool_call in tool_calls:
                 fn = tool_call.function
                 f_args = json.loads(fn.arguments)
                 f_id = tool_call.id
                 # Frontend: Add the init'ed tool call
                 display_title = central_tool_registry.get_tool_call_ui_display(fn.name, f_args)
                 ui_msg.append({ "role": "assistant", "content": "", "metadata": { "title": display_title, "status": "pending", "id": f_id, "parent_id": full_msg_id } })
+                ui_index[f_id] = len(ui_msg) - 1
+                # Backend: run the tool, all of them concurrently
+                futures[tool_call_executor.submit(timed_tool_call, fn.name, f_args)] = f_id
             yield ui_msg
-            for idx, tool_call in enumerate(res.choices[0].message.tool_calls):
-                fn = tool_call.function
-                f_args = json.loads(fn.arguments)
-                f_id = tool_call.id
-                # Backend: run the tool
-                f_ret = central_tool_registry.call_tool_dynamic_single_sync_raw(fn.name, f_args)
-                # Update the frontend display
-                ui_msg[-(n_parallel_call - idx)]["metadata"]["status"] = "done"
+            f_rets = {}
+            for future in as_completed(futures):
+                f_id = futures[future]
+                f_rets[f_id], duration = future.result()
+                # Update the frontend display, in completion order
+                ui_msg[ui_index[f_id]]["metadata"]["status"] = "done"
+                ui_msg[ui_index[f_id]]["metadata"]["duration"] = duration
                 yield ui_msg
-                # Backend: append reply to prepare next round
-                conversation.append({ "role": "tool", "tool_call_id": f_id, "content": f_ret })
+            # Backend: append replies to prepare next round, in the original tool call order
+            for tool_call in tool_calls:
+                conversation.append({ "role": "tool", "tool_call_id": tool_call.id, "content": f_rets[tool_call.id] })
         else:
             # Frontend only: final update
-            ui_msg.append({ "role": "assistant", "content": res.choices[0].message.reasoning_content, "metadata": { "title": "", "id": res.id, "parent_id": full_msg_id } })
-            ui_msg.append({ "role": "assistant", "content": res.choices[0].message.content })
+            if answer_msg is None:
+                ui_msg.append({ "role": "assistant", "content": message.content })
             yield ui_msg
             time.sleep(2)
             i = -2
@@ -251,4 +743,24 @@ demo = gr.ChatInterface(
 
 demo.launch(server_port=7861)
 
+# Shutdown report, only our logger is at INFO (httpx etc log every request at that level)
+import logging
+
+logging.basicConfig(format="%(asctime)s %(name)s %(levelname)s %(message)s")
+logger = logging.getLogger("thinking_chatbot")
+logger.setLevel(logging.INFO)
+
+logger.info(llm_router.summary())
+logger.info(llm_transport_metrics.summary())
+if llm_response_cache is not None:
+    logger.info(llm_response_cache.summary())
+logger.info(webdriver_pool.summary())
+logger.info(page_fetcher.summary())
+if SEARCH_CACHE_ENABLED:
+    logger.info(search_backend.summary())
+llm_http_client.close()
+search_backend.close()
+page_fetcher.close()
+http_event_loop.stop()
+
 
@@ -0,0 +1,141 @@
+"""
+Page fetcher for extract_webpage
+
+One pooled async HTTP client shared by all the parallel page reads, so that pages from the same site reuse keep-alive
+connections. It runs on the background event loop given to the constructor (main.py passes the one the search backends
+use), or on a loop of its own if none is given. A fetch is bounded in every dimension:
+connect/read timeouts plus an overall deadline, a per host concurrency limit, a maximum body size (the body is streamed
+and decoded incrementally, then cut), and only textual content types are accepted.
+"""
+
+import asyncio
+import codecs
+import threading
+import urllib.parse
+from dataclasses import dataclass
+
+import httpx
+
+from web_search_backends import BackgroundEventLoop
+
+FETCH_MAX_CONNECTIONS = 32
+FETCH_MAX_KEEPALIVE_CONNECTIONS = 16
+FETCH_PER_HOST_LIMIT = 4
+FETCH_TIMEOUT = httpx.Timeout(20, connect=5)
+# Overall deadline, the read timeout alone does not bound a server trickling bytes
+FETCH_DEADLINE_SECONDS = 45
+FETCH_MAX_BYTES = 2 * 1024 * 1024
+FETCH_ALLOWED_CONTENT_TYPES = ("text/html", "application/xhtml+xml", "text/plain", "text/markdown", "application/json", "application/xml", "text/xml")
+FETCH_USER_AGENT = "Mozilla/5.0 (X11; Linux x86_64; rv:128.0) Gecko/20100101 Firefox/128.0"
+
+class PageFetchError(RuntimeError):
+    pass
+
+@dataclass
+class FetchedPage:
+    url: str
+    status_code: int
+    content_type: str
+    text: str
+    truncated: bool
+
+
+class PageFetcher:
+    def __init__(self, event_loop=None, max_connections=FETCH_MAX_CONNECTIONS, per_host_limit=FETCH_PER_HOST_LIMIT, timeout=FETCH_TIMEOUT,
+                 deadline_seconds=FETCH_DEADLINE_SECONDS, max_bytes=FETCH_MAX_BYTES, allowed_content_types=FETCH_ALLOWED_CONTENT_TYPES):
+        self.event_loop = event_loop or BackgroundEventLoop()
+        self.max_connections = max_connections
+        self.per_host_limit = per_host_limit
+        self.timeout = timeout
+        self.deadline_seconds = deadline_seconds
+        self.max_bytes = max_bytes
+        self.allowed_content_types = allowed_content_types
+        self.client = None
+        # Only touched from the event loop
+        self.host_semaphores = {}
+        self.lock = threading.Lock()
+        self.n_fetches = 0
+        self.n_errors = 0
+        self.n_truncated = 0
+        self.total_bytes = 0
+
+    def get_client(self):
+        # Created (once) inside the event loop, which is then the only place it is used
+        if self.client is None:
+            self.client = httpx.AsyncClient(
+                limits=httpx.Limits(max_connections=self.max_connections, max_keepalive_connections=FETCH_MAX_KEEPALIVE_CONNECTIONS),
+                timeout=self.timeout,
+                follow_redirects=True,
+                headers={ "User-Agent": FETCH_USER_AGENT, "Accept": "text/html,application/xhtml+xml,text/plain;q=0.9,*/*;q=0.5" },
+            )
+        return self.client
+
+    def host_semaphore(self, host):
+        if host not in self.host_semaphores:
+            self.host_semaphores[host] = asyncio.Semaphore(self.per_host_limit)
+        return self.host_semaphores[host]
+
+    def check_content_type(self, url, content_type):
+        mime_type = content_type.split(";")[0].strip().lower()
+        # No header at all: let it through and let the decoder do its best
+        if mime_type and mime_type not in self.allowed_content_types:
+            raise PageFetchError(f"Unsupported content type {mime_type} for {url}, only text pages can be read")
+
+    async def read_body(self, res):
+        try:
+            decoder = codecs.getincrementaldecoder(res.charset_encoding or "utf-8")(errors="replace")
+        except LookupError:
+            # Charset unknown to Python (eg x-user-defined), best effort
+            decoder = codecs.getincrementaldecoder("utf-8")(errors="replace")
+        chunks = []
+        n_bytes = 0
+        truncated = False
+        async for chunk in res.aiter_bytes():
+            if n_bytes + len(chunk) > self.max_bytes:
+                chunk = chunk[:self.max_bytes - n_bytes]
+                truncated = True
+            n_bytes += len(chunk)
+            chunks.append(decoder.decode(chunk))
+            if truncated:
+                break
+        chunks.append(decoder.decode(b"", final=True))
+        return "".join(chunks), n_bytes, truncated
+
+    async def fetch_async(self, url):
+        parsed = urllib.parse.urlsplit(url)
+        if parsed.scheme not in ("http", "https") or not parsed.hostname:
+            raise PageFetchError(f"Not a http(s) URL: {url}")
+        async with self.host_semaphore(parsed.hostname):
+            try:
+                async with asyncio.timeout(self.deadline_seconds):
+                    async with self.get_client().stream("GET", url) as res:
+                        res.raise_for_status()
+                        content_type = res.headers.get("Content-Type", "")
+                        self.check_content_type(url, content_type)
+                        text, n_bytes, truncated = await self.read_body(res)
+            except TimeoutError as e:
+                raise PageFetchError(f"Fetching {url} took more than {self.deadline_seconds}s") from e
+            except httpx.HTTPError as e:
+                raise PageFetchError(f"Fetching {url} failed: {e}") from e
+        with self.lock:
+            self.total_bytes += n_bytes
+            if truncated:
+                self.n_truncated += 1
+        return FetchedPage(url=str(res.url), status_code=res.status_code, content_type=content_type, text=text, truncated=truncated)
+
+    def fetch(self, url):
+        with self.lock:
+            self.n_fetches += 1
+        try:
+            return self.event_loop.run(self.fetch_async(url))
+        except Exception:
+            with self.lock:
+                self.n_errors += 1
+            raise
+
+    def close(self):
+        if self.client is not None:
+            self.event_loop.run(self.client.aclose())
+
+    def summary(self):
+        return f"Page fetcher: {self.n_fetches} fetches, {self.n_errors} errors, {self.n_truncated} truncated, {self.total_bytes / 1024 / 1024:.1f} MiB read"
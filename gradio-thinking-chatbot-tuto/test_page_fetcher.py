@@ -0,0 +1,162 @@
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+import pytest
+
+from page_fetcher import PageFetcher, PageFetchError
+from web_search_backends import BackgroundEventLoop
+
+
+class StubSiteHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    lock = threading.Lock()
+    n_active = 0
+    max_active = 0
+    client_ports = set()
+
+    def log_message(self, format, *args):
+        pass
+
+    def send_body(self, body, content_type, status=200):
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        cls = type(self)
+        with cls.lock:
+            cls.client_ports.add(self.client_address[1])
+            cls.n_active += 1
+            cls.max_active = max(cls.max_active, cls.n_active)
+        try:
+            self.handle_path()
+        finally:
+            with cls.lock:
+                cls.n_active -= 1
+
+    def handle_path(self):
+        if self.path == "/article":
+            self.send_body(b"<html><body><h1>Fusion</h1><p>Plasma is hot.</p></body></html>", "text/html; charset=utf-8")
+        elif self.path == "/latin1":
+            self.send_body("<p>Café crème</p>".encode("latin-1"), "text/html; charset=iso-8859-1")
+        elif self.path == "/bogus-charset":
+            self.send_body("<p>Café</p>".encode("utf-8"), "text/html; charset=x-user-defined")
+        elif self.path == "/redirect":
+            self.send_response(302)
+            self.send_header("Location", "/article")
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+        elif self.path == "/huge":
+            # Chunked and without a length, the fetcher has to stop reading by itself
+            self.send_response(200)
+            self.send_header("Content-Type", "text/plain; charset=utf-8")
+            self.send_header("Transfer-Encoding", "chunked")
+            self.end_headers()
+            chunk = ("é" * 5000).encode("utf-8")
+            try:
+                for _ in range(200):
+                    self.wfile.write(f"{len(chunk):x}\r\n".encode("ascii") + chunk + b"\r\n")
+                self.wfile.write(b"0\r\n\r\n")
+            except (BrokenPipeError, ConnectionResetError):
+                pass
+        elif self.path == "/image":
+            self.send_body(b"\x89PNG\r\n\x1a\n", "image/png")
+        elif self.path == "/slow":
+            time.sleep(0.2)
+            self.send_body(b"<p>slow</p>", "text/html")
+        elif self.path == "/stall":
+            time.sleep(2)
+            self.send_body(b"<p>too late</p>", "text/html")
+        else:
+            self.send_body(b"Not found", "text/plain", status=404)
+
+
+@pytest.fixture
+def stub_site():
+    StubSiteHandler.n_active = 0
+    StubSiteHandler.max_active = 0
+    StubSiteHandler.client_ports = set()
+    server = ThreadingHTTPServer(("127.0.0.1", 0), StubSiteHandler)
+    server.daemon_threads = True
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield f"http://127.0.0.1:{server.server_port}"
+    server.shutdown()
+    server.server_close()
+
+
+@pytest.fixture
+def fetcher():
+    fetcher = PageFetcher(max_bytes=64 * 1024, deadline_seconds=1, per_host_limit=2)
+    yield fetcher
+    fetcher.close()
+
+
+def test_fetch_html_page(stub_site, fetcher):
+    page = fetcher.fetch(f"{stub_site}/article")
+    assert page.status_code == 200
+    assert page.content_type.startswith("text/html")
+    assert "<p>Plasma is hot.</p>" in page.text
+    assert not page.truncated
+
+
+def test_fetch_decodes_declared_charset_and_follows_redirects(stub_site, fetcher):
+    assert fetcher.fetch(f"{stub_site}/latin1").text == "<p>Café crème</p>"
+    page = fetcher.fetch(f"{stub_site}/redirect")
+    assert page.url == f"{stub_site}/article"
+    assert "Fusion" in page.text
+
+
+def test_fetch_unknown_charset_falls_back_to_utf8(stub_site, fetcher):
+    page = fetcher.fetch(f"{stub_site}/bogus-charset")
+    assert page.text == "<p>Café</p>"
+
+
+def test_fetch_truncates_large_body(stub_site, fetcher):
+    page = fetcher.fetch(f"{stub_site}/huge")
+    assert page.truncated
+    # Cut at the byte limit, a split multibyte character at the end is replaced rather than failing
+    assert 64 * 1024 // 2 <= len(page.text) <= 64 * 1024 // 2 + 1
+    assert set(page.text[:-1]) == {"é"}
+    assert fetcher.n_truncated == 1
+
+
+@pytest.mark.parametrize("path, message", [
+    ("/image", "Unsupported content type image/png"),
+    ("/missing", "404"),
+    ("/stall", "took more than 1s"),
+])
+def test_fetch_errors(stub_site, fetcher, path, message):
+    with pytest.raises(PageFetchError, match=message):
+        fetcher.fetch(f"{stub_site}{path}")
+    assert fetcher.n_errors == 1
+
+
+def test_fetch_rejects_non_http_urls(fetcher):
+    with pytest.raises(PageFetchError):
+        fetcher.fetch("file:///etc/passwd")
+
+
+def test_per_host_limit_and_connection_reuse(stub_site, fetcher):
+    with ThreadPoolExecutor(max_workers=8) as executor:
+        pages = list(executor.map(lambda _: fetcher.fetch(f"{stub_site}/slow"), range(8)))
+    assert all(page.text == "<p>slow</p>" for page in pages)
+    assert StubSiteHandler.max_active == 2
+    # Requests queued behind the host limit go over the connections already opened
+    assert len(StubSiteHandler.client_ports) <= 2
+
+
+def test_fetch_runs_on_the_given_event_loop(stub_site):
+    event_loop = BackgroundEventLoop()
+    fetcher = PageFetcher(event_loop=event_loop)
+    try:
+        assert fetcher.fetch(f"{stub_site}/article").status_code == 200
+        # No loop of its own, the client lives on the shared one
+        assert fetcher.event_loop is event_loop
+    finally:
+        fetcher.close()
+        event_loop.stop()
@@ -0,0 +1,285 @@
+import json
+import threading
+import time
+import urllib.parse
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+import pytest
+
+from web_search_backends import SearxngJsonBackend, SeleniumSearxngBackend, FallbackSearchBackend, CachedSearchBackend, WebDriverPool, SearchBackendError, format_search_results
+
+
+class StubSearxngHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    json_enabled = True
+    requests = []
+    client_ports = set()
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_GET(self):
+        parsed = urllib.parse.urlparse(self.path)
+        params = dict(urllib.parse.parse_qsl(parsed.query))
+        type(self).requests.append(params)
+        type(self).client_ports.add(self.client_address[1])
+        if parsed.path != "/search" or params.get("format") != "json" or not self.json_enabled:
+            body = b"Forbidden"
+            self.send_response(403)
+            self.send_header("Content-Type", "text/plain")
+        else:
+            body = json.dumps({
+                "query": params["q"],
+                "results": [
+                    { "title": f"Result {i} for {params['q']}", "url": f"https://example.com/{i}", "content": f"Snippet {i}", "engine": "brave" }
+                    for i in range(3)
+                ],
+                "unresponsive_engines": [],
+            }).encode("utf-8")
+            self.send_response(200)
+            self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+@pytest.fixture
+def stub_searxng():
+    StubSearxngHandler.json_enabled = True
+    StubSearxngHandler.requests = []
+    StubSearxngHandler.client_ports = set()
+    server = ThreadingHTTPServer(("127.0.0.1", 0), StubSearxngHandler)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield f"http://127.0.0.1:{server.server_port}"
+    server.shutdown()
+    server.server_close()
+
+
+class StubBackend:
+    name = "stub"
+
+    def __init__(self):
+        self.queries = []
+
+    def search(self, query, language="en", time_range="year"):
+        self.queries.append(query)
+        return [{ "title": "From fallback", "url": "https://fallback.example.com", "content": "" }]
+
+    def close(self):
+        pass
+
+
+def test_json_backend_queries_searxng_json_api(stub_searxng):
+    backend = SearxngJsonBackend(stub_searxng)
+    try:
+        results = backend.search("!br fusion power", language="en", time_range="month")
+    finally:
+        backend.close()
+    assert [x["url"] for x in results] == ["https://example.com/0", "https://example.com/1", "https://example.com/2"]
+    assert StubSearxngHandler.requests[0]["q"] == "!br fusion power"
+    assert StubSearxngHandler.requests[0]["time_range"] == "month"
+    formatted = format_search_results(results)
+    assert "### [Result 0 for !br fusion power](https://example.com/0)\n\nSnippet 0" in formatted
+
+
+def test_json_backend_reuses_pooled_connections(stub_searxng):
+    backend = SearxngJsonBackend(stub_searxng)
+    try:
+        for i in range(5):
+            backend.search(f"query {i}")
+    finally:
+        backend.close()
+    assert len(StubSearxngHandler.requests) == 5
+    # Sequential searches go over the same keep-alive connection
+    assert len(StubSearxngHandler.client_ports) == 1
+
+
+def test_json_backend_concurrent_searches_from_threads(stub_searxng):
+    backend = SearxngJsonBackend(stub_searxng)
+    results = {}
+    def worker(i):
+        results[i] = backend.search(f"query {i}")
+    threads = [threading.Thread(target=worker, args=(i,)) for i in range(8)]
+    try:
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+    finally:
+        backend.close()
+    assert sorted(results) == list(range(8))
+    assert all(results[i][0]["title"] == f"Result 0 for query {i}" for i in range(8))
+
+
+def test_fallback_when_json_format_disabled(stub_searxng):
+    StubSearxngHandler.json_enabled = False
+    fallback = StubBackend()
+    backend = FallbackSearchBackend([SearxngJsonBackend(stub_searxng), fallback])
+    try:
+        results = backend.search("fusion")
+    finally:
+        backend.close()
+    assert results[0]["title"] == "From fallback"
+    assert fallback.queries == ["fusion"]
+
+
+def test_all_backends_failing_raises(stub_searxng):
+    StubSearxngHandler.json_enabled = False
+    backend = FallbackSearchBackend([SearxngJsonBackend(stub_searxng)])
+    try:
+        with pytest.raises(SearchBackendError):
+            backend.search("fusion")
+    finally:
+        backend.close()
+
+
+SEARXNG_RESULT_PAGE = """
+<html><body>
+<article class="result"><h3><a href="https://example.com/a">First result</a></h3><p class="content">First snippet</p></article>
+<article class="result"><h3><a href="https://example.com/b">Second result</a></h3></article>
+</body></html>
+"""
+
+class FakeDriver:
+    def __init__(self, fail_on_get=False):
+        self.fail_on_get = fail_on_get
+        self.urls = []
+        self.quit_called = False
+        self.page_source = SEARXNG_RESULT_PAGE
+
+    def get(self, url):
+        if self.fail_on_get:
+            raise RuntimeError("browser crashed")
+        self.urls.append(url)
+
+    def quit(self):
+        self.quit_called = True
+
+
+def test_webdriver_pool_starts_browsers_lazily_and_reuses_them():
+    drivers = []
+    def factory():
+        drivers.append(FakeDriver())
+        return drivers[-1]
+    pool = WebDriverPool(driver_factory=factory, size=2)
+    assert drivers == []
+    backend = SeleniumSearxngBackend("http://searxng.local", driver_pool=pool)
+    for _ in range(3):
+        results = backend.search("fusion power")
+    assert results == [
+        { "title": "First result", "url": "https://example.com/a", "content": "First snippet" },
+        { "title": "Second result", "url": "https://example.com/b", "content": "" },
+    ]
+    assert len(drivers) == 1
+    assert drivers[0].urls[0].startswith("http://searxng.local/search?q=fusion%20power&")
+    backend.close()
+    assert drivers[0].quit_called
+
+
+def test_webdriver_pool_recycles_after_max_uses_and_on_crash():
+    drivers = []
+    def factory():
+        drivers.append(FakeDriver(fail_on_get=len(drivers) == 1))
+        return drivers[-1]
+    pool = WebDriverPool(driver_factory=factory, size=1, max_uses=2)
+    backend = SeleniumSearxngBackend("http://searxng.local", driver_pool=pool)
+    backend.search("a")
+    backend.search("b")
+    # Used twice, so the first browser was recycled and the next search starts a new one, which crashes
+    assert drivers[0].quit_called
+    with pytest.raises(RuntimeError):
+        backend.search("c")
+    assert drivers[1].quit_called
+    backend.search("d")
+    assert len(drivers) == 3 and not drivers[2].quit_called
+    assert pool.n_started == 3 and pool.n_recycled == 2
+
+
+def test_webdriver_pool_checkout_times_out_when_exhausted():
+    pool = WebDriverPool(driver_factory=FakeDriver, size=1, checkout_timeout=0.1)
+    with pool.driver():
+        with pytest.raises(SearchBackendError):
+            with pool.driver():
+                pass
+    with pool.driver() as driver:
+        assert isinstance(driver, FakeDriver)
+
+
+def test_webdriver_pool_concurrent_checkouts_bounded_by_size():
+    active = []
+    max_active = []
+    lock = threading.Lock()
+    pool = WebDriverPool(driver_factory=FakeDriver, size=3)
+    def worker():
+        with pool.driver():
+            with lock:
+                active.append(1)
+                max_active.append(len(active))
+            time.sleep(0.05)
+            with lock:
+                active.pop()
+    threads = [threading.Thread(target=worker) for _ in range(9)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert max(max_active) == 3
+    assert pool.n_started == 3 and pool.n_checkouts == 9
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 1_000_000.0
+
+    def __call__(self):
+        return self.now
+
+
+def test_search_cache_memory_and_disk_tiers(tmp_path):
+    clock = FakeClock()
+    inner = StubBackend()
+    backend = CachedSearchBackend(inner, cache_dir=str(tmp_path), clock=clock)
+    first = backend.search("Fusion  Power", time_range="month")
+    # Normalized query hits the memory tier
+    assert backend.search("  fusion power ", time_range="month") == first
+    assert inner.queries == ["Fusion  Power"]
+    # Different time range or language is a different entry
+    backend.search("fusion power", time_range="week")
+    backend.search("fusion power", language="fr", time_range="month")
+    assert len(inner.queries) == 3
+    # A new instance (restart) reads from disk
+    restarted = CachedSearchBackend(inner, cache_dir=str(tmp_path), clock=clock)
+    assert restarted.search("fusion power", time_range="month") == first
+    assert len(inner.queries) == 3
+    assert (restarted.n_disk_hits, restarted.n_misses) == (1, 0)
+    assert (backend.n_memory_hits, backend.n_misses) == (1, 3)
+
+
+def test_search_cache_ttl_depends_on_time_range(tmp_path):
+    clock = FakeClock()
+    inner = StubBackend()
+    backend = CachedSearchBackend(inner, cache_dir=str(tmp_path), clock=clock)
+    backend.search("fusion", time_range="day")
+    backend.search("fusion", time_range="year")
+    clock.now += 2 * 3600
+    backend.search("fusion", time_range="day")
+    backend.search("fusion", time_range="year")
+    assert len(inner.queries) == 3
+    assert backend.n_expired == 1
+    clock.now += 4 * 24 * 3600
+    CachedSearchBackend(inner, cache_dir=str(tmp_path), clock=clock).search("fusion", time_range="year")
+    assert len(inner.queries) == 4
+
+
+def test_search_cache_skips_empty_results(tmp_path):
+    class EmptyBackend(StubBackend):
+        def search(self, query, language="en", time_range="year"):
+            self.queries.append(query)
+            return []
+    inner = EmptyBackend()
+    backend = CachedSearchBackend(inner, cache_dir=str(tmp_path))
+    backend.search("nothing")
+    backend.search("nothing")
+    assert len(inner.queries) == 2
+    assert list(tmp_path.glob("*/*.json")) == []
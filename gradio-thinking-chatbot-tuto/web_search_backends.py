@@ -0,0 +1,365 @@
+"""
+Web search backends
+
+The SearXNG JSON API is queried directly over a pooled async HTTP client (on a background event loop, so that the
+sync tool functions can use it from any thread), which costs milliseconds instead of a browser page load.
+Many public SearXNG instances disable the JSON format, so the Selenium path that loads and parses the HTML page is kept as a fallback,
+with a lazily started pool of headless browsers.
+"""
+
+import asyncio
+import contextlib
+import hashlib
+import json
+import os
+import queue
+import tempfile
+import threading
+import time
+import urllib.parse
+from collections import OrderedDict
+from pathlib import Path
+
+import httpx
+from bs4 import BeautifulSoup
+from markdownify import markdownify as md
+
+try:
+    from selenium import webdriver
+except ImportError:
+    webdriver = None
+
+SEARCH_HTTP_MAX_CONNECTIONS = 20
+SEARCH_HTTP_MAX_KEEPALIVE_CONNECTIONS = 10
+SEARCH_HTTP_TIMEOUT = httpx.Timeout(15, connect=5)
+SEARCH_MAX_RESULTS = 10
+WEBDRIVER_POOL_SIZE = 4
+WEBDRIVER_MAX_USES = 50
+WEBDRIVER_CHECKOUT_TIMEOUT = 60
+WEBDRIVER_PAGE_LOAD_TIMEOUT = 30
+SEARCH_CACHE_MEMORY_ENTRIES = 1000
+# Fresher results are wanted for a narrower time range
+SEARCH_CACHE_TTL_SECONDS = { "day": 3600, "week": 6 * 3600, "month": 24 * 3600, "year": 3 * 24 * 3600 }
+SEARCH_CACHE_DEFAULT_TTL_SECONDS = 7 * 24 * 3600
+
+class SearchBackendError(RuntimeError):
+    pass
+
+def format_search_results(results):
+    # Same shape for all backends: one markdown block per result
+    blocks = []
+    for result in results:
+        block = f"### [{result['title']}]({result['url']})"
+        if result.get("content"):
+            block += f"\n\n{result['content']}"
+        blocks.append(block)
+    return "\n\n\n".join(blocks)
+
+
+class BackgroundEventLoop:
+    """
+    An asyncio loop running forever in a daemon thread. Coroutines are submitted from sync code and waited on.
+    """
+    def __init__(self):
+        self.loop = asyncio.new_event_loop()
+        self.thread = threading.Thread(target=self.loop.run_forever, name="http-event-loop", daemon=True)
+        self.thread.start()
+
+    def run(self, coro, timeout=None):
+        return asyncio.run_coroutine_threadsafe(coro, self.loop).result(timeout)
+
+    def stop(self):
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self.thread.join()
+
+
+class SearxngJsonBackend:
+    name = "searxng-json"
+
+    def __init__(self, base_url, event_loop=None, max_results=SEARCH_MAX_RESULTS):
+        self.base_url = base_url.rstrip("/")
+        self.event_loop = event_loop or BackgroundEventLoop()
+        self.max_results = max_results
+        self.client = None
+
+    def get_client(self):
+        # Created (once) inside the event loop, which is then the only place it is used
+        if self.client is None:
+            self.client = httpx.AsyncClient(
+                limits=httpx.Limits(max_connections=SEARCH_HTTP_MAX_CONNECTIONS, max_keepalive_connections=SEARCH_HTTP_MAX_KEEPALIVE_CONNECTIONS),
+                timeout=SEARCH_HTTP_TIMEOUT,
+                headers={ "Accept": "application/json" },
+            )
+        return self.client
+
+    async def search_async(self, query, language="en", time_range="year"):
+        params = { "q": query, "format": "json", "language": language, "time_range": time_range, "safesearch": 0, "pageno": 1 }
+        try:
+            res = await self.get_client().get(f"{self.base_url}/search", params=params)
+            res.raise_for_status()
+            data = res.json()
+        except (httpx.HTTPError, ValueError) as e:
+            raise SearchBackendError(f"SearXNG JSON search failed: {e}") from e
+        results = data.get("results", [])
+        if not results and data.get("unresponsive_engines"):
+            raise SearchBackendError(f"SearXNG engines unresponsive: {data['unresponsive_engines']}")
+        return [{ "title": x.get("title", ""), "url": x.get("url", ""), "content": x.get("content", "") } for x in results[:self.max_results]]
+
+    def search(self, query, language="en", time_range="year"):
+        return self.event_loop.run(self.search_async(query, language, time_range))
+
+    def close(self):
+        if self.client is not None:
+            self.event_loop.run(self.client.aclose())
+
+
+def create_headless_firefox():
+    options = webdriver.FirefoxOptions()
+    options.add_argument("-headless")
+    driver = webdriver.Firefox(options=options)
+    driver.set_page_load_timeout(WEBDRIVER_PAGE_LOAD_TIMEOUT)
+    return driver
+
+
+class PooledDriver:
+    def __init__(self, driver):
+        self.driver = driver
+        self.n_uses = 0
+
+
+class WebDriverPool:
+    """
+    Pool of browsers (a WebDriver is not thread safe, so each one serves a single search at a time).
+    Browsers are started lazily on checkout, up to `size` of them, and are recycled after `max_uses` searches
+    or when a search using them raised (the browser may have crashed). Checkout waits at most `checkout_timeout` seconds.
+    """
+    def __init__(self, driver_factory=None, size=WEBDRIVER_POOL_SIZE, max_uses=WEBDRIVER_MAX_USES, checkout_timeout=WEBDRIVER_CHECKOUT_TIMEOUT):
+        self.driver_factory = driver_factory or create_headless_firefox
+        self.max_uses = max_uses
+        self.checkout_timeout = checkout_timeout
+        # One slot per browser, None means the browser is not started yet (or was recycled)
+        self.slots = queue.LifoQueue()
+        for _ in range(size):
+            self.slots.put(None)
+        self.lock = threading.Lock()
+        self.closed = False
+        self.n_started = 0
+        self.n_recycled = 0
+        self.n_checkouts = 0
+        self.total_wait_seconds = 0.0
+
+    def quit_driver(self, pooled):
+        try:
+            pooled.driver.quit()
+        except Exception as e:
+            print(f"Error quitting browser: {e}")
+
+    def checkout(self):
+        start_time = time.perf_counter()
+        try:
+            pooled = self.slots.get(timeout=self.checkout_timeout)
+        except queue.Empty:
+            raise SearchBackendError(f"No browser available after {self.checkout_timeout}s")
+        with self.lock:
+            self.n_checkouts += 1
+            self.total_wait_seconds += time.perf_counter() - start_time
+        if pooled is None:
+            try:
+                pooled = PooledDriver(self.driver_factory())
+            except Exception:
+                self.slots.put(None)
+                raise
+            with self.lock:
+                self.n_started += 1
+        return pooled
+
+    def checkin(self, pooled, healthy=True):
+        pooled.n_uses += 1
+        if self.closed or not healthy or pooled.n_uses >= self.max_uses:
+            self.quit_driver(pooled)
+            with self.lock:
+                self.n_recycled += 1
+            pooled = None
+        self.slots.put(pooled)
+
+    @contextlib.contextmanager
+    def driver(self):
+        pooled = self.checkout()
+        try:
+            yield pooled.driver
+        except Exception:
+            self.checkin(pooled, healthy=False)
+            raise
+        self.checkin(pooled)
+
+    def close(self):
+        # Browsers checked out right now are quit when they are returned
+        self.closed = True
+        while True:
+            try:
+                pooled = self.slots.get_nowait()
+            except queue.Empty:
+                break
+            if pooled is not None:
+                self.quit_driver(pooled)
+
+    def summary(self):
+        avg_wait = self.total_wait_seconds / self.n_checkouts if self.n_checkouts else 0.0
+        return f"WebDriver pool: {self.n_checkouts} checkouts (avg wait {avg_wait:.2f}s), {self.n_started} browsers started, {self.n_recycled} recycled"
+
+
+class SeleniumSearxngBackend:
+    name = "searxng-selenium"
+
+    def __init__(self, base_url, driver_pool=None, max_results=SEARCH_MAX_RESULTS):
+        self.base_url = base_url.rstrip("/")
+        self.driver_pool = driver_pool or WebDriverPool()
+        self.max_results = max_results
+
+    def search(self, query, language="en", time_range="year"):
+        q_escaped = urllib.parse.quote(query, safe='')
+        with self.driver_pool.driver() as driver:
+            driver.get(f"{self.base_url}/search?q={q_escaped}&language={language}&time_range={time_range}&safesearch=0&pageno=1&categories=none")
+            html = driver.page_source
+        dom = BeautifulSoup(html, 'html.parser')
+        results = []
+        for entry in dom.find_all("article", {"class": "result"})[:self.max_results]:
+            link = entry.select_one("h3 a") or entry.find("a", href=True)
+            content = entry.select_one("p.content")
+            if link is None:
+                results.append({ "title": "", "url": "", "content": md(str(entry), strip=['img', 'svg']) })
+                continue
+            results.append({ "title": link.get_text(" ", strip=True), "url": link.get("href", ""), "content": content.get_text(" ", strip=True) if content else "" })
+        return results
+
+    def close(self):
+        self.driver_pool.close()
+
+
+class FallbackSearchBackend:
+    """
+    Try the backends in order, moving on to the next one when a backend fails.
+    """
+    name = "fallback"
+
+    def __init__(self, backends):
+        self.backends = backends
+
+    def search(self, query, language="en", time_range="year"):
+        errors = []
+        for backend in self.backends:
+            try:
+                return backend.search(query, language, time_range)
+            except Exception as e:
+                errors.append(f"{backend.name}: {e}")
+        raise SearchBackendError("All search backends failed. " + " | ".join(errors))
+
+    def close(self):
+        for backend in self.backends:
+            backend.close()
+
+
+class CachedSearchBackend:
+    """
+    Two tier cache in front of a search backend: an in-memory LRU, then json files on disk (shared across restarts).
+    Keyed on the normalized (query, language, time_range), entries expire after a TTL depending on the time range.
+    Empty results are not cached.
+    """
+    def __init__(self, backend, cache_dir, memory_entries=SEARCH_CACHE_MEMORY_ENTRIES, clock=time.time):
+        self.backend = backend
+        self.name = f"cached-{backend.name}"
+        self.cache_dir = cache_dir
+        self.memory_entries = memory_entries
+        self.clock = clock
+        self.memory = OrderedDict()
+        self.lock = threading.Lock()
+        self.n_memory_hits = 0
+        self.n_disk_hits = 0
+        self.n_misses = 0
+        self.n_expired = 0
+        Path(cache_dir).mkdir(parents=True, exist_ok=True)
+
+    @staticmethod
+    def normalize_query(query):
+        return " ".join(query.lower().split())
+
+    @staticmethod
+    def ttl_seconds(time_range):
+        return SEARCH_CACHE_TTL_SECONDS.get(time_range, SEARCH_CACHE_DEFAULT_TTL_SECONDS)
+
+    def request_key(self, query, language, time_range):
+        canonical = json.dumps([self.normalize_query(query), language, time_range], ensure_ascii=False)
+        return hashlib.sha256(canonical.encode("utf-8")).hexdigest()
+
+    def entry_path(self, key):
+        return os.path.join(self.cache_dir, key[:2], f"{key}.json")
+
+    def get_memory(self, key, expires_before):
+        with self.lock:
+            entry = self.memory.get(key)
+            if entry is None:
+                return None
+            created_at, results = entry
+            if created_at <= expires_before:
+                # Counted as expired by the disk tier, which has the same entry
+                del self.memory[key]
+                return None
+            self.memory.move_to_end(key)
+            self.n_memory_hits += 1
+            return results
+
+    def put_memory(self, key, created_at, results):
+        with self.lock:
+            self.memory[key] = (created_at, results)
+            self.memory.move_to_end(key)
+            while len(self.memory) > self.memory_entries:
+                self.memory.popitem(last=False)
+
+    def get_disk(self, key, expires_before):
+        path = self.entry_path(key)
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                entry = json.load(f)
+        except (FileNotFoundError, ValueError):
+            return None
+        if entry["created_at"] <= expires_before:
+            Path(path).unlink(missing_ok=True)
+            with self.lock:
+                self.n_expired += 1
+            return None
+        with self.lock:
+            self.n_disk_hits += 1
+        self.put_memory(key, entry["created_at"], entry["results"])
+        return entry["results"]
+
+    def put_disk(self, key, entry):
+        path = self.entry_path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with tempfile.NamedTemporaryFile(mode="w", encoding="utf-8", dir=os.path.dirname(path), delete=False) as tmp_file:
+            json.dump(entry, tmp_file, ensure_ascii=False)
+        os.replace(tmp_file.name, path)
+
+    def search(self, query, language="en", time_range="year"):
+        key = self.request_key(query, language, time_range)
+        now = self.clock()
+        expires_before = now - self.ttl_seconds(time_range)
+        results = self.get_memory(key, expires_before)
+        if results is None:
+            results = self.get_disk(key, expires_before)
+        if results is not None:
+            return results
+        with self.lock:
+            self.n_misses += 1
+        results = self.backend.search(query, language, time_range)
+        if results:
+            self.put_memory(key, now, results)
+            self.put_disk(key, { "query": query, "language": language, "time_range": time_range, "created_at": now, "results": results })
+        return results
+
+    def close(self):
+        self.backend.close()
+
+    def summary(self):
+        n_lookups = self.n_memory_hits + self.n_disk_hits + self.n_misses
+        hit_rate = (self.n_memory_hits + self.n_disk_hits) / n_lookups if n_lookups else 0.0
+        return f"Search cache: {self.n_memory_hits} memory hits, {self.n_disk_hits} disk hits, {self.n_misses} misses ({hit_rate:.0%} hit rate), {self.n_expired} expired, in {self.cache_dir}"